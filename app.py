@@ -3,6 +3,7 @@ import dash
 import dash_bootstrap_components as dbc
 
 from components.navbar import navbar
+from components.result_cache import cache_statistics
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
@@ -19,5 +20,11 @@ app.layout = html.Div([
 ])
 
 
+@server.route('/cache-stats')
+def cache_stats():
+    """Hit/miss counters of the strategy result cache"""
+    return cache_statistics()
+
+
 if __name__ == '__main__':
     app.run(debug=True)
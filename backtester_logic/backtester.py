@@ -1,6 +1,7 @@
 from momentum_strategy import QuantitativeMomentum
-from utils import _int_to_datetime, _datetime_to_int, _ticker_to_table_name
-from dateutil.relativedelta import relativedelta
+from strategy import Strategy, SLIPPAGE_FACTOR
+import profiling
+from panel import Panel, load_panel
 from tqdm import tqdm
 import sqlite3
 import pandas as pd
@@ -23,68 +24,205 @@ class Backtester():
     - Equity Time Series  
     """
 
-    def __init__(self, database: str) -> None:
+    def __init__(self, database: str, panel: Panel = None, dtype=np.float64, chunk_rows: int = None) -> None:
+        """
+        Parameters
+        ----------
+        database : (str) path to the stock database
+        panel : (Panel) optional preloaded panel with Open and Close for the strategy's tickers
+        dtype : np.float64 or panel.COMPACT_DTYPE, the type prices are held in (see self.backtest)
+        chunk_rows : (int) hold only this many dates of prices in memory at a time (see panel.ChunkedPanel)
+        """
 
         self.connector = sqlite3.connect(database)
         self.cursor = self.connector.cursor()
+        self.dtype = dtype
+        self.chunk_rows = chunk_rows
 
-    def backtest(self, strategy: QuantitativeMomentum, rebalance_period: int = 3, starting_capital: int = 100_000, start_date: int = 19710104, end_date: int = 20230803) -> pd.DataFrame:
-        """Runs the backtesting algorithm
-            - Will have to loop through all equities and generate signals
-            - Will have to deploy optimal amount of capital to each ticker 
+        # dates x tickers Open/Close arrays, loaded once and shared across backtests
+        self._price_panel = panel
+        self._price_panel_tickers = None if panel is None else tuple(
+            panel.tickers)
 
-        TODO: Make timeseries with pandas and/or numpy 
-        TODO: Add statistics calculations in
+    @profiling.profiled('backtest')
+    def backtest(self, strategy: Strategy, rebalance_period: int = None, starting_capital: int = 100_000, start_date: int = 19710104, end_date: int = 20230803, progress_callback=None) -> pd.DataFrame:
+        """Runs the backtesting algorithm
+            - Asks the strategy for its target weights on every rebalance date in one call
+            - Lets the strategy adjust each period's weights to the capital (see Strategy.allocate)
+            - Deploys the weighted capital into whole shares of each ticker 
+
+        Positions are valued from an in-memory dates x tickers Close panel
+        (see self.price_panel) rather than one query per holding per day, a holding that stops
+        trading keeps the value of its last close. Rebalance rows come from
+        the panel's TradingCalendar, seasonal when strategy.seasonality is set.
+
+        Arithmetic is float64 whatever the panel's dtype. With float32 prices (each within
+        panel.FLOAT32_TOLERANCE of float64) the equity curve stays within 1e-6 (relative) of the
+        float64 backtest while the same portfolios are held. It departs further once a screen
+        breaks a tie differently (two momentum or FIP values closer than float32 resolution) or a
+        share count rounds the other way.
+
+        rebalance_period : (int) months between rebalances, defaults to strategy.rebalance_period
+        progress_callback : callable(days_done, total_days) called after every holding period,
+                            an exception raised by it aborts the backtest
         """
 
-        query = f"""SELECT Date FROM {_ticker_to_table_name("GE.US")} 
-        WHERE Date BETWEEN {start_date} AND {end_date}"""
-
-        equity_timeseries = pd.read_sql_query(query, con=self.connector)
-
-        equity_timeseries['Equity'] = 0
-
-        rebalance_date = _datetime_to_int(
-            _int_to_datetime(start_date) + relativedelta(months=rebalance_period))
-
-        current_portfolio, capital_invested, cash_remaining = strategy.portfolio_construction(
-            starting_capital, start_date)
-
-        def _calculate_equity(date, capital_invested, portfolio):
-
-            unrealized_change = 0
-            for ticker, shares_purcahsed, cost in portfolio:
-                query = f'''
-                    SELECT
-                    Close 
-                    FROM {_ticker_to_table_name(ticker)}
-                    WHERE Date = {date}
-                '''
-                return_value = self.cursor.execute(query).fetchone()
-                current_price = cost if return_value is None else return_value[0]
-                unrealized_change += (current_price - cost) * shares_purcahsed
-
-            return capital_invested + unrealized_change
-
-        # Full backtest
-        for current_date in tqdm(equity_timeseries['Date']):
-
-            # Collecting equity changes
-            unrealized_equity = _calculate_equity(
-                current_date, capital_invested, current_portfolio)
-
-            equity_timeseries.loc[equity_timeseries['Date'] ==
-                                  current_date, 'Equity'] = unrealized_equity + cash_remaining
-
-            if current_date >= rebalance_date:
-                # on the rebalance date, portfolio is fully sold at the close
-                # Ater the close calculate the new portfolio and buy it at the open
-                current_portfolio, capital_invested, cash_remaining = strategy.portfolio_construction(
-                    current_capital=unrealized_equity + cash_remaining,
-                    date=current_date
-                )
+        if rebalance_period is None:
+            rebalance_period = strategy.rebalance_period
+
+        dates, equity = self._run(
+            strategy=strategy,
+            rebalance_periods=[rebalance_period],
+            target_weights=lambda variant, rebalance_dates: strategy.target_weights(
+                rebalance_dates),
+            allocate=lambda variant, rebalance_date, weights, capital: strategy.allocate(
+                rebalance_date, weights, capital),
+            starting_capital=starting_capital,
+            start_date=start_date,
+            end_date=end_date,
+            progress_callback=progress_callback
+        )
+
+        return pd.DataFrame({'Date': dates, 'Equity': equity[0]})
+
+    @profiling.profiled('backtest_variants')
+    def backtest_variants(self, strategy: QuantitativeMomentum, rebalance_periods: tuple[int, ...] = (1, 3, 6, 12), firms_held: tuple[int, ...] = (25, 50, 100, 200), starting_capital: int = 100_000, start_date: int = 19710104, end_date: int = 20230803) -> dict[tuple[int, int], pd.DataFrame]:
+        """Backtests every rebalance_period x firms_held variant of one (look_back, lottery_window) strategy 
+
+        The momentum screen and FIP ranking are computed once per rebalance date (see 
+        QuantitativeMomentum.target_weights) and every variant trading on that date slices its 
+        portfolio out of the same ranking.
+
+        Returns
+        --------
+        equity_timeseries : dict mapping (rebalance_period, firms_held) -> equity DataFrame, as returned by self.backtest
+        """
 
-                rebalance_date = _datetime_to_int(
-                    _int_to_datetime(current_date) + relativedelta(months=rebalance_period))
+        variants = [(rebalance_period, firms) for rebalance_period in rebalance_periods
+                    for firms in firms_held]
+
+        dates, equity = self._run(
+            strategy=strategy,
+            rebalance_periods=[rebalance_period for rebalance_period, _ in variants],
+            target_weights=lambda variant, rebalance_dates: strategy.target_weights(
+                rebalance_dates, firms_held=variants[variant][1]),
+            allocate=lambda variant, rebalance_date, weights, capital: strategy.allocate(
+                rebalance_date, weights, capital, firms_held=variants[variant][1]),
+            starting_capital=starting_capital,
+            start_date=start_date,
+            end_date=end_date
+        )
+
+        return {variant: pd.DataFrame({'Date': dates, 'Equity': equity[number]})
+                for number, variant in enumerate(variants)}
+
+    def _run(self, strategy: Strategy, rebalance_periods: list[int], target_weights, allocate, starting_capital: int, start_date: int, end_date: int, progress_callback=None) -> tuple[np.ndarray, np.ndarray]:
+        """Simulates one portfolio per rebalance period
+
+        Parameters
+        ----------
+        rebalance_periods : list[int] in months, one per simulated portfolio
+        target_weights : callable(variant, rebalance_dates) returning the len(rebalance_dates) x tickers weights of a variant
+        allocate : callable(variant, rebalance_date, weights, capital) returning the weights held for one
+                   row of target_weights once the capital is known (see Strategy.allocate)
+        progress_callback : callable(days_done, total_days) called after every holding period, totals count every variant
+
+        Returns
+        --------
+        dates : np.ndarray of the trading days between start_date and end_date
+        equity : np.ndarray of shape len(rebalance_periods) x len(dates)
+        """
 
-        return equity_timeseries
+        price_panel = self.price_panel(strategy.tickers['Ticker'])
+        calendar = price_panel.calendar()
+
+        # Rows of the panel between start_date and end_date
+        start_row = calendar.position(start_date)
+        end_row = calendar.position(end_date, side='right')
+        dates = calendar.dates[start_row:end_row]
+
+        num_of_variants = len(rebalance_periods)
+        equity = np.zeros((num_of_variants, len(dates)))
+
+        progress = tqdm(total=num_of_variants * len(dates))
+
+        for variant, rebalance_period in enumerate(rebalance_periods):
+            # Precomputed panel rows, shared by every variant and backtest with the same schedule
+            schedule = calendar.rebalance_rows(
+                start_date, rebalance_period, strategy.seasonality, end_date)
+
+            # The first portfolio is chosen on start_date, the next ones after the close of each rebalance row
+            rebalance_dates = [start_date] + calendar.dates[schedule].tolist()
+            with profiling.timer('target_weights'):
+                weights = target_weights(variant, rebalance_dates)
+            profiling.count('rebalances', len(rebalance_dates))
+
+            # Shares are bought at the open of the trading day after each rebalance date
+            open_rows = np.concatenate(([start_row], schedule)) + 1
+            rebalance_rows = schedule - start_row
+            period_starts = np.concatenate(([0], rebalance_rows + 1))
+            period_ends = np.append(rebalance_rows, len(dates) - 1)
+
+            with profiling.timer('valuation'):
+                current_capital = starting_capital
+                for period, (first_row, last_row) in enumerate(zip(period_starts, period_ends)):
+                    held_weights = allocate(
+                        variant, rebalance_dates[period], weights[period], current_capital)
+                    columns = np.flatnonzero(held_weights)
+                    capital_available = held_weights[columns] * current_capital
+
+                    if open_rows[period] < len(price_panel.dates):
+                        cost = SLIPPAGE_FACTOR * np.asarray(price_panel.rows(
+                            'Open', open_rows[period], open_rows[period] + 1)[0, columns], dtype=np.float64)
+                    else:
+                        cost = np.full(len(columns), np.nan)
+
+                    # Whole shares only, tickers without an open or too expensive for their weight stay in cash
+                    shares_purchased = np.zeros(len(columns))
+                    buyable = cost > 0
+                    shares_purchased[buyable] = np.floor(
+                        capital_available[buyable] / cost[buyable])
+
+                    capital_invested = shares_purchased[buyable] @ cost[buyable]
+                    cash_left = current_capital - capital_invested
+                    if cash_left < 0:
+                        raise Exception("Invested over max capital available")
+
+                    # Value the portfolio on every day of the holding period at once
+                    current_prices = np.asarray(price_panel.rows(
+                        'Close', start_row + first_row, start_row + last_row + 1)[:, columns], dtype=np.float64)
+                    # A ticker without a trade that day (halted, delisted) is valued at its last close
+                    # of the period, at cost until it first trades
+                    traded = price_panel.valid(
+                        start_row + first_row, start_row + last_row + 1)[:, columns]
+                    last_traded = np.maximum.accumulate(np.where(
+                        traded, np.arange(len(traded))[:, None], -1), axis=0)
+                    current_prices = np.where(last_traded >= 0, np.take_along_axis(
+                        current_prices, np.maximum(last_traded, 0), axis=0), cost)
+                    unrealized_change = np.where(
+                        buyable, current_prices - cost, 0) @ shares_purchased
+
+                    equity[variant, first_row:last_row + 1] = capital_invested + \
+                        unrealized_change + cash_left
+
+                    # on the rebalance date, portfolio is fully sold at the close
+                    current_capital = equity[variant, last_row]
+
+                    progress.update(last_row + 1 - first_row)
+                    if progress_callback is not None:
+                        progress_callback(int(progress.n), progress.total)
+
+        progress.close()
+
+        return dates, equity
+
+    def price_panel(self, tickers) -> Panel:
+        """Returns the Open/Close panel for tickers, reading the database only the first time"""
+
+        tickers = tuple(tickers)
+        if self._price_panel is None or self._price_panel_tickers != tickers:
+            self._price_panel = load_panel(
+                self.connector, tickers, dtype=self.dtype, chunk_rows=self.chunk_rows)
+            self._price_panel_tickers = tickers
+
+        return self._price_panel
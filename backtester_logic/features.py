@@ -0,0 +1,110 @@
+import numpy as np
+import profiling
+
+# 252 trading days in a year
+TRADING_DAYS_PER_YEAR = 252
+
+# Bump whenever momentum_features changes what a column means, invalidates cached panels
+FEATURE_VERSION = 3
+
+
+def _months_to_days(months: int) -> int:
+    """Converts a window given in months into a number of trading days"""
+    return int((months / 12) * TRADING_DAYS_PER_YEAR)
+
+
+def _return_column(look_back: int) -> str:
+    return f"Return_{look_back}_Month"
+
+
+def _positive_column(look_back: int) -> str:
+    return f"Percent_Positive_Over_{look_back}_Months"
+
+
+def _negative_column(look_back: int) -> str:
+    return f"Percent_Negative_Over_{look_back}_Months"
+
+
+@profiling.timed('features')
+def momentum_features(close: np.ndarray, parameter_pairs, days_seen_before: int = 0) -> dict:
+    """Computes the momentum columns of one ticker for every (look_back, lottery_window) pair
+
+    Each distinct look back is computed once from shifted arrays and cumulative sums, so 
+    adding pairs that share a look back is free. The percent of up and down days are measured
+    over the look back, as the generic momentum is, the lottery window does not change them.
+
+    Parameters
+    ----------
+    close : (np.ndarray) closing prices on the master date axis, NaN (or a legacy -1) where the ticker did not trade
+    parameter_pairs : iterable of (look_back, lottery_window) given in months
+    days_seen_before : (int) valid days stored before close[0] when close is only the tail of a history,
+                       rows whose window reaches back before close[0] are then left NaN
+
+    Returns
+    --------
+    columns : dict mapping column name -> np.ndarray, NaN until enough valid days have been seen and on days without a trade
+        - Return_{look_back}_Month: return over the last look_back months
+        - Percent_Positive_Over_{look_back}_Months: share of up days over the last look_back months
+        - Percent_Negative_Over_{look_back}_Months: share of down days over the last look_back months
+    """
+
+    close = np.asarray(close, dtype=np.float64)
+    num_of_dates = len(close)
+    # Only prices are > 0, NaN compares False
+    valid = close > 0
+
+    # Number of valid days seen before each date, a window is only filled once it exceeds its length
+    days_seen = days_seen_before + \
+        np.concatenate(([0], np.cumsum(valid)[:-1]))
+
+    # Daily direction, a day only counts if it and the day before both traded
+    moved = np.zeros(num_of_dates, dtype=bool)
+    moved[1:] = valid[1:] & valid[:-1]
+    positive_sum = np.concatenate(
+        ([0], np.cumsum(moved[1:] & (close[1:] > close[:-1]))))
+    negative_sum = np.concatenate(
+        ([0], np.cumsum(moved[1:] & (close[1:] < close[:-1]))))
+
+    look_backs = sorted({look_back for look_back, _ in parameter_pairs})
+
+    columns = {}
+
+    for look_back in look_backs:
+        min_days = _months_to_days(look_back)
+        generic_momentum = np.full(num_of_dates, np.nan)
+        percent_positive = np.full(num_of_dates, np.nan)
+        percent_negative = np.full(num_of_dates, np.nan)
+
+        filled = valid & (days_seen > min_days)
+        filled[:min_days] = False
+        rows = np.flatnonzero(filled)
+        start_close = close[rows - min_days]
+        usable = start_close > 0
+        generic_momentum[rows[usable]] = close[rows[usable]] / \
+            start_close[usable] - 1
+
+        percent_positive[rows] = (
+            positive_sum[rows] - positive_sum[rows - min_days]) / min_days
+        percent_negative[rows] = (
+            negative_sum[rows] - negative_sum[rows - min_days]) / min_days
+
+        columns[_return_column(look_back)] = generic_momentum
+        columns[_positive_column(look_back)] = percent_positive
+        columns[_negative_column(look_back)] = percent_negative
+
+    return columns
+
+
+def _feature_columns(parameter_pairs) -> list[str]:
+    """Names of the columns momentum_features computes for the parameter pairs"""
+
+    columns = []
+    for look_back, _ in parameter_pairs:
+        columns += [column for column in (_return_column(look_back), _positive_column(look_back),
+                                          _negative_column(look_back)) if column not in columns]
+    return columns
+
+
+def _window_days(parameter_pairs) -> int:
+    """Longest window, in trading days, used by any of the parameter pairs"""
+    return max(_months_to_days(look_back) for look_back, _ in parameter_pairs)
@@ -0,0 +1,71 @@
+import os
+import time
+
+# Seconds between two attempts to take a lock held by someone else
+LOCK_RETRY = 0.05
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _try_lock(file) -> None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(file) -> None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _try_lock(file) -> None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(file) -> None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock():
+    """Exclusive lock on a file, held by one holder at a time across every thread and process of the machine
+
+    Used like threading.Lock (acquire(timeout=...) and release(), or as a context manager). The
+    operating system releases the lock of a process that dies while holding it.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Parameters
+        ----------
+        path : (str) file to lock, created if missing and never removed
+        """
+
+        self.path = path
+        self._file = None
+
+    def acquire(self, timeout: float = None) -> bool:
+        """Waits for the lock, at most timeout seconds (forever if None), returns whether it was taken"""
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        file = open(self.path, 'a+b')
+        while True:
+            try:
+                _try_lock(file)
+                self._file = file
+                return True
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    file.close()
+                    return False
+                time.sleep(LOCK_RETRY if deadline is None else max(
+                    0.0, min(LOCK_RETRY, deadline - time.monotonic())))
+
+    def release(self) -> None:
+        _unlock(self._file)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
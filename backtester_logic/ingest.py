@@ -0,0 +1,242 @@
+from storage import PriceStore, PRICES_TABLE, PRICE_COLUMNS, create_prices_table, _sql_rows
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import os
+import sqlite3
+import pandas as pd
+import numpy as np
+
+# Date axis shared by every parsing process
+_worker_master_dates = None
+
+
+def read_ticker_list(file_path: str) -> pd.DataFrame:
+    """Reads a Stooq ticker list, whose ticker and company name are separated by a variable amount of spaces
+
+    Returns
+    --------
+    tickers : (pd.DataFrame) with Ticker and Name columns
+    """
+
+    rows = []
+    with open(file_path, "r") as f:
+        for line in f:
+            fields = line.split(maxsplit=1)
+            if fields and fields[0] != '<TICKER>':
+                rows.append((fields[0], fields[1].strip()
+                            if len(fields) > 1 else ''))
+
+    return pd.DataFrame(rows, columns=['Ticker', 'Name'])
+
+
+def _stooq_file(data_directories, ticker: str):
+    """Returns the path of ticker's .txt file in the first directory that has it, None otherwise"""
+
+    for directory in data_directories:
+        path = os.path.join(directory, f'{ticker.lower()}.txt')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def parse_stooq_file(file_path: str) -> pd.DataFrame:
+    """Reads a Stooq .txt file, normalizing '<CLOSE>' style headers into 'Close'
+
+    Returns None when the file holds no data
+    """
+
+    try:
+        ticker_df = pd.read_csv(file_path)
+    except pd.errors.EmptyDataError:
+        return None
+
+    if ticker_df.empty:
+        return None
+
+    ticker_df.rename(
+        columns=(lambda column_name: column_name.replace(
+            "<", "").replace(">", "").title()),
+        inplace=True
+    )
+    return ticker_df
+
+
+def normalize_dates(ticker_df: pd.DataFrame, master_dates: np.ndarray) -> pd.DataFrame:
+    """Pads a series with empty rows (NaN, stored as NULL) for every master date before its first trade
+    so every ticker starts on the same day as the date axis"""
+
+    first_date = ticker_df['Date'].iloc[0]
+    missing_dates = master_dates[master_dates < first_date]
+    if len(missing_dates) == 0:
+        return ticker_df
+
+    insert_df = pd.DataFrame(np.nan, index=range(len(missing_dates)),
+                             columns=ticker_df.columns)
+    insert_df['Date'] = missing_dates
+    insert_df['Ticker'] = ticker_df['Ticker'].iloc[0]
+    insert_df['Per'] = 'D'
+
+    return pd.concat([insert_df, ticker_df], ignore_index=True)
+
+
+@profiling.timed('fill_missing_dates')
+def fill_missing_dates(ticker_df: pd.DataFrame, master_dates: np.ndarray) -> tuple[pd.DataFrame, dict]:
+    """Reindexes a ticker onto the master date axis in one step, filling the dates it is missing
+
+        - Interior gaps take the average of the rows above and below. A run of k missing days is 
+          filled top down, each day averaging the day before it with the next traded day, 
+          i.e. next + (previous - next) / 2**j for the j-th missing day
+        - Gaps before the first or after the last row are left empty (NaN, stored as NULL) to signify 
+          trading has not started or has halted
+
+    Returns
+    --------
+    filled_df : (pd.DataFrame) ticker_df with a row for every master date (rows off the axis are kept)
+    gap_counts : dict with the number of 'leading', 'interior' and 'trailing' dates that were filled
+    """
+
+    dates = ticker_df['Date'].to_numpy(dtype=np.int64)
+    missing = ~np.isin(master_dates, dates)
+    if not missing.any():
+        return ticker_df, {'leading': 0, 'interior': 0, 'trailing': 0}
+
+    all_dates = np.union1d(dates, master_dates)
+    filled_df = ticker_df.assign(Date=dates).set_index(
+        'Date').reindex(all_dates)
+
+    positions = np.arange(len(all_dates))
+    traded = np.isin(all_dates, dates)
+    # Closest stored row above and below each date, -1 / len when there is none
+    previous_row = np.maximum.accumulate(np.where(traded, positions, -1))
+    next_row = np.minimum.accumulate(
+        np.where(traded, positions, len(all_dates))[::-1])[::-1]
+
+    gap = ~traded
+    leading = gap & (previous_row == -1)
+    trailing = gap & (next_row == len(all_dates)) & ~leading
+    interior = gap & ~leading & ~trailing
+
+    rows = np.flatnonzero(interior)
+    depth = rows - previous_row[rows]
+    for column in ['Open', 'High', 'Low', 'Close', 'Vol']:
+        values = filled_df[column].to_numpy(dtype=np.float64)
+        previous_value = values[previous_row[rows]]
+        next_value = values[next_row[rows]]
+        values[rows] = next_value + (previous_value - next_value) / 2.0 ** depth
+        filled_df[column] = values
+
+    # Every other column of a filled date is left NaN by the reindex
+    filled_df.loc[interior, 'Openint'] = 0
+    filled_df.loc[gap, 'Ticker'] = ticker_df['Ticker'].iloc[0]
+    filled_df.loc[gap, 'Per'] = 'D'
+
+    gap_counts = {'leading': int(leading.sum()), 'interior': int(interior.sum()),
+                  'trailing': int(trailing.sum())}
+
+    return filled_df.reset_index(names='Date')[ticker_df.columns], gap_counts
+
+
+def _init_worker(master_dates: np.ndarray) -> None:
+    global _worker_master_dates
+    _worker_master_dates = master_dates
+
+
+def _load_ticker(file_path: str) -> pd.DataFrame:
+    """Worker: parses and aligns one file entirely in memory"""
+
+    ticker_df = parse_stooq_file(file_path)
+    if ticker_df is None:
+        return None
+
+    return normalize_dates(ticker_df, _worker_master_dates)
+
+
+@profiling.timed('sql_write')
+def _bulk_insert(connector: sqlite3.Connection, frames: list[tuple[str, pd.DataFrame]]) -> None:
+    """Replaces the rows of every ticker in frames inside a single transaction"""
+
+    columns = list(PRICE_COLUMNS)
+    store = PriceStore(connector)
+
+    with connector:
+        store._bump_data_version()
+        connector.executemany(f"DELETE FROM {PRICES_TABLE} WHERE Ticker = ?",
+                              ((ticker,) for ticker, _ in frames))
+        for ticker, ticker_df in frames:
+            connector.executemany(
+                f"""INSERT INTO {PRICES_TABLE} (Ticker, Date, {', '.join(columns)})
+                VALUES (?, ?, {', '.join('?' * len(columns))})""",
+                _sql_rows(ticker_df, ['Date'] + columns, prefix=(ticker,)))
+
+
+@profiling.profiled('ingest_stooq')
+def ingest_stooq(database: str,
+                 tickers,
+                 data_directories,
+                 date_axis_ticker: str = 'GE.US',
+                 max_workers: int = None,
+                 batch_size: int = 250) -> list[str]:
+    """Streams Stooq .txt files straight into the prices table
+
+    Replaces the csv_converter -> find_blanks -> normalize_dates -> push_table_to_db steps of
+    data_preparation.ipynb: files are parsed across a process pool, headers are normalized and
+    series are padded to the date axis in memory, and the rows are written with executemany
+    inside one transaction per batch_size tickers. No intermediate files are written.
+
+    Parameters
+    ----------
+    database : (str) path to the stock database
+    tickers : iterable of stock symbols (e.g. read_ticker_list(...)['Ticker'])
+    data_directories : list of folders holding the <ticker>.txt files (e.g. nasdaq_stocks/, nyse_stocks/)
+    date_axis_ticker : (str) ticker whose trading days every series is aligned to
+    max_workers : (int) number of parsing processes, defaults to the number of CPUs
+    batch_size : (int) number of tickers written per transaction
+
+    Returns
+    --------
+    tickers_loaded : list[str] of the tickers that had data, the others are reported as they are skipped
+    """
+
+    tickers = list(tickers)
+
+    axis_file = _stooq_file(data_directories, date_axis_ticker)
+    if axis_file is None:
+        raise FileNotFoundError(f"No data file for {date_axis_ticker}")
+    master_dates = parse_stooq_file(axis_file)['Date'].to_numpy()
+
+    files = [(ticker, _stooq_file(data_directories, ticker))
+             for ticker in tickers]
+    files = [(ticker, path) for ticker, path in files if path is not None]
+
+    connector = sqlite3.connect(database)
+    create_prices_table(connector)
+
+    tickers_loaded = []
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             initializer=_init_worker,
+                             initargs=(master_dates,)) as executor:
+        parsed = executor.map(_load_ticker,
+                              [path for _, path in files],
+                              chunksize=16)
+
+        pending = []
+        for (ticker, _), ticker_df in tqdm(zip(files, parsed), total=len(files)):
+            if ticker_df is None:
+                # Written above the progress bar rather than through it
+                tqdm.write(f"No data in {ticker}")
+                continue
+
+            pending.append((ticker, ticker_df))
+            if len(pending) >= batch_size:
+                _bulk_insert(connector, pending)
+                tickers_loaded += [ticker for ticker, _ in pending]
+                pending = []
+
+        if pending:
+            _bulk_insert(connector, pending)
+            tickers_loaded += [ticker for ticker, _ in pending]
+
+    connector.close()
+
+    return tickers_loaded
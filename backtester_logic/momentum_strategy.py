@@ -1,20 +1,18 @@
 import numpy as np
 import pandas as pd
-import heapq
 import sqlite3
 from tqdm import tqdm
-from decouple import config
 
-from utils import _ticker_to_table_name, _int_to_datetime
+import profiling
+from strategy import Strategy, SLIPPAGE_FACTOR
+from features import momentum_features, _return_column, _positive_column, _negative_column, _feature_columns, _window_days
+from panel import Panel, load_panel, _database_path, _source_fingerprint
+from rank_index import RankIndex, rank_index_path, rank_index_manifest, first_stale_row
+from storage import PriceStore
+from ingest import fill_missing_dates
 
-SLIPPAGE_FACTOR = float(config('SLIPPAGE_FACTOR'))
 
-"""
-TODO: Make an abstract Strategy class, require self.tickers, self.rebalance_period, and self.portfolio_construction()
-"""
-
-
-class QuantitativeMomentum():
+class QuantitativeMomentum(Strategy):
     """This class systematizes the momentum strategy presented in 
     'Quantitative Momentum: A Practitioner's Guide to Building a Momentum-Based Stock Selection System'
     This class builds out an intermediate term momentum strategy (look back period of 12 months)
@@ -39,6 +37,7 @@ class QuantitativeMomentum():
             Smart Rebalance: Close of trading in Feb, May, Aug, and Nov
             Avg Rebalance: Close of trading in Jan, Apr, Jul, and Oct
             Dumb: Close of trading in Dec, Mar, Jun, and Sep
+        Chosen with seasonality='smart', 'avg' or 'dumb', None rebalances rebalance_period months after the last rebalance
 
     Class will determine the n best stocks to invest in on a given date based on the momentum strategy
         1. Classify the stocks and find the top 10% generic momentum names
@@ -47,8 +46,7 @@ class QuantitativeMomentum():
 
 
     TODO: 
-        1. Make an abstract Strategy class 
-        2. Test! 
+        1. Test! 
     """
 
     def __init__(self,
@@ -57,263 +55,551 @@ class QuantitativeMomentum():
                  rebalance_period: int = 3,
                  look_back: int = 12,
                  lottery_window: int = 1,
-                 firms_held: int = 50) -> None:
+                 firms_held: int = 50,
+                 panel: Panel = None,
+                 seasonality: str = None,
+                 dtype=np.float64,
+                 chunk_rows: int = None) -> None:
+        """
+        Parameters
+        ----------
+        database_name : (str) path to the stock database
+        tickers : (pd.DataFrame) universe with a 'Ticker' column
+        panel : (Panel) optional preloaded panel holding Open and this strategy's momentum columns
+        seasonality : (str) None, 'smart', 'avg' or 'dumb' (see trading_calendar.SEASONAL_ANCHOR_MONTHS)
+        dtype : np.float64 or panel.COMPACT_DTYPE, the type the feature panel is held in
+        chunk_rows : (int) hold only this many dates of features in memory at a time (see panel.ChunkedPanel)
+        """
+
+        super().__init__(tickers, rebalance_period, seasonality)
 
         self.connector = sqlite3.connect(database_name)
         self.cursor = self.connector.cursor()
-        self.tickers = tickers
+        self.store = PriceStore(self.connector)
         self.universe_size = len(self.tickers)
 
         self.look_back = look_back
         self.lottery_window = lottery_window
         self.firms_held = firms_held
-        self.rebalance_period = rebalance_period
-
-    def validate_data(self):
+        self.dtype = dtype
+        self.chunk_rows = chunk_rows
+
+        # dates x tickers momentum/FIP/Open arrays, see self.feature_panel()
+        self._feature_panel = panel
+        self._panel_supplied = panel is not None
+        self._ticker_rank = None
+        # momentum_screen of every date weights were computed for, shared by firms_held/rebalance variants
+        self._screens = {}
+        # Materialized screens of every trading date, see self.build_rank_index()
+        self._rank_index = None
+        # Store versions of the panel's columns the panel, screens and rank index above were read at
+        self._write_versions = self.store.write_versions(self._panel_columns())
+
+    @profiling.profiled('validate_data')
+    def validate_data(self) -> pd.DataFrame:
         """For missing dates in our csv, we will append the data as the average of the above and below. 
-        Otherwise we will add in a row of -1's to signify trading has halted"""
+        Otherwise we will leave the row empty (NULL) to signify trading has halted
 
-        query = f"""SELECT Date FROM {_ticker_to_table_name("GE.US")}"""
-        equity_timeseries = pd.read_sql_query(query, self.connector)
-        dates_len = len(equity_timeseries)
+        Each ticker is reindexed onto the GE.US date axis in one step (see ingest.fill_missing_dates)
+        and only tickers that were missing dates are written back.
 
-        tickers_missing_dates = []
+        Returns
+        --------
+        gap_counts : (pd.DataFrame) indexed by Ticker with the Leading, Interior and Trailing dates filled,
+                     one row per ticker that was missing dates (empty when the data is complete)
+        """
+
+        master_dates = self.store.dates()
+        gap_counts = {}
 
         for ticker in tqdm(self.tickers['Ticker']):
 
-            query = f"SELECT * from {_ticker_to_table_name(ticker)}"
-            ticker_df = pd.read_sql_query(query, self.connector)
-
-            if len(ticker_df) != dates_len:
-                missing_dates = equity_timeseries[~equity_timeseries['Date'].isin(
-                    ticker_df['Date'])].copy()
-
-                for date in missing_dates['Date']:
-                    row_above_index = ticker_df.index[ticker_df['Date'] > date].min(
-                    )
-
-                    if pd.notna(row_above_index):
-                        prev_open, prev_high, prev_low, prev_close, prev_vol = ticker_df.loc[row_above_index - 1, [
-                            'Open', 'High', 'Low', 'Close', 'Vol']]
-                        next_open, next_high, next_low, next_close, next_vol = ticker_df.loc[row_above_index, [
-                            'Open', 'High', 'Low', 'Close', 'Vol']]
-
-                        def average(a, b): return (a + b) / 2
-
-                        missing_date_row = {
-                            'Ticker': ticker,
-                            'Per': 'D',
-                            'Date': date,  # fill this with the missing date
-                            'Time': -1,
-                            'Open': average(prev_open, next_open),
-                            'High': average(prev_high, next_high),
-                            'Low': average(prev_low, next_low),
-                            'Close': average(prev_close, next_close),
-                            'Vol': average(prev_vol, next_vol),
-                            'Openint': 0,
-                            'Return_12_Month': -1,
-                            'Percent_Positive_Over_12_Months': -1,
-                            'Percent_Negative_Over_12_Months': -1,
-                        }
-                    else:
-
-                        missing_date_row = {
-                            'Ticker': ticker,
-                            'Per': 'D',
-                            'Date': date,  # fill this with the missing date
-                            'Time': -1,
-                            'Open': -1,
-                            'High': -1,
-                            'Low': -1,
-                            'Close': -1,
-                            'Vol': -1,
-                            'Openint': -1,
-                            'Return_12_Month': -1,
-                            'Percent_Positive_Over_12_Months': -1,
-                            'Percent_Negative_Over_12_Months': -1,
-                        }
-
-                    ticker_df.loc[row_above_index - 0.5] = missing_date_row
-                    ticker_df = ticker_df.sort_index().reset_index(drop=True)
-
-                ticker_df.to_sql(_ticker_to_table_name(
-                    ticker), self.connector, if_exists='replace', index=False)
-                tickers_missing_dates.append(ticker)
-
-        return tickers_missing_dates
-
-    def compute_parameters(self) -> None:
-        # TODO: FIX SO THAT ONLY NEW COLUMNS ADDED
-        """Appends the following columns to each table in the Stock database 
-            - Generic Momentum for x Months: Return over last self.lookback months
-            - Percent Positive Days over x Months: The percent of positive return days over last self.lookback months
-            -  Percent Negative_Days over x Months: The percent of negative return days over last self.lookback months
-            """
-
-        # 252 trading days in a year
-        min_days = int((self.look_back / 12) * 252)
+            ticker_df = self.store.read(ticker)
+            filled_df, counts = fill_missing_dates(ticker_df, master_dates)
 
-        for ticker in tqdm(self.tickers['Ticker']):
-            current_table = pd.read_sql_query(
-                f"""SELECT 
-                *
-                FROM {_ticker_to_table_name(ticker)}""",
-                con=self.connector)
-
-            num_of_dates = len(current_table)
-            new_columns = pd.DataFrame({
-                "Positive_Sum": np.zeros(num_of_dates),
-                "Negative_Sum": np.zeros(num_of_dates),
-                "Current_Return": np.zeros(num_of_dates),
-                f"Return_{self.look_back}_Month": np.full(num_of_dates, -1),
-                f"Percent_Positive_Over_{self.lottery_window}_Months": np.full(num_of_dates, -1),
-                f"Percent_Negative_Over_{self.lottery_window}_Months": np.full(num_of_dates, -1)})
-
-            total_days = 0
-
-            for index, row in current_table.iterrows():
-                if row['Close'] == -1:
-                    pass
-                elif total_days <= min_days:
-                    # We hit a valid OHLC data point but have not gathered enough data to draw a data point
-                    if index == 0:
-                        total_days += 1
-                    else:
-                        total_days += 1
-                        new_columns.loc[index,
-                                        'Positive_Sum'] = new_columns.loc[index - 1, 'Positive_Sum']
-                        new_columns.loc[index,
-                                        'Negative_Sum'] = new_columns.loc[index - 1, 'Negative_Sum']
-                        # If stock made a positive return
-                        if row['Close'] > current_table.loc[index - 1, "Close"] and current_table.loc[index - 1, "Close"] != -1:
-                            new_columns.loc[index, 'Positive_Sum'] += 1
-                            new_columns.loc[index, 'Current_Return'] = 1
-                        # If stock made a negative return
-                        elif row['Close'] < current_table.loc[index - 1, "Close"]:
-                            new_columns.loc[index, 'Negative_Sum'] += 1
-                            new_columns.loc[index, 'Current_Return'] = -1
-                else:
-                    # Generic Momentum
-                    new_columns.loc[index, f"Return_{self.look_back}_Month"] = (
-                        row['Close'] / current_table.loc[index - min_days, "Close"]) - 1
-                    positive_sum = new_columns.loc[index - 1, 'Positive_Sum']
-                    negative_sum = new_columns.loc[index - 1, 'Negative_Sum']
-
-                    # If the beginning of the look back period was positive,
-                    # we need to remove that from our count
-                    if new_columns.loc[index - min_days, "Current_Return"] == 1:
-                        positive_sum -= 1
-                    # If negative we have to remove that
-                    elif new_columns.loc[index - min_days, "Current_Return"] == -1:
-                        negative_sum -= 1
-
-                    # If stock made a positive return
-                    if row['Close'] > current_table.loc[index - 1, 'Close']:
-                        positive_sum += 1
-                        new_columns.loc[index, 'Current_Return'] = 1
-                    # If stock made a negative return
-                    elif row['Close'] < current_table.loc[index - 1, "Close"]:
-                        negative_sum += 1
-                        new_columns.loc[index, 'Current_Return'] = -1
-
-                    # Necessary statistics
-                    new_columns.loc[index, 'Positive_Sum'] = positive_sum
-                    new_columns.loc[index, 'Negative_Sum'] = negative_sum
-
-                    new_columns.loc[index,
-                                    f"Percent_Positive_Over_{self.lottery_window}_Months"] = positive_sum / min_days
-                    new_columns.loc[index,
-                                    f"Percent_Negative_Over_{self.lottery_window}_Months"] = negative_sum / min_days
-
-            # update sql table
-            pd.merge(
-                left=current_table,
-                right=new_columns[[
-                    f"Return_{self.look_back}_Month",
-                    f"Percent_Positive_Over_{self.lottery_window}_Months",
-                    f"Percent_Negative_Over_{self.lottery_window}_Months"]],
-                left_index=True,
-                right_index=True
-            ).to_sql(_ticker_to_table_name(ticker), self.connector, if_exists='replace', index=False)
-
-    def portfolio_construction(self, current_capital: int, date: int) -> tuple[list[tuple[str, int, float]], float]:
-        """Returns the self.firm_size number of stocks that should be invested in for given date
+            if sum(counts.values()) > 0:
+                self.store.write(ticker, filled_df)
+                gap_counts[ticker] = counts
+
+        self._forget_stale_data()
+
+        return pd.DataFrame.from_dict(gap_counts, orient='index', columns=['leading', 'interior', 'trailing']).rename(
+            columns=str.title).rename_axis('Ticker')
+
+    @profiling.profiled('compute_parameters')
+    def compute_parameters(self, parameter_pairs=None, columns=None, progress_callback=None) -> None:
+        """Adds (or replaces) the following columns in each table in the Stock database 
+            - Generic Momentum for x Months: Return over last look_back months
+            - Percent Positive Days over x Months: The percent of positive return days over last look_back months
+            - Percent Negative Days over x Months: The percent of negative return days over last look_back months
+
+        The columns are flagged incomplete (see PriceStore.incomplete_columns) until every ticker is written.
+
+        Parameters
+        ----------
+        parameter_pairs : list[(look_back, lottery_window)] to compute in a single pass over each ticker,
+                          defaults to [(self.look_back, self.lottery_window)]
+        columns : names of the columns to write, defaults to every column of parameter_pairs
+        progress_callback : callable(tickers_done, total_tickers) called after every ticker,
+                            an exception raised by it aborts the computation
+        """
+
+        if parameter_pairs is None:
+            parameter_pairs = [(self.look_back, self.lottery_window)]
+
+        if columns is None:
+            columns = _feature_columns(parameter_pairs)
+        columns = list(columns)
+
+        tickers = self.tickers['Ticker']
+        self.store.mark_incomplete(columns)
+
+        for done, ticker in enumerate(tqdm(tickers), start=1):
+            current_table = self.store.read(ticker)
+
+            new_columns = momentum_features(
+                current_table['Close'].to_numpy(dtype=np.float64), parameter_pairs)
+
+            # Columns computed previously are overwritten rather than duplicated
+            for column in columns:
+                current_table[column] = new_columns[column]
+
+            self.store.write(ticker, current_table, columns=columns)
+
+            if progress_callback is not None:
+                progress_callback(done, len(tickers))
+
+        self.store.mark_incomplete(columns, incomplete=False)
+        self._forget_stale_data()
+
+    @profiling.profiled('append_bars')
+    def append_bars(self, new_bars: pd.DataFrame, parameter_pairs=None) -> dict:
+        """Ingests new daily bars and computes their momentum columns without rewriting history
+
+        Only bars dated after a ticker's last stored date are kept. Their features are computed 
+        from the stored tail (the longest window plus one day) and upserted, so a nightly refresh 
+        costs time proportional to the new data.
+
+        Parameters
+        ----------
+        new_bars : (pd.DataFrame) Stooq style rows with Ticker, Date, Open, High, Low, Close, Vol, ...
+        parameter_pairs : list[(look_back, lottery_window)] to compute, defaults to [(self.look_back, self.lottery_window)]
+
+        Returns
+        --------
+        rows_appended : dict mapping ticker -> number of new rows stored
+        """
+
+        if parameter_pairs is None:
+            parameter_pairs = [(self.look_back, self.lottery_window)]
+
+        tail_length = _window_days(parameter_pairs) + 1
+        rows_appended = {}
+
+        for ticker, ticker_bars in tqdm(new_bars.groupby('Ticker', sort=False)):
+            tail = self.store.tail(ticker, tail_length, columns=['Close'])
+            last_date = int(tail['Date'].iloc[-1]) if len(tail) else -1
+
+            ticker_bars = ticker_bars[ticker_bars['Date'].astype(np.int64) > last_date].sort_values(
+                'Date').reset_index(drop=True)
+            if ticker_bars.empty:
+                continue
+
+            tail_close = tail['Close'].to_numpy(dtype=np.float64)
+            tail_valid = int(np.sum(tail_close > 0))
+
+            # Trading days stored before the tail, a short tail is the whole history. A full
+            # tail says nothing about what precedes it (the ticker may have listed inside it)
+            days_seen_before = 0 if len(tail) < tail_length else (
+                self.store.valid_days(ticker) - tail_valid)
+
+            close = np.concatenate(
+                (tail_close, ticker_bars['Close'].to_numpy(dtype=np.float64)))
+            new_columns = momentum_features(
+                close, parameter_pairs, days_seen_before=days_seen_before)
+
+            for column, values in new_columns.items():
+                ticker_bars[column] = values[len(tail):]
+
+            self.store.append(ticker, ticker_bars)
+            rows_appended[ticker] = len(ticker_bars)
+
+        self._forget_stale_data()
+        return rows_appended
+
+    def feature_panel(self) -> Panel:
+        """Returns the dates x tickers panel of the strategy's momentum, FIP inputs and Open,
+        reading the database only the first time"""
+
+        if self._feature_panel is None:
+            self._feature_panel = load_panel(self.connector, self.tickers['Ticker'], columns=self._panel_columns(),
+                                             dtype=self.dtype, chunk_rows=self.chunk_rows)
+
+        if self._ticker_rank is None:
+            self._set_ticker_rank(self._feature_panel.tickers)
+
+        return self._feature_panel
+
+    def _panel_columns(self) -> list[str]:
+        """Names of the columns the momentum screen is computed from"""
+        return [_return_column(self.look_back), _positive_column(self.look_back),
+                _negative_column(self.look_back), 'Open']
+
+    def _forget_stale_data(self) -> None:
+        """Drops the feature panel, screens and rank index read before the store's data of the
+        panel's columns last changed, writes of other columns keep them
+
+        A panel given to the constructor belongs to the caller and is kept.
+        """
+
+        write_versions = self.store.write_versions(self._panel_columns())
+        if write_versions == self._write_versions:
+            return
+
+        self._write_versions = write_versions
+        if not self._panel_supplied:
+            self._feature_panel = None
+        self._screens = {}
+        self._rank_index = None
+
+    def _set_ticker_rank(self, tickers: np.ndarray) -> None:
+        # Position of each ticker in alphabetical order, breaks ties the same way heapq compares tuples
+        self._ticker_rank = np.empty(len(tickers), dtype=np.int64)
+        self._ticker_rank[np.argsort(tickers)] = np.arange(len(tickers))
+
+    def build_rank_index(self, rebuild: bool = False) -> RankIndex:
+        """Brings the stored rank index of this (look_back, lottery_window) and universe up to date,
+        screens are then looked up in it rather than computed
+
+        The momentum screen of every trading date is materialized next to the database (see
+        rank_index.rank_index_path). Only the dates from the day before the earliest date written since 
+        the index was built are screened again, so after append_bars only the new dates are. Any 
+        firms_held is then sliced out of the stored screens by portfolio_construction and target_weights.
+
+        Parameters
+        ----------
+        rebuild : (bool) screen every date again even if the stored index is up to date
+        """
+
+        # Screens of new dates must not come from a panel read before they were stored
+        self._forget_stale_data()
+
+        tickers = self.tickers['Ticker']
+        dates = self.store.dates()
+        database_path = _database_path(self.connector)
+        expected = rank_index_manifest(
+            tickers, self.look_back, self.lottery_window)
+        source = _source_fingerprint(self.connector, database_path)
+
+        path = None
+        index, manifest = None, {}
+        if database_path != '':
+            path = rank_index_path(
+                database_path, self.look_back, self.lottery_window)
+            if not rebuild:
+                index, manifest = RankIndex.load(path)
+
+        first_row = first_stale_row(
+            index, manifest, expected, self.store, dates, source, self._panel_columns())
+        if first_row == 0:
+            index = RankIndex.empty(np.asarray(tickers))
+
+        if first_row < len(dates) or len(index) != len(dates):
+            screens = [self.momentum_screen(int(date))
+                       for date in tqdm(dates[first_row:])]
+            index = index.extend(first_row, dates, screens)
+            if path is not None:
+                index.save(path, {**expected, 'source': source})
+        elif path is not None and manifest.get('source') != source:
+            # Only other columns were written, the index is up to date with the new data_version
+            index.save(path, {**expected, 'source': source})
+
+        self._rank_index = index
+        self._set_ticker_rank(index.tickers)
+        return index
+
+    def _screen(self, date: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the momentum screen of date, looked up in the rank index once one is built"""
+
+        if self._rank_index is not None:
+            return self._rank_index.screen(date)
+        return self.momentum_screen(date)
+
+    def _screened_tickers(self) -> np.ndarray:
+        """Returns the tickers the positions of a screen refer to"""
+
+        if self._rank_index is not None:
+            return self._rank_index.tickers
+        return self.feature_panel().tickers
+
+    def snapshot(self, date: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the cross section of the universe on the first trading day >= date
 
         Parameters
         ----------
-        current_capital : (int) representing the amount of cash currently available to invest
         date : (int) given as YYYYMMDD
 
         Returns
         --------
-        portfolio : list[(ticker, shares_purcahsed, cost)] where each tuple represents an allocation into the ticker
-                    buying shares_purchased amount at the next date open with slippage factor included in cost
+        generic_momentum, perc_pos, perc_neg, next_open : np.ndarray over self.tickers, NaN where the ticker has no data
+        tradable : np.ndarray[bool] of tickers with a computed momentum and an open on the following day
+        """
 
-        cash_left : (int) uninvested capital
+        panel = self.feature_panel()
+        row = panel.date_index(date)
+        num_of_tickers = len(panel.tickers)
+
+        def _row(field, row):
+            if row >= len(panel.dates):
+                return np.full(num_of_tickers, np.nan)
+            # Scores are computed in float64 from compact panels too
+            return np.asarray(panel.rows(field, row, row + 1)[0], dtype=np.float64)
+
+        generic_momentum = _row(_return_column(self.look_back), row)
+        perc_pos = _row(_positive_column(self.look_back), row)
+        perc_neg = _row(_negative_column(self.look_back), row)
+        next_open = _row('Open', row + 1)
+
+        # Features are NaN until their window is filled and on days without a trade
+        tradable = ~np.isnan(generic_momentum) & ~np.isnan(perc_pos) & \
+            ~np.isnan(perc_neg) & (next_open > 0)
+
+        return generic_momentum, perc_pos, perc_neg, next_open, tradable
+
+    @profiling.timed('ranking')
+    def momentum_screen(self, date: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the top 10% generic momentum names on date ranked by FIP score
+
+        The screen does not depend on capital or firms_held, so it can be shared by every 
+        portfolio size and rebalance period that trades on the same date.
+
+        Parameters
+        ----------
+        date : (int) given as YYYYMMDD
+
+        Returns
+        --------
+        positions : np.ndarray of ticker positions in self.feature_panel(), best FIP score first
+        fip_score : np.ndarray of the FIP score of each screened ticker
+        next_open : np.ndarray of the open on the following trading day of each screened ticker
         """
 
+        profiling.count('screens')
         generic_momentum_size = int(self.universe_size * 0.1)
-        generic_momentum_screen = []
 
         def _fip_score(perc_return: float, perc_pos_days: float, perc_neg_days: float) -> float:
             return perc_return * (perc_pos_days - perc_neg_days)
 
+        generic_momentum, perc_pos, perc_neg, next_open, tradable = self.snapshot(
+            date)
+        ticker_rank = self._ticker_rank
+        fip_score = _fip_score(generic_momentum, perc_pos, perc_neg)
+
         # Top 10% of generic momentum tickers
-        for ticker in self.tickers['Ticker']:
-            query = f"""SELECT 
-            Return_{self.look_back}_Month,
-            Percent_Positive_Over_{self.lottery_window}_Months, 
-            Percent_Negative_Over_{self.lottery_window}_Months,
-            OPEN
-            FROM {_ticker_to_table_name(ticker)} 
-            WHERE Date >= {date}
-            ORDER BY Date
-            LIMIT 2"""
-            return_value = self.cursor.execute(query).fetchall()
-            if return_value == []:
-                pass
-            elif return_value[0][0] == -1:
-                pass
-            else:
-                generic_momentum, perc_pos, perc_neg, _ = return_value[0]
-                next_open = return_value[1][3]
-                heapq.heappush(generic_momentum_screen,
-                               (generic_momentum,
-                                _fip_score(
-                                    generic_momentum, perc_pos, perc_neg),
-                                   next_open,
-                                   ticker))
-                if len(generic_momentum_screen) > generic_momentum_size:
-                    heapq.heappop(generic_momentum_screen)
-
-        # Choose top firms by fip_score next, calculate capital to deploy for each
-        top_firms = []
+        candidates = np.flatnonzero(tradable)
+        positions = candidates[_top_k(generic_momentum_size, [
+            generic_momentum[candidates], fip_score[candidates], next_open[candidates], ticker_rank[candidates]])]
+
+        # Rank by FIP score
+        positions = positions[np.lexsort(
+            (-ticker_rank[positions], -fip_score[positions]))]
+
+        return positions, fip_score[positions], next_open[positions]
+
+    def target_weights(self, rebalance_dates, firms_held: int = None) -> np.ndarray:
+        """Equally weights the firms_held best FIP scores of the momentum screen on each rebalance date
+
+        The weights ignore prices, the Backtester replaces the firms its capital cannot buy a share
+        of through self.allocate. Screens are kept by date, so variants rebalancing on the same dates with another firms_held 
+        or rebalance period reuse them. They are looked up once self.build_rank_index() has been run.
+
+        Parameters
+        ----------
+        rebalance_dates : list[int] of YYYYMMDD dates
+        firms_held : (int) number of firms to hold, defaults to self.firms_held
+
+        Returns
+        --------
+        weights : np.ndarray of shape len(rebalance_dates) x len(self.tickers), see Strategy.target_weights
+        """
+
+        if firms_held is None:
+            firms_held = self.firms_held
+
+        self._forget_stale_data()
+        weights = np.zeros(
+            (len(rebalance_dates), len(self._screened_tickers())))
+
+        for row, date in enumerate(rebalance_dates):
+            if date not in self._screens:
+                self._screens[date] = self._screen(date)
+            positions = self._screens[date][0]
+
+            top_firms = self._top_firms(self._screens[date], firms_held)
+            if len(top_firms):
+                weights[row, positions[top_firms]] = 1 / len(top_firms)
+
+        return weights
+
+    def _top_firms(self, screen: tuple[np.ndarray, np.ndarray, np.ndarray], firms_held: int) -> np.ndarray:
+        """Returns the entries of a momentum screen target_weights holds, best FIP score first
+
+        FIP ties straddling the cut go to the cheaper share and then the ticker
+        """
+
+        positions, fip_score, next_open = screen
+        if len(positions) == 0 or firms_held <= 0:
+            return np.array([], dtype=np.int64)
+
+        top_firms = np.arange(min(firms_held, len(positions)))
+        if len(positions) > firms_held and fip_score[firms_held - 1] == fip_score[firms_held]:
+            top_firms = np.sort(_top_k(firms_held, [
+                fip_score, -next_open, self._ticker_rank[positions]]))
+
+        return top_firms
+
+    def _affordable_firms(self, screen: tuple[np.ndarray, np.ndarray, np.ndarray], current_capital: float, firms_held: int) -> tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+        """Picks the firms_held best FIP scores of a momentum screen the capital can buy a share of
+
+        Each pick gets current_capital / min(firms_held, screen size). A firm that cannot buy one
+        share with it is skipped and the next ranked firm takes its place, FIP ties are broken by
+        shares, cost and then ticker.
+
+        Returns
+        --------
+        top_firms : np.ndarray of the screen entries bought, best FIP score first
+        shares_purchased, cost : np.ndarray over the whole screen
+        capital_available : (float) capital given to each pick
+        """
+
+        positions, fip_score, next_open = screen
+
+        if len(positions) == 0 or firms_held <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([]), 0.0
+
         # will allocate to all stocks in universe if pool is too small
         capital_available = (
-            1 / min(self.firms_held, len(generic_momentum_screen))) * current_capital
-        for generic_momentum, fip_score, next_open, ticker in generic_momentum_screen:
-            # cost of each share
-            cost = SLIPPAGE_FACTOR * next_open
-
-            # maximum possible deployment
-            shares_purchased = int(capital_available / cost)
-
-            # Can't afford any shares (e.g. potentially Berkshare Hathaway), skip
-            if shares_purchased == 0:
-                pass
-            # Insert correctly into heap while maintaining size
-            elif len(top_firms) < self.firms_held:
-                heapq.heappush(
-                    top_firms, (fip_score, shares_purchased, cost, ticker))
-            else:
-                heapq.heappushpop(
-                    top_firms, (fip_score, shares_purchased, cost, ticker))
-
-        portfolio = [(ticker, shares_purcahsed, cost)
-                     for _, shares_purcahsed, cost, ticker in top_firms]
+            1 / min(firms_held, len(positions))) * current_capital
+
+        # cost of each share
+        cost = SLIPPAGE_FACTOR * next_open
+
+        # maximum possible deployment
+        shares_purchased = (capital_available / cost).astype(np.int64)
+
+        # Can't afford any shares (e.g. potentially Berkshare Hathaway), skip
+        affordable = np.flatnonzero(shares_purchased != 0)
+        top_firms = affordable[:firms_held]
+
+        # FIP ties are broken by shares, cost and then ticker, only re-rank if a tie straddles the cut
+        if len(affordable) > firms_held and fip_score[affordable[firms_held - 1]] == fip_score[affordable[firms_held]]:
+            top_firms = affordable[_top_k(firms_held, [
+                fip_score[affordable], shares_purchased[affordable], cost[affordable], self._ticker_rank[positions[affordable]]])]
+            top_firms = top_firms[np.argsort(
+                -fip_score[top_firms], kind='stable')]
+
+        return top_firms, shares_purchased, cost, capital_available
+
+    def allocate(self, rebalance_date: int, weights: np.ndarray, capital: float, firms_held: int = None) -> np.ndarray:
+        """Replaces the firms of a row of target_weights the capital cannot buy a share of by the
+        next ranked ones (see self._affordable_firms), as self.portfolio_construction does
+
+        Parameters
+        ----------
+        see Strategy.allocate, firms_held defaults to self.firms_held
+        """
+
+        if firms_held is None:
+            firms_held = self.firms_held
+
+        if rebalance_date not in self._screens:
+            self._screens[rebalance_date] = self._screen(rebalance_date)
+        positions = self._screens[rebalance_date][0]
+        top_firms, _, _, _ = self._affordable_firms(
+            self._screens[rebalance_date], capital, firms_held)
+
+        allocation = np.zeros(len(weights))
+        # weight * capital is capital_available to the last bit, so the Backtester buys the share counts picked here
+        allocation[positions[top_firms]] = 1 / min(firms_held, len(positions)) if len(top_firms) else 0
+        return allocation
+
+    def select_portfolio(self, screen: tuple[np.ndarray, np.ndarray, np.ndarray], current_capital: float, firms_held: int = None) -> tuple[list[tuple[str, int, float]], float, float]:
+        """Slices the firms_held best FIP scores the current capital can afford out of a momentum screen
+
+        Parameters
+        ----------
+        screen : output of self.momentum_screen
+        current_capital : (float) representing the amount of cash currently available to invest
+        firms_held : (int) number of firms to hold, defaults to self.firms_held
+
+        Returns
+        --------
+        see self.portfolio_construction
+        """
+
+        if firms_held is None:
+            firms_held = self.firms_held
+
+        positions = screen[0]
+        if len(positions) == 0:
+            return [], 0, current_capital
+
+        top_firms, shares_purchased, cost, _ = self._affordable_firms(
+            screen, current_capital, firms_held)
+
+        tickers = self._screened_tickers()
+        portfolio = [(str(tickers[positions[firm]]), int(shares_purchased[firm]), float(cost[firm]))
+                     for firm in top_firms]
         capital_invested = sum(asset[1] * asset[2] for asset in portfolio)
         cash_left = current_capital - capital_invested
 
         if cash_left < 0:
             raise Exception("Invested over max capital available")
         return portfolio, capital_invested, cash_left
+
+    def portfolio_construction(self, current_capital: int, date: int) -> tuple[list[tuple[str, int, float]], float, float]:
+        """Returns the self.firm_size number of stocks that should be invested in for given date
+
+        Parameters
+        ----------
+        current_capital : (int) representing the amount of cash currently available to invest
+        date : (int) given as YYYYMMDD
+
+        Returns
+        --------
+        portfolio : list[(ticker, shares_purcahsed, cost)] where each tuple represents an allocation into the ticker
+                    buying shares_purchased amount at the next date open with slippage factor included in cost
+
+        capital_invested : (float) capital deployed into the portfolio
+
+        cash_left : (int) uninvested capital
+        """
+
+        self._forget_stale_data()
+        return self.select_portfolio(self._screen(date), current_capital)
+
+
+def _top_k(k: int, keys: list[np.ndarray]) -> np.ndarray:
+    """Returns the positions of the k largest rows, comparing rows lexicographically by keys 
+    (primary key first) exactly as a size k heapq of tuples would
+
+    The primary key is split with a partial sort, only rows tied at the cut are fully sorted
+    """
+
+    primary = keys[0]
+    if len(primary) <= k:
+        return np.arange(len(primary))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+
+    cut = len(primary) - k
+    kth_largest = np.partition(primary, cut)[cut]
+    above = np.flatnonzero(primary > kth_largest)
+    ties = np.flatnonzero(primary == kth_largest)
+
+    needed = k - len(above)
+    if len(ties) > needed:
+        order = np.lexsort([key[ties] for key in reversed(keys)])
+        ties = ties[order[len(ties) - needed:]]
+
+    return np.concatenate((above, ties))
@@ -0,0 +1,518 @@
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from tqdm import tqdm
+
+import profiling
+from storage import PriceStore
+from features import FEATURE_VERSION
+from trading_calendar import TradingCalendar
+
+# Bump when the on-disk layout of the panel cache changes
+PANEL_CACHE_VERSION = 2
+
+# The cache is rebuilt into a new generation folder which manifest.json is then swapped to point at.
+# A superseded generation is removed once unused for GENERATION_GRACE seconds, so a process that read
+# the previous manifest can still open the arrays it points at
+GENERATION_PREFIX = 'generation-'
+BUILD_PREFIX = '.build-'
+GENERATION_GRACE = 3600
+
+# Value and date types of a compact panel (load_panel(dtype=COMPACT_DTYPE)), half the memory of float64/int64.
+# float32 keeps 24 significant bits, every price and feature is within FLOAT32_TOLERANCE (relative)
+# of its float64 value
+COMPACT_DTYPE = np.float32
+COMPACT_DATE_DTYPE = np.int32
+FLOAT32_TOLERANCE = 2.0 ** -24
+
+
+class Panel():
+    """Dense dates x tickers arrays of per-ticker columns (Open, Close, ...)
+
+    Rows follow the master date axis and columns follow self.tickers. A cell is
+    NaN when the ticker's table has no row for that date or the ticker did not trade on it,
+    self.validity() packs which cells hold a trade into one bit each.
+
+    Fields are float64 with int64 dates, or float32 with int32 dates for a compact panel.
+    """
+
+    def __init__(self, dates: np.ndarray, tickers, fields: dict, directory: str = None) -> None:
+
+        dates = np.asarray(dates)
+        self.dates = dates if dates.dtype == COMPACT_DATE_DTYPE else dates.astype(
+            np.int64)
+        self.tickers = np.asarray(tickers)
+        self.fields = fields
+        # Folder the fields are memory-mapped from, None when they live in memory
+        self.directory = directory
+        self._ticker_positions = {ticker: position for position,
+                                  ticker in enumerate(self.tickers)}
+        self._calendar = None
+        self._validity = None
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.fields[field]
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.fields
+
+    def rows(self, field: str, start: int, stop: int) -> np.ndarray:
+        """Returns the dates[start:stop] x tickers values of field"""
+        return self.fields[field][start:stop]
+
+    def ticker_index(self, tickers) -> np.ndarray:
+        """Returns the column positions of the given tickers"""
+        return np.array([self._ticker_positions[ticker] for ticker in tickers], dtype=np.int64)
+
+    def date_index(self, date: int) -> int:
+        """Returns the row of the first date on the axis >= date (len(self.dates) if none)"""
+        return int(np.searchsorted(self.dates, date, side='left'))
+
+    def validity(self) -> np.ndarray:
+        """Returns the packed validity bitmap of the panel, built from Close on first use
+
+        Row t holds one bit per date (np.packbits order) set when tickers[t] traded that day,
+        an array of len(tickers) x ceil(len(dates) / 8) bytes
+        """
+
+        if self._validity is None:
+            # NaN and legacy -1 closes compare False
+            self._validity = np.packbits(self.fields['Close'].T > 0, axis=1)
+        return self._validity
+
+    def valid(self, start: int, stop: int) -> np.ndarray:
+        """Returns the dates[start:stop] x tickers mask of the cells holding a trade, unpacked from self.validity()"""
+
+        offset = start % 8
+        packed = self.validity()[:, start // 8:(stop + 7) // 8]
+        return np.unpackbits(packed, axis=1)[:, offset:offset + stop - start].T.view(bool)
+
+    def calendar(self) -> TradingCalendar:
+        """Returns the trading calendar of the panel's dates, built on first use and shared by every backtest of the panel"""
+
+        if self._calendar is None:
+            self._calendar = TradingCalendar(self.dates)
+        return self._calendar
+
+    @profiling.timed('panel_save')
+    def save(self, directory: str) -> None:
+        """Writes the panel as one .npy file per array so it can be memory-mapped by other processes"""
+
+        os.makedirs(directory, exist_ok=True)
+        _save_array(directory, 'Date', self.dates)
+        _save_array(directory, 'Ticker', self.tickers.astype(str))
+        for field, values in self.fields.items():
+            _save_array(directory, field, values)
+
+    @classmethod
+    def open(cls, directory: str, fields=None, mmap_mode: str = 'r') -> 'Panel':
+        """Opens a panel written by Panel.save, memory-mapping the field arrays (read-only by default)
+
+        Parameters
+        ----------
+        directory : (str) folder given to Panel.save
+        fields : names of the fields to open, defaults to every field in the folder
+        mmap_mode : (str) passed to np.load, None reads the arrays into memory
+        """
+
+        if fields is None:
+            fields = [file_name[:-4] for file_name in sorted(os.listdir(directory))
+                      if file_name.endswith('.npy') and file_name not in ('Date.npy', 'Ticker.npy')]
+
+        return cls(
+            dates=np.load(os.path.join(directory, 'Date.npy')),
+            tickers=np.load(os.path.join(directory, 'Ticker.npy')),
+            fields={field: np.load(os.path.join(directory, f'{field}.npy'), mmap_mode=mmap_mode)
+                    for field in fields},
+            directory=directory)
+
+
+class ChunkedPanel(Panel):
+    """A Panel read from the database chunk_rows dates at a time, for universes whose full panel
+    does not fit in memory
+
+    Only the block of dates holding the rows last asked for is kept, so memory is bounded by
+    chunk_rows x tickers x columns values (see chunk_rows_for_memory) plus the slice returned.
+    Values are served through self.rows and self.valid, the whole fields are never materialized.
+    Reading forward in time loads every block once.
+    """
+
+    def __init__(self, connector: sqlite3.Connection, tickers, columns, chunk_rows: int, dtype=np.float64) -> None:
+        """
+        Parameters
+        ----------
+        connector : (sqlite3.Connection) connection to the stock database
+        tickers : iterable of stock symbols (e.g. universe['Ticker'])
+        columns : names of the numeric columns to serve
+        chunk_rows : (int) dates per block, rounded up to a multiple of 8 to line up with the validity bitmap
+        dtype : np.float64 or COMPACT_DTYPE
+        """
+
+        self.store = PriceStore(connector)
+        self.columns = list(columns)
+        self.dtype = np.dtype(dtype)
+        self.chunk_rows = max(8, -(-int(chunk_rows) // 8) * 8)
+
+        dates = self.store.dates()
+        super().__init__(dates.astype(_date_dtype(self.dtype)), list(tickers), fields={})
+
+        self._block_number = None
+        self._block = None
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        raise TypeError(
+            f"{field} of a ChunkedPanel is only read a block at a time, use rows()")
+
+    def __contains__(self, field: str) -> bool:
+        return field in self.columns
+
+    def rows(self, field: str, start: int, stop: int) -> np.ndarray:
+        """Returns the dates[start:stop] x tickers values of field, reading the blocks they fall in"""
+
+        stop = min(stop, len(self.dates))
+        pieces = []
+        row = start
+        while row < stop:
+            block_number = row // self.chunk_rows
+            block_start = block_number * self.chunk_rows
+            block = self._load_block(block_number)
+            pieces.append(
+                block[field][row - block_start:min(stop - block_start, self.chunk_rows)])
+            row = block_start + self.chunk_rows
+
+        if not pieces:
+            return np.empty((0, len(self.tickers)), dtype=self.dtype)
+        return pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+
+    def valid(self, start: int, stop: int) -> np.ndarray:
+        """Returns the dates[start:stop] x tickers mask of the cells holding a trade, from the Close of those rows only"""
+        # NaN and legacy -1 closes compare False
+        return self.rows('Close', start, stop) > 0
+
+    def validity(self) -> np.ndarray:
+        """Returns the packed validity bitmap of the panel, built block by block on first use (see Panel.validity)"""
+
+        if self._validity is None:
+            self._validity = np.concatenate([np.packbits(self.valid(start, start + self.chunk_rows).T, axis=1)
+                                             for start in range(0, len(self.dates), self.chunk_rows)], axis=1)
+        return self._validity
+
+    def _load_block(self, block_number: int) -> dict:
+
+        if block_number != self._block_number:
+            # Release the previous block before reading the next one
+            self._block = None
+            start = block_number * self.chunk_rows
+            with profiling.timer('panel_load'):
+                self._block = _read_panel(self.store.connector, self.tickers, self.columns,
+                                          dtype=self.dtype, start=start, stop=start + self.chunk_rows).fields
+            self._block_number = block_number
+            profiling.count('panel_chunks')
+
+        return self._block
+
+
+def chunk_rows_for_memory(memory_limit: int, num_of_tickers: int, num_of_columns: int, dtype=np.float64) -> int:
+    """Returns the most dates a ChunkedPanel block of num_of_columns columns can hold within memory_limit bytes"""
+
+    row_bytes = num_of_tickers * num_of_columns * np.dtype(dtype).itemsize
+    return max(8, int(memory_limit) // row_bytes // 8 * 8)
+
+
+def _date_dtype(dtype) -> np.dtype:
+    """Date type of a panel holding values of dtype"""
+    return np.dtype(COMPACT_DATE_DTYPE) if np.dtype(dtype) == COMPACT_DTYPE else np.dtype(np.int64)
+
+
+def _save_array(directory: str, name: str, values: np.ndarray) -> None:
+    """Writes name.npy through a temporary file so readers never map a half written array"""
+
+    temporary_path = os.path.join(directory, f'{name}.npy.tmp')
+    with open(temporary_path, 'wb') as file:
+        np.save(file, values)
+    profiling.count('bytes_written', values.nbytes)
+    os.replace(temporary_path, os.path.join(directory, f'{name}.npy'))
+
+
+def _database_path(connector: sqlite3.Connection) -> str:
+    """Returns the file behind the connection's main database, '' for in-memory databases"""
+
+    for _, name, file in connector.execute("PRAGMA database_list"):
+        if name == 'main':
+            return file
+    return ''
+
+
+def panel_cache_directory(database_path: str) -> str:
+    """Returns where the panel cache of a database lives (next to the database file)"""
+    return f'{database_path}.panel'
+
+
+def _source_fingerprint(connector: sqlite3.Connection, database_path: str) -> list:
+    """Identifies the version of the price and feature data in the database
+
+    Uses the data_version counter kept by PriceStore writes, so result tables written into the same 
+    database do not invalidate the cache. Falls back to the size and modification time of the 
+    database and its write-ahead log when the data was not written through a PriceStore.
+    """
+
+    data_version = PriceStore(connector).data_version()
+    if data_version is not None:
+        return ['data_version', data_version]
+
+    fingerprint = []
+    for path in (database_path, f'{database_path}-wal'):
+        if os.path.exists(path):
+            status = os.stat(path)
+            fingerprint.append([os.path.basename(path),
+                               status.st_size, status.st_mtime_ns])
+    return fingerprint
+
+
+def _field_sources(connector: sqlite3.Connection, database_path: str, columns) -> tuple:
+    """Identifies the version of the rows and of every column in the database (see PriceStore.write_versions)
+
+    Databases not written through a PriceStore fall back to _source_fingerprint for the rows,
+    any change of the file then invalidates every column.
+    """
+
+    rows_version, column_versions = PriceStore(connector).write_versions(columns)
+    if rows_version is None:
+        return _source_fingerprint(connector, database_path), column_versions
+
+    return ['rows_version', rows_version], column_versions
+
+
+def _tickers_digest(tickers) -> str:
+    return hashlib.sha1("\n".join(tickers).encode()).hexdigest()
+
+
+def _read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(directory: str, manifest: dict) -> None:
+    temporary_path = os.path.join(directory, f'manifest.json.{os.getpid()}.tmp')
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temporary_path, os.path.join(directory, 'manifest.json'))
+
+
+def _link_array(source: str, target: str) -> None:
+    """Shares an array file of a previous generation, copying it where hard links are not supported"""
+
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _build_generation(directory: str, panel: Panel, previous: str = None, kept=()) -> str:
+    """Writes panel and the kept fields of the previous generation into a new generation folder
+
+    The folder is filled under a temporary name and renamed once complete, readers only reach it
+    through the manifest written afterwards
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    build_directory = tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=directory)
+    os.chmod(build_directory, 0o755)
+
+    for field in kept:
+        _link_array(os.path.join(directory, previous, f'{field}.npy'),
+                    os.path.join(build_directory, f'{field}.npy'))
+    panel.save(build_directory)
+
+    generation = GENERATION_PREFIX + \
+        os.path.basename(build_directory)[len(BUILD_PREFIX):]
+    os.replace(build_directory, os.path.join(directory, generation))
+    return generation
+
+
+def _remove_superseded(directory: str, current: str, previous: str = None) -> None:
+    """Removes the generations (and abandoned builds) of the cache unused for GENERATION_GRACE seconds
+
+    The grace period of the previous generation starts now, when current replaced it
+    """
+
+    if previous is not None:
+        try:
+            os.utime(os.path.join(directory, previous))
+        except OSError:
+            pass
+
+    now = time.time()
+    for file_name in os.listdir(directory):
+        path = os.path.join(directory, file_name)
+        if file_name.endswith('.npy'):
+            # Arrays of the single folder layout (PANEL_CACHE_VERSION 1)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        elif file_name != current and file_name.startswith((GENERATION_PREFIX, BUILD_PREFIX)):
+            try:
+                unused = now - os.stat(path).st_mtime > GENERATION_GRACE
+            except OSError:
+                continue
+            if unused:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+@profiling.timed('panel_load')
+def load_panel(connector: sqlite3.Connection, tickers, columns=('Open', 'Close'), cache: bool = None, dtype=np.float64, chunk_rows: int = None) -> Panel:
+    """Aligns the requested columns of every ticker to the GE.US date axis
+
+    A columnar cache of the panel (one .npy file per column, see panel_cache_directory) is 
+    memory-mapped with zero copy when it is valid. It is rebuilt whenever the price rows, 
+    the ticker universe, the feature definitions or the dtype change, and missing columns or 
+    columns written since are added to it. Only those columns are read from the database, 
+    the others are carried over from the previous build.
+
+    A build never modifies the arrays a manifest points at, it writes a new generation of the
+    cache (see _build_generation) and atomically swaps the manifest, so a panel can be opened
+    while another process rebuilds it.
+
+    Parameters
+    ----------
+    connector : (sqlite3.Connection) connection to the stock database
+    tickers : iterable of stock symbols (e.g. universe['Ticker'])
+    columns : names of the numeric columns to load
+    cache : (bool) True creates or updates the cache, False bypasses it,
+            None (default) uses the cache only if it already exists
+    dtype : np.float64 or COMPACT_DTYPE, whose values are within FLOAT32_TOLERANCE of float64
+    chunk_rows : (int) return a ChunkedPanel reading this many dates at a time instead (the cache is not used)
+
+    Returns
+    --------
+    panel : (Panel) with one len(dates) x len(tickers) array of dtype per column
+    """
+
+    tickers = list(tickers)
+    columns = list(columns)
+
+    if chunk_rows is not None:
+        return ChunkedPanel(connector, tickers, columns, chunk_rows, dtype=dtype)
+
+    database_path = _database_path(connector)
+    if cache is False or database_path == '':
+        return _read_panel(connector, tickers, columns, dtype=dtype)
+
+    directory = panel_cache_directory(database_path)
+    if cache is None and not os.path.isdir(directory):
+        return _read_panel(connector, tickers, columns, dtype=dtype)
+
+    manifest = _read_manifest(directory)
+    cached_fields = manifest.get('fields')
+    rows_source, field_sources = _field_sources(
+        connector, database_path, columns + list(cached_fields or {}))
+
+    expected = {
+        'version': PANEL_CACHE_VERSION,
+        'features': FEATURE_VERSION,
+        'rows': rows_source,
+        'tickers': _tickers_digest(tickers),
+        'dtype': np.dtype(dtype).name,
+    }
+    if not isinstance(cached_fields, dict) or any(
+            manifest.get(key) != value for key, value in expected.items()):
+        # Stale or new cache, start over
+        cached_fields = {}
+    kept = [field for field, source in cached_fields.items()
+            if source == field_sources[field]]
+
+    missing = [column for column in columns if column not in kept]
+    if missing:
+        panel = _read_panel(connector, tickers, missing, dtype=dtype)
+        previous = manifest.get('generation')
+        generation = _build_generation(directory, panel, previous, kept)
+        manifest = {**expected, 'generation': generation, 'fields': {
+            field: field_sources[field] for field in kept + missing}}
+        _write_manifest(directory, manifest)
+        _remove_superseded(directory, generation, previous)
+
+    return Panel.open(os.path.join(directory, manifest['generation']), fields=columns)
+
+
+def cached_tickers(connector: sqlite3.Connection) -> list:
+    """Returns the ticker universe of the database's panel cache, None when there is no cache
+
+    Backtests run against the same universe (in the same order) reuse the cache instead of rebuilding it
+    """
+
+    database_path = _database_path(connector)
+    if database_path == '':
+        return None
+
+    directory = panel_cache_directory(database_path)
+    generation = _read_manifest(directory).get('generation')
+    if generation is None:
+        return None
+
+    try:
+        return np.load(os.path.join(directory, generation, 'Ticker.npy')).tolist()
+    except OSError:
+        return None
+
+
+def build_panel_cache(connector: sqlite3.Connection, tickers, columns=None, dtype=np.float64) -> Panel:
+    """Creates (or refreshes) the panel cache of the database with OHLCV and every momentum/FIP column
+
+    Parameters
+    ----------
+    connector : (sqlite3.Connection) connection to the stock database
+    tickers : iterable of stock symbols (e.g. universe['Ticker'])
+    columns : names of the columns to cache, defaults to OHLCV plus every computed feature column
+    dtype : np.float64 or COMPACT_DTYPE (see load_panel)
+    """
+
+    tickers = list(tickers)
+    if columns is None:
+        stored = PriceStore(connector).columns(tickers[0])
+        columns = ['Open', 'High', 'Low', 'Close', 'Vol'] + [
+            column for column in stored if column.startswith(('Return_', 'Percent_'))]
+
+    return load_panel(connector, tickers, columns=columns, cache=True, dtype=dtype)
+
+
+def _read_panel(connector: sqlite3.Connection, tickers: list, columns: list, dtype=np.float64, start: int = 0, stop: int = None) -> Panel:
+    """Reads every ticker's history once from the database into a Panel of dtype
+
+    start and stop restrict the panel to the rows dates[start:stop] of the master date axis
+    """
+
+    store = PriceStore(connector)
+    dates = store.dates()[start:stop]
+
+    fields = {column: np.full((len(dates), len(tickers)), np.nan, dtype=dtype)
+              for column in columns}
+    if len(dates) == 0:
+        return Panel(dates.astype(_date_dtype(dtype)), tickers, fields)
+
+    # Blocks of a ChunkedPanel are read without a progress bar
+    for position, ticker in enumerate(tickers if stop is not None else tqdm(tickers)):
+        values = store.rows(ticker, columns, dates[0], dates[-1])
+        if len(values) == 0:
+            continue
+
+        ticker_dates = values[:, 0].astype(np.int64)
+
+        # Only keep rows whose date exists on the master axis
+        rows_on_axis = np.searchsorted(dates, ticker_dates).clip(
+            max=len(dates) - 1)
+        on_axis = dates[rows_on_axis] == ticker_dates
+
+        for column_number, column in enumerate(columns):
+            fields[column][rows_on_axis[on_axis],
+                           position] = values[on_axis, column_number + 1]
+
+    return Panel(dates.astype(_date_dtype(dtype)), tickers, fields)
@@ -0,0 +1,189 @@
+import functools
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+# Directory profiles are written to, e.g. BACKTEST_PROFILE=profiles/ (1 or true write to ./profiles)
+PROFILE_ENVIRONMENT_VARIABLE = 'BACKTEST_PROFILE'
+DEFAULT_PROFILE_DIRECTORY = 'profiles'
+
+# Shared by every timer() call while no run is being profiled
+_NO_TIMER = nullcontext()
+
+# Where profiles are written, None when profiling is off
+_directory = None
+# Profile of the run in progress, None outside a run
+_profile = None
+_runs_written = 0
+
+
+class Profile():
+    """Named timers and counters collected during one run (a backtest, compute_parameters, a sweep...)
+
+    Timers measure wall time and may nest, e.g. sql_read is also counted inside panel_load.
+    Counters used by the pipeline:
+        - sql_queries : statements sent to SQLite (an executemany counts once)
+        - rows_read, rows_written : rows returned by or sent to SQLite
+        - bytes_written : size of the values written to SQLite or to panel .npy files
+        - rebalances, screens : portfolios simulated and momentum screens computed
+        - panel_chunks : blocks of dates read by a ChunkedPanel
+    """
+
+    def __init__(self, name: str) -> None:
+
+        self.name = name
+        self.started = datetime.now(timezone.utc)
+        self.timers = {}
+        self.counters = {}
+        self._start = time.perf_counter()
+
+    def add_time(self, name: str, seconds: float) -> None:
+
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [seconds, 1]
+        else:
+            timer[0] += seconds
+            timer[1] += 1
+
+    def report(self) -> dict:
+        """Returns the profile as a JSON serializable dict"""
+
+        return {
+            'run': self.name,
+            'started': self.started.isoformat(timespec='milliseconds'),
+            'pid': os.getpid(),
+            'wall_seconds': time.perf_counter() - self._start,
+            'timers': {name: {'seconds': seconds, 'calls': calls}
+                       for name, (seconds, calls) in sorted(self.timers.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+
+class _Timer():
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile: Profile, name: str) -> None:
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable(directory: str = DEFAULT_PROFILE_DIRECTORY) -> None:
+    """Profiles every following run, writing one JSON file per run into directory"""
+
+    global _directory, _profile
+    _directory = directory
+    # A forked worker must not add to its parent's run
+    _profile = None
+
+
+def disable() -> None:
+
+    global _directory, _profile
+    _directory = None
+    _profile = None
+
+
+def profile_directory():
+    """Returns the directory profiles are written to, None when profiling is off"""
+    return _directory
+
+
+def active() -> bool:
+    """True while a run is being profiled, guards counters whose value is costly to compute"""
+    return _profile is not None
+
+
+def timer(name: str):
+    """Context manager adding its wall time to the timer name of the current run, a no-op outside one"""
+
+    if _profile is None:
+        return _NO_TIMER
+    return _Timer(_profile, name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Adds amount to the counter name of the current run, a no-op outside one"""
+
+    if _profile is not None:
+        _profile.counters[name] = _profile.counters.get(name, 0) + amount
+
+
+@contextmanager
+def run(name: str):
+    """Profiles the block as one run and writes its profile when it ends
+
+    Runs started inside another run are part of the outer run's profile
+    """
+
+    global _profile, _runs_written
+
+    if _directory is None or _profile is not None:
+        yield _profile
+        return
+
+    _profile = Profile(name)
+    try:
+        yield _profile
+    finally:
+        profile, _profile = _profile, None
+
+        os.makedirs(_directory, exist_ok=True)
+        _runs_written += 1
+        path = os.path.join(
+            _directory, f"{name}_{profile.started:%Y%m%d-%H%M%S}_{os.getpid()}_{_runs_written}.json")
+        with open(path, 'w') as file:
+            json.dump(profile.report(), file, indent=2)
+
+
+def profiled(name: str):
+    """Decorator profiling every call of the function as a run (see run)"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _directory is None:
+                return function(*args, **kwargs)
+            with run(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def timed(name: str):
+    """Decorator adding the wall time of every call of the function to the timer name (see timer)"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return function(*args, **kwargs)
+            with _Timer(_profile, name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def _configure_from_environment() -> None:
+
+    value = os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, '').strip()
+    if value.lower() in ('', '0', 'false'):
+        return
+
+    enable(DEFAULT_PROFILE_DIRECTORY if value.lower()
+           in ('1', 'true') else value)
+
+
+_configure_from_environment()
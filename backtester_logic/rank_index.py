@@ -0,0 +1,154 @@
+import json
+import os
+import numpy as np
+
+from features import FEATURE_VERSION
+from panel import _tickers_digest
+from storage import PriceStore
+
+# Bump when the layout of the rank index file or the screen it stores changes
+RANK_INDEX_VERSION = 1
+
+
+class RankIndex():
+    """Momentum screens of every trading date for one (look_back, lottery_window) strategy and universe
+
+    The screen of dates[row] (see QuantitativeMomentum.momentum_screen) is stored ragged: its ticker
+    positions, FIP scores and next day opens are the entries offsets[row]:offsets[row + 1] of the flat
+    arrays, best FIP score first. Only the screened top decile is kept, about a tenth of the cells of
+    one panel column, so a portfolio of any size is a lookup and a slice.
+    """
+
+    def __init__(self, dates: np.ndarray, tickers, offsets: np.ndarray, positions: np.ndarray, fip_score: np.ndarray, next_open: np.ndarray) -> None:
+
+        self.dates = np.asarray(dates, dtype=np.int64)
+        self.tickers = np.asarray(tickers)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.positions = np.asarray(positions, dtype=np.int32)
+        self.fip_score = np.asarray(fip_score, dtype=np.float64)
+        self.next_open = np.asarray(next_open, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def screen(self, date: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the screen of the first trading day >= date, as QuantitativeMomentum.momentum_screen does"""
+
+        row = int(np.searchsorted(self.dates, date, side='left'))
+        if row >= len(self.dates):
+            return (np.array([], dtype=np.int64), np.array([]), np.array([]))
+
+        entries = slice(self.offsets[row], self.offsets[row + 1])
+        return self.positions[entries].astype(np.int64), self.fip_score[entries], self.next_open[entries]
+
+    def extend(self, first_row: int, dates: np.ndarray, screens: list) -> 'RankIndex':
+        """Returns an index keeping the screens before first_row and holding screens for dates[first_row:]
+
+        Parameters
+        ----------
+        first_row : (int) first row screened again, the rows before must be on the same dates
+        dates : np.ndarray of the whole master date axis
+        screens : list of the momentum_screen output of every date in dates[first_row:]
+        """
+
+        kept = self.offsets[first_row]
+        sizes = np.array([len(positions) for positions, _, _ in screens], dtype=np.int64)
+
+        return RankIndex(
+            dates=dates,
+            tickers=self.tickers,
+            offsets=np.concatenate((self.offsets[:first_row + 1], kept + np.cumsum(sizes))),
+            positions=np.concatenate(
+                [self.positions[:kept]] + [positions for positions, _, _ in screens]),
+            fip_score=np.concatenate(
+                [self.fip_score[:kept]] + [fip_score for _, fip_score, _ in screens]),
+            next_open=np.concatenate(
+                [self.next_open[:kept]] + [next_open for _, _, next_open in screens]))
+
+    def save(self, path: str, manifest: dict) -> None:
+        """Writes the index and the manifest it was built under to one .npz file"""
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # np.savez adds .npz to names without it
+        temporary_path = f'{path}.tmp.npz'
+        np.savez(temporary_path, manifest=np.array(json.dumps(manifest)), dates=self.dates,
+                 tickers=self.tickers.astype(str), offsets=self.offsets, positions=self.positions,
+                 fip_score=self.fip_score, next_open=self.next_open)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> tuple['RankIndex', dict]:
+        """Reads an index written by RankIndex.save, returns (None, {}) when there is none"""
+
+        try:
+            with np.load(path) as arrays:
+                manifest = json.loads(str(arrays['manifest']))
+                index = cls(**{name: arrays[name] for name in (
+                    'dates', 'tickers', 'offsets', 'positions', 'fip_score', 'next_open')})
+        except (OSError, KeyError, ValueError):
+            return None, {}
+
+        return index, manifest
+
+    @classmethod
+    def empty(cls, tickers) -> 'RankIndex':
+        return cls(dates=[], tickers=tickers, offsets=[0], positions=[], fip_score=[], next_open=[])
+
+
+def rank_index_path(database_path: str, look_back: int, lottery_window: int) -> str:
+    """Returns where the rank index of a (look_back, lottery_window) strategy lives (next to the database file)"""
+    return os.path.join(f'{database_path}.ranks', f'momentum_{look_back}_{lottery_window}.npz')
+
+
+def rank_index_manifest(tickers, look_back: int, lottery_window: int) -> dict:
+    """Identifies what a rank index was built for, an index built for anything else is rebuilt"""
+
+    return {
+        'version': RANK_INDEX_VERSION,
+        'features': FEATURE_VERSION,
+        'tickers': _tickers_digest(list(tickers)),
+        'look_back': look_back,
+        'lottery_window': lottery_window,
+    }
+
+
+def first_stale_row(index: RankIndex, manifest: dict, expected: dict, store: PriceStore, dates: np.ndarray, source: list, columns=None) -> int:
+    """Returns the first row of dates whose stored screen may be out of date, len(dates) when none is
+
+    Screens before the earliest date written since the index was built are kept, writes of other
+    columns than the screen's are ignored. The screen of the day before it is redone too, as it buys
+    at that date's open.
+
+    Parameters
+    ----------
+    index, manifest : as returned by RankIndex.load
+    expected : rank_index_manifest of the strategy, 0 is returned when the index was built for another one
+    store : (PriceStore) of the database the index was built from
+    dates : np.ndarray of the master date axis
+    source : fingerprint of the database's data (see panel._source_fingerprint)
+    columns : names of the columns the screens are computed from, defaults to every column
+    """
+
+    if index is None or any(manifest.get(key) != value for key, value in expected.items()):
+        return 0
+
+    built_from = manifest.get('source')
+    if built_from == source:
+        return len(index)
+    # Without the data_version write log any change could be anywhere
+    if not built_from or not source or built_from[0] != 'data_version' or source[0] != 'data_version':
+        return 0
+
+    first_date = store.first_date_written_since(built_from[1], columns)
+    if first_date == 0:
+        return 0
+
+    first_row = len(index) if first_date is None else max(
+        int(np.searchsorted(dates, first_date, side='left')) - 1, 0)
+    first_row = min(first_row, len(index), len(dates))
+
+    # The axis itself was rewritten
+    if not np.array_equal(index.dates[:first_row], dates[:first_row]):
+        return 0
+
+    return first_row
@@ -0,0 +1,507 @@
+import numpy as np
+import pandas as pd
+import sqlite3
+from tqdm import tqdm
+
+import profiling
+from utils import _ticker_to_table_name
+
+PRICES_TABLE = 'prices'
+
+# key/value table holding the data_version counter, bumped on every write of price or feature data,
+# the versions of the last writes of rows and of single columns (see PriceStore.write_versions)
+# and the feature columns still being computed
+METADATA_TABLE = 'store_metadata'
+
+# Earliest date and columns (comma separated, NULL for every column) each data_version may have changed,
+# lets data derived from the store (see rank_index) recompute only the dates after it
+WRITES_TABLE = 'store_writes'
+
+# Every ticker is aligned to GE.US's trading days (see data_preparation.ipynb)
+DATE_AXIS_TICKER = "GE.US"
+
+# Days a ticker did not trade (before its listing or once halted) are stored as NULL and read as NaN,
+# databases written before marked them with -1 which readers also turn into NaN
+LEGACY_MISSING_VALUE = -1
+
+PRICE_COLUMNS = {
+    'Per': 'TEXT',
+    'Time': 'INTEGER',
+    'Open': 'REAL',
+    'High': 'REAL',
+    'Low': 'REAL',
+    'Close': 'REAL',
+    'Vol': 'INTEGER',
+    'Openint': 'INTEGER',
+}
+
+
+def _has_prices_table(connector: sqlite3.Connection) -> bool:
+    return connector.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (PRICES_TABLE,)).fetchone() is not None
+
+
+def create_prices_table(connector: sqlite3.Connection) -> None:
+    """Creates the long format prices table, one row per (Ticker, Date) clustered on that key"""
+
+    price_columns = ",\n".join(
+        f"{column} {column_type}" for column, column_type in PRICE_COLUMNS.items())
+
+    with connector:
+        connector.execute(f"""CREATE TABLE IF NOT EXISTS {PRICES_TABLE} (
+            Ticker TEXT NOT NULL,
+            Date INTEGER NOT NULL,
+            {price_columns},
+            PRIMARY KEY (Ticker, Date)
+            ) WITHOUT ROWID""")
+        connector.execute(
+            f"CREATE INDEX IF NOT EXISTS {PRICES_TABLE}_date ON {PRICES_TABLE} (Date)")
+
+
+class PriceStore():
+    """Reads and writes per-ticker daily bars in either database layout
+
+        - Long format: a single prices table keyed by (Ticker, Date) with an integer Date
+        - Legacy: one table per ticker named with _ticker_to_table_name
+
+    The layout is detected once when the store is created, the long format is used whenever
+    the prices table exists.
+    """
+
+    def __init__(self, connector: sqlite3.Connection) -> None:
+
+        self.connector = connector
+        self.long_format = _has_prices_table(connector)
+        # Whether the write log has its columns field, checked until it does
+        self._has_writes_columns = False
+
+    def dates(self) -> np.ndarray:
+        """Returns the master date axis as sorted YYYYMMDD ints"""
+
+        with profiling.timer('sql_read'):
+            if self.long_format:
+                query = f"SELECT Date FROM {PRICES_TABLE} WHERE Ticker = ? ORDER BY Date"
+                rows = self.connector.execute(
+                    query, (DATE_AXIS_TICKER,)).fetchall()
+            else:
+                query = f"SELECT CAST(Date AS INTEGER) AS Date FROM {_ticker_to_table_name(DATE_AXIS_TICKER)} ORDER BY Date"
+                rows = self.connector.execute(query).fetchall()
+        _count_read(len(rows))
+
+        return np.array(rows, dtype=np.int64).reshape(-1)
+
+    def tickers(self) -> list[str]:
+        """Returns every ticker with stored bars, sorted
+
+        In the legacy layout tickers are recovered from the table names, so a dash in a symbol 
+        comes back as an underscore (both map to the same table)
+        """
+
+        if self.long_format:
+            rows = self.connector.execute(
+                f"SELECT DISTINCT Ticker FROM {PRICES_TABLE} ORDER BY Ticker").fetchall()
+            return [ticker for (ticker,) in rows]
+
+        rows = self.connector.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE '%\\_US' ESCAPE '\\' ORDER BY name").fetchall()
+        return [f'{table_name[:-3]}.US' for (table_name,) in rows]
+
+    def columns(self, ticker: str) -> list[str]:
+        """Returns the column names stored for ticker"""
+
+        table_name = PRICES_TABLE if self.long_format else _ticker_to_table_name(
+            ticker)
+        return [row[1] for row in self.connector.execute(f"PRAGMA table_info({table_name})")]
+
+    def read(self, ticker: str, columns=None) -> pd.DataFrame:
+        """Returns the full history of ticker ordered by date
+
+        Parameters
+        ----------
+        ticker : (str) the stock symbol.US in all caps
+        columns : names of the columns to read (Date is always included), defaults to every column
+        """
+
+        selected = "*" if columns is None else ", ".join(
+            ['Date'] + [column for column in columns if column != 'Date'])
+
+        with profiling.timer('sql_read'):
+            if self.long_format:
+                ticker_df = pd.read_sql_query(
+                    f"SELECT {selected} FROM {PRICES_TABLE} WHERE Ticker = ? ORDER BY Date",
+                    con=self.connector, params=(ticker,))
+            else:
+                ticker_df = pd.read_sql_query(
+                    f"SELECT {selected} FROM {_ticker_to_table_name(ticker)}",
+                    con=self.connector)
+        _count_read(len(ticker_df))
+
+        return _legacy_missing_to_nan(ticker_df)
+
+    def rows(self, ticker: str, columns, start_date: int = None, end_date: int = None) -> np.ndarray:
+        """Returns [Date, *columns] of ticker as a float64 array, missing values (NULL or -1) read as NaN
+
+        start_date and end_date (YYYYMMDD, inclusive) restrict the rows to a range of dates
+        """
+
+        selected = ", ".join(columns)
+        date_range = (-1 if start_date is None else int(start_date),
+                      99999999 if end_date is None else int(end_date))
+
+        with profiling.timer('sql_read'):
+            if self.long_format:
+                rows = self.connector.execute(
+                    f"SELECT Date, {selected} FROM {PRICES_TABLE} WHERE Ticker = ? AND Date BETWEEN ? AND ?",
+                    (ticker, *date_range)).fetchall()
+            else:
+                rows = self.connector.execute(
+                    f"SELECT CAST(Date AS INTEGER), {selected} FROM {_ticker_to_table_name(ticker)} WHERE CAST(Date AS INTEGER) BETWEEN ? AND ?",
+                    date_range).fetchall()
+        _count_read(len(rows))
+
+        values = np.array(rows, dtype=np.float64).reshape(-1, len(columns) + 1)
+        values[:, 1:][values[:, 1:] == LEGACY_MISSING_VALUE] = np.nan
+        return values
+
+    def tail(self, ticker: str, rows: int, columns=None) -> pd.DataFrame:
+        """Returns the last rows of ticker's history ordered by date
+
+        Parameters
+        ----------
+        ticker : (str) the stock symbol.US in all caps
+        rows : (int) number of trailing rows to read
+        columns : names of the columns to read (Date is always included), defaults to every column
+        """
+
+        selected = "*" if columns is None else ", ".join(
+            ['Date'] + [column for column in columns if column != 'Date'])
+        table_name = PRICES_TABLE if self.long_format else _ticker_to_table_name(
+            ticker)
+        where = "WHERE Ticker = ?" if self.long_format else ""
+        params = (ticker, rows) if self.long_format else (rows,)
+
+        with profiling.timer('sql_read'):
+            ticker_df = pd.read_sql_query(
+                f"SELECT {selected} FROM {table_name} {where} ORDER BY CAST(Date AS INTEGER) DESC LIMIT ?",
+                con=self.connector, params=params)
+        _count_read(len(ticker_df))
+
+        return _legacy_missing_to_nan(ticker_df.iloc[::-1].reset_index(drop=True))
+
+    @profiling.timed('sql_write')
+    def append(self, ticker: str, new_rows: pd.DataFrame) -> None:
+        """Upserts new_rows (must include Date) into ticker's history without touching older rows"""
+
+        columns = [column for column in new_rows.columns
+                   if column not in ('Ticker', 'Date')]
+
+        if not self.long_format:
+            table_name = _ticker_to_table_name(ticker)
+            self.add_columns(columns, ticker=ticker)
+            # The Ticker column is only kept by tables created with it
+            columns = ['Date'] + columns + \
+                (['Ticker'] if 'Ticker' in new_rows and 'Ticker' in self.columns(ticker) else [])
+            with self.connector:
+                self._bump_data_version(_first_date(new_rows))
+                self.connector.executemany(
+                    f"DELETE FROM {table_name} WHERE CAST(Date AS INTEGER) = ?",
+                    ((int(date),) for date in new_rows['Date']))
+                self.connector.executemany(
+                    f"""INSERT INTO {table_name} ({', '.join(f'"{column}"' for column in columns)})
+                    VALUES ({', '.join('?' * len(columns))})""",
+                    _sql_rows(new_rows, columns))
+            return
+
+        self.add_columns([column for column in columns
+                          if column not in PRICE_COLUMNS])
+        assignments = ", ".join(
+            f"{column} = excluded.{column}" for column in columns)
+        with self.connector:
+            self._bump_data_version(_first_date(new_rows))
+            self.connector.executemany(
+                f"""INSERT INTO {PRICES_TABLE} (Ticker, Date, {', '.join(columns)})
+                VALUES (?, ?, {', '.join('?' * len(columns))})
+                ON CONFLICT (Ticker, Date) DO UPDATE SET {assignments}""",
+                _sql_rows(new_rows, ['Date'] + columns, prefix=(ticker,)))
+
+    def valid_days(self, ticker: str) -> int:
+        """Returns the number of days ticker traded (Close is a price, not NULL or -1)"""
+
+        if self.long_format:
+            row = self.connector.execute(
+                f"SELECT COUNT(*) FROM {PRICES_TABLE} WHERE Ticker = ? AND Close > 0", (ticker,)).fetchone()
+        else:
+            row = self.connector.execute(
+                f"SELECT COUNT(*) FROM {_ticker_to_table_name(ticker)} WHERE Close > 0").fetchone()
+
+        return row[0]
+
+    def data_version(self):
+        """Returns a counter bumped by every write through a PriceStore, None if nothing has been 
+        written through one yet (e.g. tables created directly with to_sql)"""
+
+        exists = self.connector.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (METADATA_TABLE,)).fetchone()
+        if exists is None:
+            return None
+
+        row = self.connector.execute(
+            f"SELECT value FROM {METADATA_TABLE} WHERE key = 'data_version'").fetchone()
+        return None if row is None else row[0]
+
+    def first_date_written_since(self, data_version: int, columns=None):
+        """Returns the earliest YYYYMMDD date the writes made after data_version may have changed,
+        0 when any date may have and None when nothing was written since
+
+        columns : only count the writes that may have changed these columns, defaults to every write
+        """
+
+        current = self.data_version()
+        if current is None or current == data_version:
+            return None
+        if current < data_version:
+            return 0
+
+        exists = self.connector.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (WRITES_TABLE,)).fetchone()
+        if exists is None:
+            return 0
+
+        writes = self.connector.execute(
+            f"SELECT first_date, {self._writes_columns()} FROM {WRITES_TABLE} WHERE version > ?", (data_version,)).fetchall()
+        # Writes made before the log existed are missing from it
+        if len(writes) != current - data_version:
+            return 0
+
+        first_dates = [first_date for first_date, written in writes
+                       if columns is None or written is None or not set(written.split(',')).isdisjoint(columns)]
+        return min(first_dates) if first_dates else None
+
+    def write_versions(self, columns) -> tuple:
+        """Returns the data_version of the last write that may have changed any column (rows added,
+        replaced or removed) and a dict of the data_version of the last write that may have changed each
+        of columns. Both are None when nothing was written through a PriceStore.
+
+        Data derived from a few columns (see panel.load_panel) stays valid while their versions
+        do, whatever other columns were written since.
+        """
+
+        data_version = self.data_version()
+        if data_version is None:
+            return None, {column: None for column in columns}
+
+        versions = dict(self.connector.execute(
+            f"SELECT key, value FROM {METADATA_TABLE} WHERE key = 'rows_version' OR key LIKE 'column_version:%'").fetchall())
+        # Writes made before the versions were kept may have changed anything
+        rows_version = versions.get('rows_version', data_version)
+
+        return rows_version, {column: max(rows_version, versions.get(f'column_version:{column}', 0))
+                              for column in columns}
+
+    def _bump_data_version(self, first_date: int = 0, columns=None) -> None:
+        """Marks price/feature data as changed from first_date on (0 for every date), must run inside the writing transaction
+
+        columns : the only columns the write changed (no row added or removed), defaults to every column
+        """
+
+        self.connector.execute(
+            f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (key TEXT PRIMARY KEY, value INTEGER)")
+        # Writes made before the rows version was kept are dated to the version they left
+        self.connector.execute(
+            f"""INSERT OR IGNORE INTO {METADATA_TABLE} (key, value)
+            SELECT 'rows_version', value FROM {METADATA_TABLE} WHERE key = 'data_version'""")
+        self.connector.execute(
+            f"""INSERT INTO {METADATA_TABLE} (key, value) VALUES ('data_version', 1)
+            ON CONFLICT (key) DO UPDATE SET value = value + 1""")
+
+        keys = ['rows_version'] if columns is None else [
+            f'column_version:{column}' for column in columns]
+        self.connector.executemany(
+            f"""INSERT OR REPLACE INTO {METADATA_TABLE} (key, value)
+            SELECT ?, value FROM {METADATA_TABLE} WHERE key = 'data_version'""", [(key,) for key in keys])
+
+        self.connector.execute(
+            f"CREATE TABLE IF NOT EXISTS {WRITES_TABLE} (version INTEGER PRIMARY KEY, first_date INTEGER NOT NULL, columns TEXT)")
+        if self._writes_columns() == 'NULL':
+            self.connector.execute(
+                f"ALTER TABLE {WRITES_TABLE} ADD COLUMN columns TEXT")
+            self._has_writes_columns = True
+        self.connector.execute(
+            f"""INSERT OR REPLACE INTO {WRITES_TABLE} (version, first_date, columns)
+            SELECT value, ?, ? FROM {METADATA_TABLE} WHERE key = 'data_version'""",
+            (int(first_date), None if columns is None else ','.join(columns)))
+
+    def _writes_columns(self) -> str:
+        """Returns the columns field of the write log, NULL for a log written before it was kept"""
+
+        if not self._has_writes_columns:
+            self._has_writes_columns = 'columns' in [row[1] for row in self.connector.execute(
+                f"PRAGMA table_info({WRITES_TABLE})")]
+        return 'columns' if self._has_writes_columns else 'NULL'
+
+    def incomplete_columns(self) -> set[str]:
+        """Returns the feature columns whose computation was started but has not finished (see mark_incomplete)"""
+
+        exists = self.connector.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (METADATA_TABLE,)).fetchone()
+        if exists is None:
+            return set()
+
+        rows = self.connector.execute(
+            f"SELECT key FROM {METADATA_TABLE} WHERE key LIKE 'incomplete:%'").fetchall()
+        return {key[len('incomplete:'):] for key, in rows}
+
+    def mark_incomplete(self, columns, incomplete: bool = True) -> None:
+        """Flags columns as being computed ticker by ticker, so a run that is aborted half way
+        is not mistaken for a finished one, and clears the flag once every ticker is written"""
+
+        with self.connector:
+            self.connector.execute(
+                f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (key TEXT PRIMARY KEY, value INTEGER)")
+            if incomplete:
+                self.connector.executemany(
+                    f"INSERT OR REPLACE INTO {METADATA_TABLE} (key, value) VALUES (?, 1)",
+                    [(f'incomplete:{column}',) for column in columns])
+            else:
+                self.connector.executemany(
+                    f"DELETE FROM {METADATA_TABLE} WHERE key = ?",
+                    [(f'incomplete:{column}',) for column in columns])
+
+    def add_columns(self, columns, column_type: str = 'REAL', ticker: str = None) -> None:
+        """Adds feature columns to the prices table (to ticker's table in the legacy layout) if they are not already there
+
+        Price columns get their PRICE_COLUMNS type, any other column column_type
+        """
+
+        if self.long_format:
+            table_name = PRICES_TABLE
+            existing = set(self.columns(DATE_AXIS_TICKER))
+        elif ticker is None:
+            return
+        else:
+            table_name = _ticker_to_table_name(ticker)
+            existing = set(self.columns(ticker))
+
+        with self.connector:
+            for column in columns:
+                if column not in existing:
+                    self.connector.execute(
+                        f"ALTER TABLE {table_name} ADD COLUMN {column} {PRICE_COLUMNS.get(column, column_type)}")
+
+    @profiling.timed('sql_write')
+    def write(self, ticker: str, ticker_df: pd.DataFrame, columns=None) -> None:
+        """Stores ticker_df as the history of ticker
+
+        Parameters
+        ----------
+        ticker : (str) the stock symbol.US in all caps
+        ticker_df : (pd.DataFrame) rows to store, must include Date
+        columns : only update these columns of existing rows (long format), defaults to replacing every row
+        """
+
+        if not self.long_format:
+            table_name = _ticker_to_table_name(ticker)
+            columns = list(ticker_df.columns)
+            with self.connector:
+                # The bump opens the transaction, sqlite3 would commit the DROP on its own
+                self._bump_data_version()
+                self.connector.execute(f"DROP TABLE IF EXISTS {table_name}")
+                # Same schema as DataFrame.to_sql creates
+                self.connector.execute(pd.io.sql.get_schema(
+                    ticker_df, table_name, con=self.connector))
+                self.connector.executemany(
+                    f"""INSERT INTO {table_name} ({', '.join(f'"{column}"' for column in columns)})
+                    VALUES ({', '.join('?' * len(columns))})""",
+                    _sql_rows(ticker_df, columns))
+            return
+
+        if columns is None:
+            columns = [column for column in ticker_df.columns
+                       if column not in ('Ticker', 'Date')]
+            self.add_columns([column for column in columns
+                              if column not in PRICE_COLUMNS])
+            with self.connector:
+                self._bump_data_version()
+                self.connector.execute(
+                    f"DELETE FROM {PRICES_TABLE} WHERE Ticker = ?", (ticker,))
+                self.connector.executemany(
+                    f"""INSERT INTO {PRICES_TABLE} (Ticker, Date, {', '.join(columns)})
+                    VALUES (?, ?, {', '.join('?' * len(columns))})""",
+                    _sql_rows(ticker_df, ['Date'] + columns, prefix=(ticker,)))
+        else:
+            self.add_columns(columns)
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            with self.connector:
+                self._bump_data_version(_first_date(ticker_df), columns)
+                self.connector.executemany(
+                    f"UPDATE {PRICES_TABLE} SET {assignments} WHERE Date = ? AND Ticker = ?",
+                    _sql_rows(ticker_df, columns + ['Date'], suffix=(ticker,)))
+
+
+def _first_date(ticker_df: pd.DataFrame) -> int:
+    """Earliest Date of the rows written, 0 when there are none"""
+    return int(ticker_df['Date'].astype(np.int64).min()) if len(ticker_df) else 0
+
+
+def _legacy_missing_to_nan(ticker_df: pd.DataFrame) -> pd.DataFrame:
+    """Replaces the -1 a legacy database stores for days without a trade by NaN in every numeric column but Date"""
+
+    columns = [column for column in ticker_df.select_dtypes('number').columns
+               if column != 'Date']
+    missing = ticker_df[columns] == LEGACY_MISSING_VALUE
+    if missing.to_numpy().any():
+        ticker_df[columns] = ticker_df[columns].mask(missing)
+
+    return ticker_df
+
+
+def _count_read(rows: int) -> None:
+    profiling.count('sql_queries')
+    profiling.count('rows_read', rows)
+
+
+def _count_written(data: pd.DataFrame) -> None:
+    """Counts one statement writing the rows of data, bytes are the in-memory size of its values"""
+
+    if profiling.active():
+        profiling.count('sql_queries')
+        profiling.count('rows_written', len(data))
+        profiling.count('bytes_written', int(
+            data.memory_usage(index=False).sum()))
+
+
+def _sql_rows(ticker_df: pd.DataFrame, columns, prefix=(), suffix=()):
+    """Yields python tuples of columns ready for executemany, NaN is stored as NULL and Date as an int"""
+
+    data = ticker_df[columns].copy()
+    _count_written(data)
+    data['Date'] = data['Date'].astype(np.int64)
+    data = data.astype(object).where(data.notna(), None)
+
+    for row in data.itertuples(index=False, name=None):
+        yield (*prefix, *row, *suffix)
+
+
+def migrate_to_prices_table(connector: sqlite3.Connection, tickers, drop_legacy: bool = False) -> None:
+    """Copies every per-ticker table into the long format prices table
+
+    Parameters
+    ----------
+    connector : (sqlite3.Connection) connection to the stock database
+    tickers : iterable of stock symbols whose legacy tables should be migrated
+    drop_legacy : (bool) drop each legacy table once its rows have been copied
+    """
+
+    create_prices_table(connector)
+    legacy_store = PriceStore(connector)
+    legacy_store.long_format = False
+    store = PriceStore(connector)
+
+    for ticker in tqdm(list(tickers)):
+        ticker_df = legacy_store.read(ticker)
+        store.write(ticker, ticker_df)
+
+        if drop_legacy:
+            with connector:
+                connector.execute(
+                    f"DROP TABLE {_ticker_to_table_name(ticker)}")
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+from decouple import config
+from trading_calendar import SEASONAL_ANCHOR_MONTHS
+
+# Multiplier applied to the open a position is bought at
+SLIPPAGE_FACTOR = float(config('SLIPPAGE_FACTOR'))
+
+
+class Strategy(ABC):
+    """Base class of the strategies the Backtester runs
+
+    A strategy decides, for a batch of rebalance dates at once, which fraction of the portfolio's
+    equity to hold in each ticker of its universe. The Backtester turns the weights into whole
+    shares bought at the next trading day's open (times SLIPPAGE_FACTOR) and holds them until the
+    next rebalance date, so a strategy never deals with capital, shares or prices.
+
+    Subclasses set
+        - self.tickers : (pd.DataFrame) universe with a 'Ticker' column, the columns of the weights
+        - self.rebalance_period : (int) months between rebalances when none is given to the Backtester
+        - self.seasonality : (str) None rebalances rebalance_period months after the previous rebalance,
+                             'smart', 'avg' or 'dumb' at the close of fixed months (see trading_calendar)
+    """
+
+    def __init__(self, tickers: pd.DataFrame, rebalance_period: int = 3, seasonality: str = None) -> None:
+
+        if seasonality is not None and seasonality not in SEASONAL_ANCHOR_MONTHS:
+            raise ValueError(
+                f"seasonality must be one of {', '.join(SEASONAL_ANCHOR_MONTHS)} or None, not {seasonality}")
+
+        self.tickers = tickers
+        self.rebalance_period = rebalance_period
+        self.seasonality = seasonality
+
+    @abstractmethod
+    def target_weights(self, rebalance_dates) -> np.ndarray:
+        """Returns the portfolio to hold after each rebalance date
+
+        Parameters
+        ----------
+        rebalance_dates : list[int] of YYYYMMDD dates the portfolio is rebalanced on (after the close)
+
+        Returns
+        --------
+        weights : np.ndarray of shape len(rebalance_dates) x len(self.tickers), the fraction of equity
+                  to invest in each ticker. Rows must be non-negative and sum to at most 1, the rest is
+                  kept as cash
+        """
+
+    def allocate(self, rebalance_date: int, weights: np.ndarray, capital: float, **options) -> np.ndarray:
+        """Returns the weights actually held after rebalance_date once the capital to invest is known
+
+        Called by the Backtester for every holding period with one row of target_weights. A strategy
+        whose picks depend on which shares the capital can buy overrides it, by default the weights
+        are kept and the capital of a ticker too expensive for its weight stays in cash.
+
+        Parameters
+        ----------
+        rebalance_date : (int) YYYYMMDD date the row of weights was computed for
+        weights : np.ndarray over self.tickers, a row of self.target_weights(...)
+        capital : (float) equity invested on the next trading day's open
+        options : the keyword arguments target_weights was called with (e.g. firms_held)
+        """
+        return weights
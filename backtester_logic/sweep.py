@@ -0,0 +1,346 @@
+from momentum_strategy import QuantitativeMomentum
+from backtester import Backtester
+from features import _feature_columns
+from panel import Panel, load_panel, cached_tickers
+from storage import PriceStore
+from file_lock import FileLock
+from utils import _strategy_table_convention, STATISTICS_TABLE, PARAMETER_COLUMNS, RESULTS_VERSION_TABLE
+import profiling
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import product
+from tqdm import tqdm
+import tempfile
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# Grid of the 192 strategies shown on the website. The lottery window does not change a backtest
+# (see features.momentum_features), run_sweep backtests each look back once and writes its results
+# under every lottery window
+DEFAULT_PARAMETER_GRID = {
+    'look_back': [12, 36, 60],
+    'lottery_window': [1, 3, 6, 12],
+    'rebalance': [1, 3, 6, 12],
+    'firms_held': [25, 50, 100, 200],
+}
+
+# Seconds between two cancellation checks of a run waiting for another to finish computing features
+FEATURE_LOCK_POLL = 1.0
+
+# Read-only panel shared by every configuration a worker process runs
+_worker_panel = None
+_worker_database = None
+
+
+def _expand_grid(parameter_grid: dict) -> list[dict]:
+    """Expands {'look_back': [...], 'lottery_window': [...], 'rebalance': [...], 'firms_held': [...]}
+    into one dict per configuration"""
+
+    names = ['look_back', 'lottery_window', 'rebalance', 'firms_held']
+    return [dict(zip(names, values)) for values in product(*(parameter_grid[name] for name in names))]
+
+
+def _init_worker(database: str, panel_directory: str, columns: list[str], profile_directory: str = None) -> None:
+    """Memory-maps the shared panel once per worker process, profiling its runs if the sweep is profiled"""
+
+    global _worker_panel, _worker_database
+    if profile_directory is None:
+        profiling.disable()
+    else:
+        profiling.enable(profile_directory)
+    _worker_panel = Panel.open(panel_directory, fields=columns)
+    _worker_database = database
+
+
+def _run_configuration(configuration: dict, lottery_windows: list[int], starting_capital: int, start_date: int, end_date: int) -> list[tuple[dict, pd.DataFrame]]:
+    """Backtests one configuration against the worker's shared panel, the result is returned for
+    every one of lottery_windows"""
+
+    strategy = QuantitativeMomentum(
+        database_name=_worker_database,
+        tickers=pd.DataFrame({'Ticker': _worker_panel.tickers}),
+        rebalance_period=configuration['rebalance'],
+        look_back=configuration['look_back'],
+        lottery_window=configuration['lottery_window'],
+        firms_held=configuration['firms_held'],
+        panel=_worker_panel
+    )
+    backtester = Backtester(_worker_database, panel=_worker_panel)
+
+    equity_timeseries = backtester.backtest(
+        strategy=strategy,
+        rebalance_period=configuration['rebalance'],
+        starting_capital=starting_capital,
+        start_date=start_date,
+        end_date=end_date
+    )
+
+    return [({**configuration, 'lottery_window': lottery_window}, equity_timeseries)
+            for lottery_window in lottery_windows]
+
+
+def _run_look_back(look_back: int, lottery_windows: list[int], rebalance_periods: list[int], firms_held: list[int], starting_capital: int, start_date: int, end_date: int) -> list[tuple[dict, pd.DataFrame]]:
+    """Backtests every rebalance x firms_held configuration of one look_back in one pass, the results
+    are returned for every one of lottery_windows"""
+
+    strategy = QuantitativeMomentum(
+        database_name=_worker_database,
+        tickers=pd.DataFrame({'Ticker': _worker_panel.tickers}),
+        look_back=look_back,
+        lottery_window=lottery_windows[0],
+        panel=_worker_panel
+    )
+    backtester = Backtester(_worker_database, panel=_worker_panel)
+
+    variants = backtester.backtest_variants(
+        strategy=strategy,
+        rebalance_periods=rebalance_periods,
+        firms_held=firms_held,
+        starting_capital=starting_capital,
+        start_date=start_date,
+        end_date=end_date
+    )
+
+    return [({'look_back': look_back, 'lottery_window': lottery_window, 'rebalance': rebalance, 'firms_held': firms},
+             equity_timeseries)
+            for (rebalance, firms), equity_timeseries in variants.items()
+            for lottery_window in lottery_windows]
+
+
+@profiling.timed('sql_write')
+def _write_results(connector: sqlite3.Connection, results: list[tuple[dict, pd.DataFrame]]) -> None:
+    """Replaces the equity_* table of every result inside a single transaction
+
+    The strategy_stats rows of the replaced tables are deleted so they are recomputed
+    from the new equity curves, and their results_version is bumped in the same transaction
+    """
+
+    has_statistics = connector.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STATISTICS_TABLE,)).fetchone() is not None
+
+    connector.execute(f"""CREATE TABLE IF NOT EXISTS {RESULTS_VERSION_TABLE} (
+        Name TEXT PRIMARY KEY, Version INTEGER NOT NULL)""")
+
+    with connector:
+        for configuration, equity_timeseries in results:
+            table_name = _strategy_table_convention(**configuration)
+            # sqlite3 only opens the transaction on a data statement, the DROP would commit on its own
+            connector.execute(
+                f"""INSERT INTO {RESULTS_VERSION_TABLE} VALUES (?, 1)
+                ON CONFLICT (Name) DO UPDATE SET Version = Version + 1""", (table_name,))
+            connector.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            connector.execute(
+                f'CREATE TABLE "{table_name}" ("Date" INTEGER, "Equity" REAL)')
+            connector.executemany(
+                f'INSERT INTO "{table_name}" VALUES (?, ?)',
+                zip(equity_timeseries['Date'].astype(int).tolist(),
+                    equity_timeseries['Equity'].astype(float).tolist()))
+            profiling.count('sql_queries')
+            profiling.count('rows_written', len(equity_timeseries))
+            # An integer date and a float equity per row
+            profiling.count('bytes_written', 16 * len(equity_timeseries))
+            if has_statistics:
+                connector.execute(
+                    f"""DELETE FROM {STATISTICS_TABLE}
+                    WHERE {' AND '.join(f'{column} = ?' for column in PARAMETER_COLUMNS)}""",
+                    [configuration[column] for column in PARAMETER_COLUMNS])
+
+
+def _missing_columns(store: PriceStore, ticker: str, columns: list[str]) -> list[str]:
+    """Returns the columns not stored for ticker or whose computation never finished"""
+
+    stored_columns = set(store.columns(ticker)) - store.incomplete_columns()
+    return [column for column in columns if column not in stored_columns]
+
+
+def feature_lock(database: str) -> FileLock:
+    """Returns the lock held while feature columns of the database are computed, shared by every process"""
+    return FileLock(f'{database}.features.lock')
+
+
+@contextmanager
+def _holding(lock, progress_callback=None):
+    """Holds lock, calling progress_callback('features', 0, 1) while waiting for it so a
+    cancelled run stops waiting"""
+
+    while not lock.acquire(timeout=FEATURE_LOCK_POLL):
+        if progress_callback is not None:
+            progress_callback('features', 0, 1)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+@profiling.profiled('backtest_configuration')
+def backtest_configuration(database: str,
+                           configuration: dict,
+                           tickers=None,
+                           progress_callback=None,
+                           starting_capital: int = 100_000,
+                           start_date: int = 19710104,
+                           end_date: int = 20230803) -> str:
+    """Backtests a single configuration on demand and stores it like a sweep result
+
+    Momentum and FIP columns missing for the configuration's (look_back, lottery_window) pair
+    are computed first, so any positive parameters can be run. Only the missing columns are
+    written, columns already stored for other pairs are left as they are, and so are the panel
+    cache and rank indexes built from them. The computation holds feature_lock(database), two
+    runs (in any process) never write the same columns.
+
+    Parameters
+    ----------
+    database : (str) path to the stock database
+    configuration : dict with look_back, lottery_window, rebalance and firms_held
+    tickers : (pd.DataFrame) universe with a 'Ticker' column, defaults to the universe of the panel
+              cache or else every stored ticker
+    progress_callback : callable(stage, done, total) with stage 'features' (tickers done) or
+                        'backtest' (days done), an exception raised by it aborts the run
+
+    Returns
+    --------
+    table_name : (str) the _strategy_table_convention table written
+    """
+
+    connector = sqlite3.connect(database)
+    connector.execute("PRAGMA journal_mode = WAL")
+
+    if tickers is None:
+        universe = cached_tickers(connector)
+        if universe is None:
+            universe = PriceStore(connector).tickers()
+        tickers = pd.DataFrame({'Ticker': universe})
+
+    strategy = QuantitativeMomentum(
+        database_name=database,
+        tickers=tickers,
+        rebalance_period=configuration['rebalance'],
+        look_back=configuration['look_back'],
+        lottery_window=configuration['lottery_window'],
+        firms_held=configuration['firms_held']
+    )
+
+    ticker = tickers['Ticker'].iloc[0]
+    required_columns = _feature_columns(
+        [(configuration['look_back'], configuration['lottery_window'])])
+    if _missing_columns(strategy.store, ticker, required_columns):
+        with _holding(feature_lock(database), progress_callback):
+            # Another run may have computed them while this one waited
+            missing_columns = _missing_columns(
+                strategy.store, ticker, required_columns)
+            if missing_columns:
+                strategy.compute_parameters(
+                    columns=missing_columns,
+                    progress_callback=None if progress_callback is None else (
+                        lambda done, total: progress_callback('features', done, total)))
+
+    equity_timeseries = Backtester(database).backtest(
+        strategy=strategy,
+        rebalance_period=configuration['rebalance'],
+        starting_capital=starting_capital,
+        start_date=start_date,
+        end_date=end_date,
+        progress_callback=None if progress_callback is None else (
+            lambda done, total: progress_callback('backtest', done, total))
+    )
+
+    _write_results(connector, [(configuration, equity_timeseries)])
+    connector.close()
+
+    return _strategy_table_convention(**configuration)
+
+
+@profiling.profiled('run_sweep')
+def run_sweep(database: str,
+              tickers,
+              parameter_grid: dict = DEFAULT_PARAMETER_GRID,
+              max_workers: int = None,
+              batch_size: int = 16,
+              batched: bool = True,
+              starting_capital: int = 100_000,
+              start_date: int = 19710104,
+              end_date: int = 20230803,
+              dtype=np.float64) -> list[str]:
+    """Backtests every configuration in parameter_grid across a process pool
+
+    The price and feature panel is read from SQLite once, written to .npy files and
+    memory-mapped read-only by every worker. When the database has a panel cache 
+    (see panel.build_panel_cache) the workers map the cache directly. Equity curves are written back in
+    transactions of batch_size tables under _strategy_table_convention names. Run
+    python -m components.strategy_stats afterwards to materialize their statistics.
+
+    The lottery window does not change a backtest, every configuration is backtested once and its
+    equity curve is written under the table name of each lottery window in the grid.
+
+    Parameters
+    ----------
+    database : (str) path to the stock database, compute_parameters must have been run for every
+               look_back in the grid
+    tickers : (pd.DataFrame) universe with a 'Ticker' column
+    parameter_grid : dict of lists keyed by look_back, lottery_window, rebalance and firms_held
+    max_workers : (int) number of worker processes, defaults to the number of CPUs
+    batch_size : (int) number of result tables written per transaction
+    batched : (bool) run all rebalance x firms_held variants of a look_back in one task so they
+              share the momentum screen of each rebalance date, otherwise one task per configuration
+    dtype : np.float64 or panel.COMPACT_DTYPE, the type of the shared panel (float32 halves the memory mapped)
+
+    Returns
+    --------
+    table_names : list[str] of the equity tables written
+    """
+
+    lottery_windows = list(dict.fromkeys(parameter_grid['lottery_window']))
+    configurations = _expand_grid(
+        {**parameter_grid, 'lottery_window': lottery_windows[:1]})
+
+    connector = sqlite3.connect(database)
+    # Readers (the website) keep reading the old tables while results are written
+    connector.execute("PRAGMA journal_mode = WAL")
+
+    columns = ['Open', 'Close'] + _feature_columns(
+        product(sorted(set(parameter_grid['look_back'])), lottery_windows[:1]))
+
+    panel = load_panel(connector, tickers['Ticker'],
+                       columns=columns, dtype=dtype)
+
+    table_names = []
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        if panel.directory is None:
+            panel.save(temporary_directory)
+            panel_directory = temporary_directory
+        else:
+            panel_directory = panel.directory
+        del panel
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_init_worker,
+                                 initargs=(database, panel_directory, columns, profiling.profile_directory())) as executor:
+            if batched:
+                futures = [executor.submit(_run_look_back, look_back, lottery_windows,
+                                           parameter_grid['rebalance'], parameter_grid['firms_held'],
+                                           starting_capital, start_date, end_date)
+                           for look_back in dict.fromkeys(parameter_grid['look_back'])]
+            else:
+                futures = [executor.submit(_run_configuration, configuration, lottery_windows,
+                                           starting_capital, start_date, end_date)
+                           for configuration in configurations]
+
+            pending_results = []
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                pending_results += future.result()
+
+                if len(pending_results) >= batch_size:
+                    _write_results(connector, pending_results)
+                    table_names += [_strategy_table_convention(**configuration)
+                                    for configuration, _ in pending_results]
+                    pending_results = []
+
+            if pending_results:
+                _write_results(connector, pending_results)
+                table_names += [_strategy_table_convention(**configuration)
+                                for configuration, _ in pending_results]
+
+    connector.close()
+
+    return table_names
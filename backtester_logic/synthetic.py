@@ -0,0 +1,215 @@
+from storage import PriceStore, DATE_AXIS_TICKER, create_prices_table
+from ingest import fill_missing_dates, _bulk_insert
+from utils import _int_to_datetime
+import argparse
+import os
+import sqlite3
+import pandas as pd
+import numpy as np
+
+# Trading days simulated per calendar year
+SYNTHETIC_DAYS_PER_YEAR = 252
+
+
+def synthetic_dates(start_date: int, years: int) -> np.ndarray:
+    """Returns years of weekdays starting on start_date as sorted YYYYMMDD ints, the master date axis"""
+
+    days = pd.bdate_range(_int_to_datetime(start_date),
+                          periods=years * SYNTHETIC_DAYS_PER_YEAR)
+    return days.strftime('%Y%m%d').astype(np.int64).to_numpy()
+
+
+def _market_returns(dates: np.ndarray, seed: int) -> np.ndarray:
+    """Daily log returns of the market factor shared by every ticker and SPX_DAILY"""
+
+    rng = np.random.default_rng([seed, 0])
+    return rng.normal(0.0003, 0.01, len(dates))
+
+
+def synthetic_bars(ticker: str, dates: np.ndarray, market_returns: np.ndarray, seed: int, position: int,
+                   listing: bool = True, gap_rate: float = 0.002) -> pd.DataFrame:
+    """Simulates the Stooq daily bars of one ticker as ingest_stooq stores them
+
+    Each ticker has its own beta to the market factor, volatility and a drift that changes
+    every year, so momentum persists long enough for the screen to pick winners.
+
+        - A listed ticker may start trading after the first date, the dates before are padded
+          with empty rows (see ingest.normalize_dates)
+        - It may be delisted, its rows then stop before the last date
+        - gap_rate of the dates it traded on have no row (the gaps validate_data fills)
+
+    Parameters
+    ----------
+    ticker : (str) the stock symbol.US in all caps
+    dates : (np.ndarray) master date axis
+    market_returns : (np.ndarray) daily log returns of the market factor on dates
+    seed, position : (int) the ticker's random stream, the same pair always gives the same bars
+    listing : (bool) False trades on every date with no gaps (the date axis ticker)
+    gap_rate : (float) share of traded dates dropped
+
+    Returns
+    --------
+    ticker_df : (pd.DataFrame) with Ticker, Per, Date, Time, Open, High, Low, Close, Vol and Openint
+    """
+
+    rng = np.random.default_rng([seed, 2, position])
+    num_of_dates = len(dates)
+
+    beta = rng.uniform(0.5, 1.5)
+    volatility = rng.uniform(0.01, 0.03)
+    yearly_drift = rng.normal(0, 0.001, num_of_dates //
+                              SYNTHETIC_DAYS_PER_YEAR + 1)
+    drift = np.repeat(yearly_drift, SYNTHETIC_DAYS_PER_YEAR)[:num_of_dates]
+
+    log_returns = beta * market_returns + drift + \
+        rng.normal(0, volatility, num_of_dates)
+    close = rng.lognormal(3.5, 1.0) * np.exp(np.cumsum(log_returns))
+    # Opens gap away from the previous close
+    previous_close = np.concatenate(([close[0]], close[:-1]))
+    open_ = previous_close * \
+        np.exp(rng.normal(0, volatility / 4, num_of_dates))
+    high = np.maximum(open_, close) * \
+        (1 + np.abs(rng.normal(0, volatility / 2, num_of_dates)))
+    low = np.minimum(open_, close) * \
+        (1 - np.abs(rng.normal(0, volatility / 2, num_of_dates)))
+    volume = rng.lognormal(12, 1, num_of_dates).astype(np.int64)
+
+    ticker_df = pd.DataFrame({
+        'Ticker': ticker,
+        'Per': 'D',
+        'Date': dates,
+        'Time': 0,
+        'Open': open_.round(4),
+        'High': high.round(4),
+        'Low': low.round(4),
+        'Close': close.round(4),
+        'Vol': volume,
+        'Openint': 0,
+    })
+
+    if not listing:
+        return ticker_df
+
+    # A third of the tickers list after the first date and a tenth are delisted before the last
+    first_row = 0 if rng.random() < 2 / 3 else int(rng.integers(1, num_of_dates // 2))
+    last_row = num_of_dates if rng.random() < 0.9 else int(
+        rng.integers(first_row + SYNTHETIC_DAYS_PER_YEAR // 4, num_of_dates))
+
+    traded = np.zeros(num_of_dates, dtype=bool)
+    traded[first_row:last_row] = True
+    # The first and last bars are kept so gaps are always interior
+    gaps = rng.random(num_of_dates) < gap_rate
+    gaps[[first_row, last_row - 1]] = False
+    traded &= ~gaps
+
+    ticker_df = ticker_df[traded | (np.arange(num_of_dates) < first_row)].copy()
+    ticker_df.loc[ticker_df['Date'] < dates[first_row],
+                  ['Time', 'Open', 'High', 'Low', 'Close', 'Vol', 'Openint']] = np.nan
+
+    return ticker_df.reset_index(drop=True)
+
+
+def synthetic_risk_free_rates(dates: np.ndarray, seed: int) -> pd.DataFrame:
+    """Monthly 3 month treasury bill rates (in percent) covering dates, stored as the TB3MS table"""
+
+    rng = np.random.default_rng([seed, 1])
+    months = pd.date_range(_int_to_datetime(int(dates[0])).replace(day=1),
+                           _int_to_datetime(int(dates[-1])), freq='MS')
+    rates = np.clip(5 + np.cumsum(rng.normal(0, 0.25, len(months))), 0.01, 15)
+
+    return pd.DataFrame({'Date': months.strftime('%Y-%m-%d'), 'Rate': rates.round(2)})
+
+
+def generate_database(database: str,
+                      num_of_tickers: int = 100,
+                      years: int = 10,
+                      seed: int = 0,
+                      start_date: int = 19700102,
+                      gap_rate: float = 0.002,
+                      fill_gaps: bool = False,
+                      long_format: bool = True,
+                      starting_capital: int = 100_000,
+                      batch_size: int = 250) -> pd.DataFrame:
+    """Writes a deterministic synthetic market into a new database with the StratData.db schema
+
+    The prices are written the way ingest_stooq writes Stooq files (or in per-ticker tables),
+    alongside the TB3MS risk free rates and the SPX_DAILY benchmark equity the website reads.
+    GE.US trades on every date and defines the date axis, the other tickers are named SYN0001.US, ...
+    The same arguments always produce the same data, and a ticker's bars do not depend on
+    num_of_tickers so universes of different sizes share their common tickers.
+
+    Parameters
+    ----------
+    database : (str) path of the database to create, must not exist
+    num_of_tickers : (int) size of the universe, GE.US included
+    years : (int) length of the date axis
+    seed : (int) seed of every random stream
+    start_date : (int) first date, given as YYYYMMDD
+    gap_rate : (float) share of each ticker's traded dates missing from the data
+    fill_gaps : (bool) store the data as validate_data leaves it: gaps averaged and delisted tickers padded with empty rows
+    long_format : (bool) write the prices table, otherwise one table per ticker
+    starting_capital : (int) first value of SPX_DAILY
+    batch_size : (int) number of tickers written per transaction
+
+    Returns
+    --------
+    tickers : (pd.DataFrame) universe with Ticker and Name columns
+    """
+
+    if os.path.exists(database):
+        raise FileExistsError(f"{database} already exists")
+
+    dates = synthetic_dates(start_date, years)
+    market_returns = _market_returns(dates, seed)
+
+    tickers = [DATE_AXIS_TICKER] + \
+        [f'SYN{position:04d}.US' for position in range(1, num_of_tickers)]
+
+    connector = sqlite3.connect(database)
+    if long_format:
+        create_prices_table(connector)
+    store = PriceStore(connector)
+
+    pending = []
+    for position, ticker in enumerate(tickers):
+        ticker_df = synthetic_bars(ticker, dates, market_returns, seed, position,
+                                   listing=ticker != DATE_AXIS_TICKER, gap_rate=gap_rate)
+        if fill_gaps:
+            ticker_df, _ = fill_missing_dates(ticker_df, dates)
+
+        if not long_format:
+            store.write(ticker, ticker_df)
+            continue
+
+        pending.append((ticker, ticker_df))
+        if len(pending) >= batch_size:
+            _bulk_insert(connector, pending)
+            pending = []
+
+    if pending:
+        _bulk_insert(connector, pending)
+
+    synthetic_risk_free_rates(dates, seed).to_sql(
+        'TB3MS', connector, index=False)
+    pd.DataFrame({'Date': dates, 'Equity': starting_capital * np.exp(np.cumsum(market_returns))}).to_sql(
+        'SPX_DAILY', connector, index=False)
+
+    connector.close()
+
+    return pd.DataFrame({'Ticker': tickers, 'Name': [f'Synthetic {ticker[:-3]}' for ticker in tickers]})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Writes a synthetic StratData.db style database")
+    parser.add_argument('database')
+    parser.add_argument('--tickers', type=int, default=100)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fill-gaps', action='store_true')
+    parser.add_argument('--legacy', action='store_true',
+                        help="one table per ticker instead of the prices table")
+    arguments = parser.parse_args()
+
+    generate_database(arguments.database, num_of_tickers=arguments.tickers, years=arguments.years,
+                      seed=arguments.seed, fill_gaps=arguments.fill_gaps, long_format=not arguments.legacy)
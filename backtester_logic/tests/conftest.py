@@ -0,0 +1,34 @@
+"""Shared setup of the backtester_logic tests
+
+backtester_logic uses flat imports, so its directory goes on the path before any test module
+imports it. Every test builds its data with synthetic.generate_database.
+
+    python -m pytest backtester_logic/tests
+"""
+
+import os
+import sys
+import pytest
+
+BACKTESTER_LOGIC_PATH = os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__)))
+if BACKTESTER_LOGIC_PATH not in sys.path:
+    sys.path.insert(0, BACKTESTER_LOGIC_PATH)
+
+# Read by strategy.py through decouple, progress bars would drown the report
+os.environ.setdefault('SLIPPAGE_FACTOR', '1.001')
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+from synthetic import generate_database  # noqa: E402
+
+
+@pytest.fixture
+def synthetic_database(tmp_path):
+    """Returns generate_database(path, **options) writing into the test's temporary directory,
+    called as synthetic_database(name, **options) -> (path, universe)"""
+
+    def _generate(name: str = 'synthetic.db', **options):
+        database = str(tmp_path / name)
+        return database, generate_database(database, **options)
+
+    return _generate
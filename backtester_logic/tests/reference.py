@@ -0,0 +1,71 @@
+"""The heapq implementations of the momentum screen and portfolio selection the vectorized code
+replaced, the tests compare against them"""
+
+import heapq
+
+from features import _return_column, _positive_column, _negative_column
+from strategy import SLIPPAGE_FACTOR
+
+
+def heap_screen(connector, tickers, date, look_back):
+    """The original generic momentum screen: one query per ticker, a heap of the top 10% of
+    (momentum, FIP score, next open, ticker) tuples
+
+    Names without an open on the next trading day are skipped, the original failed on them.
+    """
+
+    generic_momentum_size = int(len(tickers) * 0.1)
+    generic_momentum_screen = []
+
+    for ticker in tickers:
+        return_value = connector.execute(
+            f"""SELECT {_return_column(look_back)}, {_positive_column(look_back)},
+            {_negative_column(look_back)}, Open
+            FROM prices WHERE Ticker = ? AND Date >= ? ORDER BY Date LIMIT 2""", (ticker, date)).fetchall()
+        if len(return_value) < 2 or return_value[0][0] is None or not return_value[1][3]:
+            continue
+
+        generic_momentum, perc_pos, perc_neg, _ = return_value[0]
+        next_open = return_value[1][3]
+        heapq.heappush(generic_momentum_screen, (generic_momentum, generic_momentum *
+                       (perc_pos - perc_neg), next_open, ticker))
+        if len(generic_momentum_screen) > generic_momentum_size:
+            heapq.heappop(generic_momentum_screen)
+
+    return generic_momentum_screen
+
+
+def heap_portfolio(connector, tickers, date, current_capital, firms_held, look_back):
+    """The original portfolio_construction: the top firms_held FIP scores of the screen among the
+    names an equal share of the capital buys at least one share of, as sorted (ticker, shares)"""
+
+    generic_momentum_screen = heap_screen(connector, tickers, date, look_back)
+
+    top_firms = []
+    capital_available = (
+        1 / min(firms_held, len(generic_momentum_screen))) * current_capital
+    for _, fip_score, next_open, ticker in generic_momentum_screen:
+        cost = SLIPPAGE_FACTOR * next_open
+        shares_purchased = int(capital_available / cost)
+        if shares_purchased == 0:
+            pass
+        elif len(top_firms) < firms_held:
+            heapq.heappush(
+                top_firms, (fip_score, shares_purchased, cost, ticker))
+        else:
+            heapq.heappushpop(
+                top_firms, (fip_score, shares_purchased, cost, ticker))
+
+    return sorted((ticker, shares) for _, shares, _, ticker in top_firms)
+
+
+def heap_top_k(k, keys):
+    """The size k heap of key tuples the original screens kept, as sorted positions"""
+
+    heap = []
+    for row in zip(*keys, range(len(keys[0]))):
+        if len(heap) < k:
+            heapq.heappush(heap, row)
+        else:
+            heapq.heappushpop(heap, row)
+    return sorted(row[-1] for row in heap)
@@ -0,0 +1,82 @@
+"""On demand backtests (sweep.backtest_configuration) running concurrently"""
+
+import multiprocessing
+import os
+import sqlite3
+import pandas as pd
+import pytest
+
+from backtester import Backtester
+from features import _feature_columns
+from momentum_strategy import QuantitativeMomentum
+from panel import load_panel, build_panel_cache
+from rank_index import RankIndex, rank_index_path, rank_index_manifest, first_stale_row
+from panel import _source_fingerprint
+from storage import PriceStore
+from sweep import backtest_configuration
+from utils import _strategy_table_convention
+
+START_DATE = 19710104
+END_DATE = 19721229
+
+
+def _configuration(rebalance):
+    # Look back 3 is not computed by the fixture, both runs need its columns
+    return {'look_back': 3, 'lottery_window': 1, 'rebalance': rebalance, 'firms_held': 5}
+
+
+@pytest.fixture
+def market(synthetic_database):
+    database, universe = synthetic_database(
+        num_of_tickers=30, years=3, seed=4, fill_gaps=True)
+    strategy = QuantitativeMomentum(database, universe, look_back=12)
+    strategy.compute_parameters()
+    strategy.build_rank_index()
+    build_panel_cache(sqlite3.connect(database), universe['Ticker'])
+    return database, universe
+
+
+def _backtest(database, universe, rebalance):
+    backtest_configuration(database, _configuration(rebalance), tickers=universe,
+                           start_date=START_DATE, end_date=END_DATE)
+
+
+def test_concurrent_runs_compute_missing_columns_once(market):
+    database, universe = market
+    connector = sqlite3.connect(database)
+    store = PriceStore(connector)
+    data_version = store.data_version()
+    close_file = os.stat(os.path.join(load_panel(
+        connector, universe['Ticker'], ['Close']).directory, 'Close.npy'))
+
+    context = multiprocessing.get_context('fork')
+    runs = [context.Process(target=_backtest, args=(database, universe, rebalance))
+            for rebalance in (1, 3)]
+    for run in runs:
+        run.start()
+    for run in runs:
+        run.join()
+    assert [run.exitcode for run in runs] == [0, 0]
+
+    # One write per ticker: the second run found the columns the first computed
+    assert store.data_version() - data_version == len(universe)
+    assert not store.incomplete_columns()
+    assert set(_feature_columns([(3, 1)])) <= set(store.columns('GE.US'))
+
+    for rebalance in (1, 3):
+        strategy = QuantitativeMomentum(database, universe, look_back=3, firms_held=5,
+                                        rebalance_period=rebalance)
+        expected = Backtester(database).backtest(
+            strategy, start_date=START_DATE, end_date=END_DATE)
+        stored = pd.read_sql(
+            f"SELECT * FROM {_strategy_table_convention(**_configuration(rebalance))}", connector)
+        pd.testing.assert_frame_equal(stored, expected, check_dtype=False)
+
+    # New columns leave the panel cache and the rank index of the other look back as they were
+    panel = load_panel(connector, universe['Ticker'], ['Close'])
+    assert os.stat(os.path.join(panel.directory, 'Close.npy')).st_ino == close_file.st_ino
+    strategy = QuantitativeMomentum(database, universe, look_back=12)
+    index, manifest = RankIndex.load(rank_index_path(database, 12, 1))
+    assert first_stale_row(index, manifest, rank_index_manifest(universe['Ticker'], 12, 1), store,
+                           store.dates(), _source_fingerprint(connector, database),
+                           strategy._panel_columns()) == len(index)
@@ -0,0 +1,78 @@
+"""fill_missing_dates against the row by row gap filling of the original validate_data"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingest import fill_missing_dates
+from synthetic import synthetic_bars, synthetic_dates, _market_returns
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Vol']
+
+
+def loop_fill_missing_dates(ticker_df, master_dates):
+    """The original validate_data for one ticker: every missing date is inserted one at a time,
+    averaging the rows above and below it, or filled with -1 after the last row"""
+
+    ticker_df = ticker_df.reset_index(drop=True)
+    ticker = ticker_df['Ticker'].iloc[0]
+    missing_dates = master_dates[~np.isin(master_dates, ticker_df['Date'])]
+
+    for date in missing_dates:
+        row_above_index = ticker_df.index[ticker_df['Date'] > date].min()
+
+        if pd.notna(row_above_index):
+            previous_row = ticker_df.loc[row_above_index - 1, PRICE_COLUMNS]
+            next_row = ticker_df.loc[row_above_index, PRICE_COLUMNS]
+            missing_date_row = {'Ticker': ticker, 'Per': 'D', 'Date': date, 'Time': -1,
+                                **((previous_row + next_row) / 2).to_dict(), 'Openint': 0}
+        else:
+            missing_date_row = {'Ticker': ticker, 'Per': 'D', 'Date': date, 'Time': -1,
+                                **{column: -1 for column in PRICE_COLUMNS}, 'Openint': -1}
+
+        ticker_df.loc[row_above_index - 0.5] = missing_date_row
+        ticker_df = ticker_df.sort_index().reset_index(drop=True)
+
+    return ticker_df
+
+
+# Every ticker has interior gaps, 28, 32, 35, 58, 59 and 60 are delisted and have trailing ones
+@pytest.mark.parametrize('position', range(1, 61))
+def test_fill_missing_dates_matches_loop(position):
+    seed = 7
+    dates = synthetic_dates(19700102, 2)
+    ticker_df = synthetic_bars(f'SYN{position:04d}.US', dates, _market_returns(dates, seed),
+                               seed, position, gap_rate=0.02)
+
+    filled_df, gap_counts = fill_missing_dates(ticker_df, dates)
+    expected = loop_fill_missing_dates(ticker_df, dates)
+
+    assert filled_df['Date'].tolist() == expected['Date'].astype(np.int64).tolist()
+    assert (filled_df['Ticker'] == expected['Ticker']).all()
+    assert (filled_df['Per'] == expected['Per']).all()
+
+    # Days after the last trade were -1, they are now left empty
+    trailing = (expected['Open'] == -1).to_numpy()
+    assert gap_counts['trailing'] == trailing.sum()
+    assert filled_df.loc[trailing, PRICE_COLUMNS].isna().all().all()
+
+    np.testing.assert_allclose(filled_df.loc[~trailing, PRICE_COLUMNS].to_numpy(dtype=np.float64),
+                               expected.loc[~trailing, PRICE_COLUMNS].to_numpy(dtype=np.float64),
+                               rtol=1e-12)
+
+    interior = expected['Time'].to_numpy() == -1
+    interior &= ~trailing
+    assert gap_counts['interior'] == interior.sum()
+    assert (filled_df.loc[interior, 'Openint'] == 0).all()
+
+
+def test_fill_missing_dates_counts_leading_dates():
+    dates = synthetic_dates(19700102, 1)
+    ticker_df = synthetic_bars('SYN0001.US', dates, _market_returns(dates, 0), 0, 1, listing=False)
+    ticker_df = ticker_df.iloc[10:].reset_index(drop=True)
+
+    filled_df, gap_counts = fill_missing_dates(ticker_df, dates)
+
+    assert gap_counts == {'leading': 10, 'interior': 0, 'trailing': 0}
+    assert filled_df['Date'].tolist() == dates.tolist()
+    assert filled_df.loc[:9, PRICE_COLUMNS].isna().all().all()
@@ -0,0 +1,174 @@
+"""Panel cache rebuilds against panels read straight from the database"""
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import numpy as np
+import pytest
+
+import panel as panel_module
+from features import FEATURE_VERSION
+from panel import COMPACT_DTYPE, Panel, load_panel, panel_cache_directory, _read_panel
+from storage import METADATA_TABLE, WRITES_TABLE, PriceStore
+
+COLUMNS = ['Open', 'Close']
+
+
+@pytest.fixture
+def market(synthetic_database):
+    database, universe = synthetic_database(num_of_tickers=20, years=2, seed=5)
+    return database, universe['Ticker'].tolist()
+
+
+def _assert_same_panel(panel, expected):
+    assert np.array_equal(panel.dates, expected.dates)
+    assert panel.tickers.tolist() == expected.tickers.tolist()
+    for column in expected.fields:
+        assert np.array_equal(panel[column], expected[column], equal_nan=True)
+
+
+def _rewrite_and_rebuild(database, tickers, stop):
+    """Rewrites a ticker's unchanged rows (bumping the rows version) and rebuilds the cache until stop is set"""
+
+    connector = sqlite3.connect(database, timeout=30)
+    store = PriceStore(connector)
+    ticker_df = store.read(tickers[1])
+    while not stop.is_set():
+        store.write(tickers[1], ticker_df)
+        load_panel(connector, tickers, COLUMNS, cache=True)
+    connector.close()
+
+
+def test_panel_opens_while_another_process_rebuilds_it(market):
+    database, tickers = market
+    connector = sqlite3.connect(database, timeout=30)
+    expected = load_panel(connector, tickers, COLUMNS, cache=False)
+    load_panel(connector, tickers, COLUMNS, cache=True)
+
+    context = multiprocessing.get_context('fork')
+    stop = context.Event()
+    rebuilder = context.Process(
+        target=_rewrite_and_rebuild, args=(database, tickers, stop))
+    rebuilder.start()
+    try:
+        deadline = time.monotonic() + 3
+        while time.monotonic() < deadline:
+            _assert_same_panel(load_panel(connector, tickers, COLUMNS), expected)
+    finally:
+        stop.set()
+        rebuilder.join()
+
+    assert rebuilder.exitcode == 0
+    _assert_same_panel(load_panel(connector, tickers, COLUMNS), expected)
+
+
+def test_feature_write_rebuilds_only_its_column(market):
+    database, tickers = market
+    connector = sqlite3.connect(database)
+    store = PriceStore(connector)
+
+    panel = load_panel(connector, tickers, COLUMNS, cache=True)
+    close_file = os.stat(os.path.join(panel.directory, 'Close.npy'))
+
+    ticker_df = store.read(tickers[1])
+    ticker_df['Open'] = ticker_df['Open'] * 2
+    store.write(tickers[1], ticker_df, columns=['Open'])
+
+    panel = load_panel(connector, tickers, COLUMNS)
+    _assert_same_panel(panel, load_panel(connector, tickers, COLUMNS, cache=False))
+    # Close is carried over from the previous generation rather than read again
+    assert os.stat(os.path.join(panel.directory, 'Close.npy')).st_ino == close_file.st_ino
+
+
+def test_row_write_rebuilds_every_column(market):
+    database, tickers = market
+    connector = sqlite3.connect(database)
+    store = PriceStore(connector)
+
+    panel = load_panel(connector, tickers, COLUMNS, cache=True)
+    close_file = os.stat(os.path.join(panel.directory, 'Close.npy'))
+
+    ticker_df = store.read(tickers[1])
+    ticker_df['Close'] = ticker_df['Close'] * 2
+    store.write(tickers[1], ticker_df)
+
+    panel = load_panel(connector, tickers, COLUMNS)
+    _assert_same_panel(panel, load_panel(connector, tickers, COLUMNS, cache=False))
+    assert os.stat(os.path.join(panel.directory, 'Close.npy')).st_ino != close_file.st_ino
+    # The previous generation stays until its grace period is over
+    assert len(os.listdir(panel_cache_directory(database))) == 3
+
+
+def _close_inode(panel):
+    return os.stat(os.path.join(panel.directory, 'Close.npy')).st_ino
+
+
+@pytest.mark.parametrize('change', ['tickers', 'dtype', 'features'])
+def test_manifest_change_rebuilds_every_column(market, monkeypatch, change):
+    database, tickers = market
+    connector = sqlite3.connect(database)
+    close_inode = _close_inode(load_panel(connector, tickers, COLUMNS, cache=True))
+
+    dtype = np.float64
+    if change == 'tickers':
+        tickers = tickers[:-1]
+    elif change == 'dtype':
+        dtype = COMPACT_DTYPE
+    else:
+        monkeypatch.setattr(panel_module, 'FEATURE_VERSION', FEATURE_VERSION + 1)
+
+    panel = load_panel(connector, tickers, COLUMNS, dtype=dtype)
+    _assert_same_panel(panel, load_panel(connector, tickers, COLUMNS, cache=False, dtype=dtype))
+    assert panel['Close'].dtype == dtype
+    assert _close_inode(panel) != close_inode
+
+
+def test_missing_column_is_added_to_the_cache(market):
+    database, tickers = market
+    connector = sqlite3.connect(database)
+    close_inode = _close_inode(load_panel(connector, tickers, COLUMNS, cache=True))
+
+    panel = load_panel(connector, tickers, COLUMNS + ['High'])
+    _assert_same_panel(panel, load_panel(connector, tickers, COLUMNS + ['High'], cache=False))
+    assert _close_inode(panel) == close_inode
+    # Asking for fewer columns than cached reuses the generation
+    assert load_panel(connector, tickers, ['High']).directory == panel.directory
+
+
+def test_direct_writes_invalidate_by_file_fingerprint(market):
+    database, tickers = market
+    connector = sqlite3.connect(database)
+    # As a database whose prices were written with to_sql, without PriceStore write versions
+    with connector:
+        connector.execute(f"DROP TABLE {METADATA_TABLE}")
+        connector.execute(f"DROP TABLE IF EXISTS {WRITES_TABLE}")
+    assert PriceStore(connector).data_version() is None
+
+    load_panel(connector, tickers, COLUMNS, cache=True)
+    manifest = json.load(open(os.path.join(panel_cache_directory(database), 'manifest.json')))
+    assert manifest['rows'][0] != 'rows_version'
+
+    with connector:
+        connector.execute("UPDATE prices SET Close = Close * 2 WHERE Ticker = ?", (tickers[1],))
+    _assert_same_panel(load_panel(connector, tickers, COLUMNS),
+                       load_panel(connector, tickers, COLUMNS, cache=False))
+
+
+def test_single_folder_cache_is_replaced(market):
+    """A cache of the layout before generations (arrays next to a manifest listing its fields) is rebuilt"""
+
+    database, tickers = market
+    connector = sqlite3.connect(database)
+    expected = _read_panel(connector, tickers, COLUMNS)
+
+    directory = panel_cache_directory(database)
+    os.makedirs(directory)
+    Panel(expected.dates, expected.tickers, {column: expected[column] * 2 for column in COLUMNS}).save(directory)
+    with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+        json.dump({'version': 1, 'features': FEATURE_VERSION, 'source': [], 'dtype': 'float64',
+                   'tickers': panel_module._tickers_digest(tickers), 'fields': COLUMNS}, file)
+
+    _assert_same_panel(load_panel(connector, tickers, COLUMNS), expected)
+    assert not any(file_name.endswith('.npy') for file_name in os.listdir(directory))
@@ -0,0 +1,119 @@
+"""Portfolio selection against the heapq implementation of portfolio_construction the
+vectorized screen and the Backtester replaced"""
+
+import sqlite3
+import numpy as np
+import pytest
+
+from backtester import Backtester
+from momentum_strategy import QuantitativeMomentum, _top_k
+from strategy import SLIPPAGE_FACTOR
+from trading_calendar import TradingCalendar
+from reference import heap_portfolio, heap_top_k
+
+LOOK_BACK = 12
+FIRMS_HELD = 5
+
+# Every fourth ticker trades at a thousand times its synthetic price, too expensive for small capitals
+HIGH_PRICE_FACTOR = 1000
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_top_k_breaks_ties_like_heap(seed):
+    rng = np.random.default_rng(seed)
+    size = int(rng.integers(1, 200))
+    # Few distinct values so the cut falls inside runs of ties on the first keys, the last key
+    # (a ticker rank) is unique as in the screens
+    keys = [rng.integers(0, 4, size).astype(np.float64), rng.integers(0, 3, size),
+            rng.permutation(size)]
+
+    for k in (0, 1, 5, size // 2, size, size + 3):
+        assert sorted(_top_k(k, keys).tolist()) == heap_top_k(k, keys)
+
+
+@pytest.fixture
+def high_priced_market(synthetic_database):
+    database, universe = synthetic_database(
+        num_of_tickers=60, years=3, seed=3, fill_gaps=True)
+
+    connector = sqlite3.connect(database)
+    with connector:
+        connector.executemany(
+            """UPDATE prices SET Open = Open * ?, High = High * ?, Low = Low * ?, Close = Close * ?
+            WHERE Ticker = ?""",
+            [(HIGH_PRICE_FACTOR,) * 4 + (ticker,) for ticker in universe['Ticker'][1::4]])
+    connector.close()
+
+    QuantitativeMomentum(database, universe, look_back=LOOK_BACK).compute_parameters()
+    return database, universe
+
+
+def _monthly_dates(database):
+    connector = sqlite3.connect(database)
+    dates = np.array([date for date, in connector.execute(
+        "SELECT Date FROM prices WHERE Ticker = 'GE.US' ORDER BY Date")])
+    connector.close()
+    return dates[TradingCalendar(dates).rebalance_rows(int(dates[260]), 1)].tolist()
+
+
+@pytest.mark.parametrize('capital', [20_000, 1_000_000])
+@pytest.mark.parametrize('indexed', [False, True])
+def test_portfolio_construction_matches_heap(high_priced_market, capital, indexed):
+    database, universe = high_priced_market
+    strategy = QuantitativeMomentum(
+        database, universe, look_back=LOOK_BACK, firms_held=FIRMS_HELD)
+    if indexed:
+        strategy.build_rank_index()
+
+    connector = sqlite3.connect(database)
+    expensive = set(universe['Ticker'][1::4])
+    tickers = strategy._screened_tickers()
+    screened_expensive = 0
+    for date in _monthly_dates(database):
+        portfolio, _, cash_left = strategy.portfolio_construction(capital, date)
+        expected = heap_portfolio(
+            connector, universe['Ticker'], date, capital, FIRMS_HELD, LOOK_BACK)
+
+        assert sorted((ticker, shares) for ticker, shares, _ in portfolio) == expected
+        assert cash_left >= 0
+        screened_expensive += bool(expensive & set(tickers[strategy._screen(date)[0]]))
+
+    # The universe must exercise the fallback: expensive names reach the screen
+    assert screened_expensive > 0
+
+
+def test_backtest_holds_heap_portfolios(high_priced_market):
+    """Every holding period of a backtest buys the heap's portfolio for the capital it has"""
+
+    database, universe = high_priced_market
+    strategy = QuantitativeMomentum(database, universe, look_back=LOOK_BACK,
+                                    firms_held=FIRMS_HELD, rebalance_period=1)
+
+    allocations = []
+    allocate = strategy.allocate
+
+    def _recording_allocate(rebalance_date, weights, capital, **options):
+        held_weights = allocate(rebalance_date, weights, capital, **options)
+        allocations.append((rebalance_date, capital, held_weights))
+        return held_weights
+
+    strategy.allocate = _recording_allocate
+    dates = _monthly_dates(database)
+    Backtester(database).backtest(strategy, starting_capital=20_000,
+                                  start_date=dates[0], end_date=dates[-1])
+
+    connector = sqlite3.connect(database)
+    tickers = strategy._screened_tickers()
+    replaced = 0
+    for rebalance_date, capital, held_weights in allocations[:-1]:
+        positions, fip_score, next_open = strategy._screen(rebalance_date)
+        shares = np.floor(held_weights[positions] * capital / (SLIPPAGE_FACTOR * next_open))
+        held = sorted((str(tickers[position]), int(count))
+                      for position, count in zip(positions, shares) if count > 0)
+
+        assert held == heap_portfolio(
+            connector, universe['Ticker'], rebalance_date, capital, FIRMS_HELD, LOOK_BACK)
+        replaced += np.any(held_weights[positions[:FIRMS_HELD]] == 0)
+
+    # Some period bought a lower ranked firm in place of an unaffordable one
+    assert replaced > 0
@@ -0,0 +1,132 @@
+"""Rank index builds, incremental and from scratch, against the heapq momentum screen"""
+
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+from features import TRADING_DAYS_PER_YEAR, _return_column
+from momentum_strategy import QuantitativeMomentum
+from panel import _source_fingerprint
+from rank_index import RankIndex, rank_index_path, rank_index_manifest, first_stale_row
+from storage import PriceStore
+from reference import heap_screen
+
+LOOK_BACK = 12
+LOTTERY_WINDOW = 1
+
+# Trading days appended after the first build, a month of nightly refreshes
+APPENDED_DAYS = 21
+
+
+@pytest.fixture
+def market(synthetic_database):
+    database, universe = synthetic_database(
+        num_of_tickers=40, years=3, seed=11, fill_gaps=True)
+    _strategy(database, universe).compute_parameters()
+    return database, universe
+
+
+def _strategy(database, universe):
+    return QuantitativeMomentum(database, universe, look_back=LOOK_BACK, lottery_window=LOTTERY_WINDOW)
+
+
+def _hold_back(database, days):
+    """Removes the last days of every ticker and returns them as bars to append"""
+
+    connector = sqlite3.connect(database)
+    cut = int(PriceStore(connector).dates()[-days - 1])
+    held_back = pd.read_sql_query(
+        "SELECT * FROM prices WHERE Date > ? ORDER BY Ticker, Date", connector, params=(cut,))
+    with connector:
+        connector.execute("DELETE FROM prices WHERE Date > ?", (cut,))
+    connector.close()
+    return held_back
+
+
+def _assert_same_index(index, expected):
+    assert index.tickers.tolist() == expected.tickers.tolist()
+    for array in ('dates', 'offsets', 'positions', 'fip_score', 'next_open'):
+        assert np.array_equal(getattr(index, array), getattr(expected, array)), array
+
+
+def _first_stale_row(strategy):
+    """first_stale_row of the strategy's stored index against the database as it is now"""
+
+    database_path = strategy.connector.execute("PRAGMA database_list").fetchone()[2]
+    index, manifest = RankIndex.load(rank_index_path(database_path, LOOK_BACK, LOTTERY_WINDOW))
+    return first_stale_row(index, manifest, rank_index_manifest(strategy.tickers['Ticker'], LOOK_BACK, LOTTERY_WINDOW),
+                           strategy.store, strategy.store.dates(), _source_fingerprint(strategy.connector, database_path),
+                           strategy._panel_columns())
+
+
+def _assert_screens_match_heap(strategy, universe, dates):
+    tickers = strategy._screened_tickers()
+    screened_names = 0
+    for date in dates:
+        screened = sorted(tickers[strategy._screen(int(date))[0]].tolist())
+        expected = sorted(ticker for *_, ticker in heap_screen(
+            strategy.connector, universe['Ticker'], int(date), LOOK_BACK))
+        assert screened == expected, date
+        screened_names += len(screened)
+
+    assert screened_names > 0
+
+
+def test_incremental_build_matches_rebuild(synthetic_database):
+    database, universe = synthetic_database(
+        num_of_tickers=40, years=3, seed=11, fill_gaps=True)
+    new_bars = _hold_back(database, APPENDED_DAYS)
+
+    strategy = _strategy(database, universe)
+    strategy.compute_parameters()
+    strategy.build_rank_index()
+    strategy.append_bars(new_bars)
+    incremental = strategy.build_rank_index()
+    stored = _strategy(database, universe).build_rank_index()
+    rebuilt = _strategy(database, universe).build_rank_index(rebuild=True)
+
+    assert len(rebuilt) == len(strategy.store.dates())
+    _assert_same_index(incremental, rebuilt)
+    _assert_same_index(stored, rebuilt)
+    _assert_screens_match_heap(strategy, universe, rebuilt.dates[-APPENDED_DAYS - 1::5])
+
+
+def test_screens_match_heap(market):
+    database, universe = market
+    strategy = _strategy(database, universe)
+    index = strategy.build_rank_index()
+
+    _assert_screens_match_heap(strategy, universe, index.dates[TRADING_DAYS_PER_YEAR::37])
+
+
+def test_mid_history_write_rescreens_from_the_day_before(market):
+    database, universe = market
+    strategy = _strategy(database, universe)
+    dates = strategy.build_rank_index().dates
+
+    # Double one ticker's momentum from a date on, which moves it up the screens after it
+    first_date = int(dates[len(dates) // 2])
+    column = _return_column(LOOK_BACK)
+    ticker = universe['Ticker'].iloc[3]
+    ticker_df = strategy.store.read(ticker, columns=[column])
+    ticker_df = ticker_df[ticker_df['Date'] >= first_date].copy()
+    ticker_df[column] = ticker_df[column] * 2
+    strategy.store.write(ticker, ticker_df, columns=[column])
+
+    assert _first_stale_row(strategy) == len(dates) // 2 - 1
+
+    incremental = strategy.build_rank_index()
+    _assert_same_index(incremental, _strategy(database, universe).build_rank_index(rebuild=True))
+    _assert_screens_match_heap(strategy, universe, dates[len(dates) // 2 - 1::41])
+
+
+def test_other_look_back_write_keeps_the_index(market):
+    database, universe = market
+    strategy = _strategy(database, universe)
+    index = strategy.build_rank_index()
+
+    _strategy(database, universe).compute_parameters(parameter_pairs=[(6, 1)])
+
+    assert _first_stale_row(strategy) == len(index)
+    _assert_same_index(strategy.build_rank_index(), index)
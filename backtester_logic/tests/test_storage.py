@@ -0,0 +1,73 @@
+"""PriceStore writes to the legacy per-ticker tables"""
+
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+from storage import PriceStore
+from utils import _ticker_to_table_name
+
+TICKER = 'SYN0001.US'
+
+
+@pytest.fixture
+def legacy_store(synthetic_database):
+    database, _ = synthetic_database(
+        num_of_tickers=3, years=1, seed=2, long_format=False)
+    return PriceStore(sqlite3.connect(database))
+
+
+def test_legacy_append_adds_missing_feature_columns(legacy_store):
+    ticker_df = legacy_store.read(TICKER)
+    new_rows = ticker_df.tail(2).copy()
+    new_rows['Close'] = [1.5, 2.5]
+    new_rows['Return_12_Month'] = [0.1, np.nan]
+
+    legacy_store.append(TICKER, new_rows)
+
+    stored = legacy_store.read(TICKER)
+    assert len(stored) == len(ticker_df)
+    appended = stored.set_index('Date').loc[new_rows['Date']]
+    assert appended['Close'].tolist() == [1.5, 2.5]
+    assert appended['Return_12_Month'].iloc[0] == 0.1
+    assert np.isnan(appended['Return_12_Month'].iloc[1])
+
+
+def test_legacy_append_is_one_transaction(legacy_store):
+    ticker_df = legacy_store.read(TICKER)
+    data_version = legacy_store.data_version()
+    new_rows = ticker_df.tail(2).copy()
+    # Not a value sqlite can bind, the insert fails after the delete
+    new_rows['Close'] = [object(), object()]
+
+    with pytest.raises(sqlite3.Error):
+        legacy_store.append(TICKER, new_rows)
+
+    pd.testing.assert_frame_equal(legacy_store.read(TICKER), ticker_df)
+    assert legacy_store.data_version() == data_version
+
+
+def test_legacy_write_replaces_table_and_bumps_version_together(legacy_store):
+    ticker_df = legacy_store.read(TICKER)
+    data_version = legacy_store.data_version()
+
+    broken_df = ticker_df.copy()
+    broken_df['Close'] = [object()] * len(broken_df)
+    with pytest.raises(sqlite3.Error):
+        legacy_store.write(TICKER, broken_df)
+
+    pd.testing.assert_frame_equal(legacy_store.read(TICKER), ticker_df)
+    assert legacy_store.data_version() == data_version
+
+    ticker_df['Close'] = ticker_df['Close'] * 2
+    legacy_store.write(TICKER, ticker_df)
+
+    pd.testing.assert_frame_equal(legacy_store.read(TICKER), ticker_df)
+    assert legacy_store.data_version() == data_version + 1
+    # Same schema as the table to_sql created
+    ticker_df.to_sql('reference', legacy_store.connector, index=False)
+    schema = [row[1:3] for row in legacy_store.connector.execute(
+        f"PRAGMA table_info({_ticker_to_table_name(TICKER)})")]
+    assert schema == [row[1:3] for row in legacy_store.connector.execute(
+        "PRAGMA table_info(reference)")]
@@ -0,0 +1,74 @@
+"""TradingCalendar schedules against the date loop of the original Backtester.backtest"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from synthetic import synthetic_dates
+from trading_calendar import TradingCalendar, SEASONAL_ANCHOR_MONTHS
+from utils import _int_to_datetime, _datetime_to_int
+
+
+@pytest.fixture(scope='module')
+def dates():
+    # Weekdays with holidays, so months may end on any weekday
+    dates = synthetic_dates(19700102, 6)
+    return dates[np.random.default_rng(0).random(len(dates)) > 0.05]
+
+
+def loop_rebalance_dates(dates, start_date, end_date, rebalance_period):
+    """The original schedule: rebalance on the first trading day on or after rebalance_period months
+    since start_date, then since each rebalance date"""
+
+    rebalance_date = _datetime_to_int(_int_to_datetime(
+        start_date) + relativedelta(months=rebalance_period))
+    rebalance_dates = []
+    for current_date in dates[(dates >= start_date) & (dates <= end_date)]:
+        if current_date >= rebalance_date:
+            rebalance_dates.append(int(current_date))
+            rebalance_date = _datetime_to_int(_int_to_datetime(
+                int(current_date)) + relativedelta(months=rebalance_period))
+    return rebalance_dates
+
+
+def seasonal_rebalance_dates(dates, start_date, end_date, rebalance_period, seasonality):
+    """Last trading day of every rebalance_period-th month counted from the anchor month, the month
+    of the axis' last day is not over"""
+
+    months = pd.Series(dates).groupby(dates // 100).max().iloc[:-1]
+    anchor = SEASONAL_ANCHOR_MONTHS[seasonality]
+    months = months[(months.index % 100 - anchor) % rebalance_period == 0]
+    return [int(date) for date in months if start_date < date <= end_date]
+
+
+@pytest.mark.parametrize('rebalance_period', [1, 2, 3, 6, 12])
+@pytest.mark.parametrize('start_date', [19700102, 19710131, 19720229, 19730815])
+def test_rebalance_rows_match_loop(dates, rebalance_period, start_date):
+    calendar = TradingCalendar(dates)
+    for end_date in (int(dates[-1]), 19741231):
+        rows = calendar.rebalance_rows(start_date, rebalance_period, end_date=end_date)
+        assert dates[rows].tolist() == loop_rebalance_dates(
+            dates, start_date, end_date, rebalance_period)
+
+
+@pytest.mark.parametrize('seasonality', sorted(SEASONAL_ANCHOR_MONTHS))
+@pytest.mark.parametrize('rebalance_period', [1, 3, 6, 12])
+def test_seasonal_rebalance_rows_are_anchored(dates, seasonality, rebalance_period):
+    calendar = TradingCalendar(dates)
+    for start_date, end_date in ((19700102, int(dates[-1])), (19710228, 19740630)):
+        rows = calendar.rebalance_rows(
+            start_date, rebalance_period, seasonality, end_date)
+        assert dates[rows].tolist() == seasonal_rebalance_dates(
+            dates, start_date, end_date, rebalance_period, seasonality)
+
+    # Quarterly schedules rebalance in the months the strategy describes
+    if rebalance_period == 3:
+        months = set(dates[calendar.rebalance_rows(19700102, 3, seasonality)] // 100 % 100)
+        assert months == {(SEASONAL_ANCHOR_MONTHS[seasonality] + 3 * quarter - 1) % 12 + 1
+                          for quarter in range(4)}
+
+
+def test_unknown_seasonality_raises(dates):
+    with pytest.raises(ValueError):
+        TradingCalendar(dates).rebalance_rows(19700102, 3, 'clever')
@@ -0,0 +1,149 @@
+import numpy as np
+
+# Month of the year each seasonal schedule is anchored on, a portfolio is rebalanced at the close of
+# every rebalance_period-th month counted from the anchor. Quarterly this gives
+#     smart : Feb, May, Aug and Nov
+#     avg : Jan, Apr, Jul and Oct
+#     dumb : Dec, Mar, Jun and Sep
+SEASONAL_ANCHOR_MONTHS = {
+    'smart': 2,
+    'avg': 1,
+    'dumb': 12,
+}
+
+
+def _month_number(dates: np.ndarray) -> np.ndarray:
+    """Months since year 0 of YYYYMMDD dates (January of year y is 12 * y)"""
+    return (dates // 10000) * 12 + dates // 100 % 100 - 1
+
+
+def to_ordinal(dates) -> np.ndarray:
+    """Converts YYYYMMDD ints into days since 1970-01-01"""
+
+    dates = np.asarray(dates, dtype=np.int64)
+    month_starts = (_month_number(dates) - 1970 * 12).astype('datetime64[M]')
+    return month_starts.astype('datetime64[D]').astype(np.int64) + dates % 100 - 1
+
+
+def from_ordinal(ordinals) -> np.ndarray:
+    """Converts days since 1970-01-01 into YYYYMMDD ints"""
+
+    days = np.asarray(ordinals, dtype=np.int64).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    month_number = months.astype(np.int64) + 1970 * 12
+    day = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+
+    return (month_number // 12) * 10000 + (month_number % 12 + 1) * 100 + day
+
+
+def add_months(dates, months: int) -> np.ndarray:
+    """Shifts YYYYMMDD dates by a number of months, clipping the day to the end of the month like relativedelta"""
+
+    dates = np.asarray(dates, dtype=np.int64)
+    month_number = _month_number(dates) + months
+
+    month_starts = (month_number - 1970 * 12).astype('datetime64[M]')
+    days_in_month = ((month_starts + 1).astype('datetime64[D]') -
+                     month_starts.astype('datetime64[D]')).astype(np.int64)
+
+    return (month_number // 12) * 10000 + (month_number % 12 + 1) * 100 + \
+        np.minimum(dates % 100, days_in_month)
+
+
+class TradingCalendar():
+    """The master date axis with its rebalance schedules, built once and queried by integer position
+
+    Positions are rows of the date axis (and of any Panel built on it). Schedules are computed
+    with vectorized date arithmetic the first time they are asked for and kept, so every
+    backtest of a sweep reuses them.
+    """
+
+    def __init__(self, dates) -> None:
+        """
+        Parameters
+        ----------
+        dates : sorted YYYYMMDD ints of the master date axis
+        """
+
+        self.dates = np.asarray(dates, dtype=np.int64)
+        # Days since 1970-01-01 of each trading day
+        self.ordinals = to_ordinal(self.dates)
+        self.month_numbers = _month_number(self.dates)
+        # Last trading day of each month, the axis' last day is left out since its month may not be over
+        self.month_ends = np.flatnonzero(
+            self.month_numbers[1:] != self.month_numbers[:-1])
+
+        self._next_rows = {}
+        self._schedules = {}
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def position(self, date: int, side: str = 'left') -> int:
+        """Returns the row of the first trading day >= date (> date when side is 'right'), len(self) if none"""
+        return int(np.searchsorted(self.dates, date, side=side))
+
+    def positions(self, dates, side: str = 'left') -> np.ndarray:
+        """Vectorized self.position"""
+        return np.searchsorted(self.dates, np.asarray(dates, dtype=np.int64), side=side)
+
+    def next_rows(self, rebalance_period: int) -> np.ndarray:
+        """Returns, for every row, the row of the first trading day on or after rebalance_period months later
+        (len(self) when the axis ends before)"""
+
+        if rebalance_period not in self._next_rows:
+            self._next_rows[rebalance_period] = self.positions(
+                add_months(self.dates, rebalance_period))
+
+        return self._next_rows[rebalance_period]
+
+    def rebalance_rows(self, start_date: int, rebalance_period: int, seasonality: str = None, end_date: int = None) -> np.ndarray:
+        """Returns the rows the portfolio is rebalanced on (after the close), the first portfolio is bought on start_date
+
+            - No seasonality: each portfolio is held up to and including the first trading day on
+              or after rebalance_period months later
+            - smart, avg or dumb: portfolios are rebalanced on the last trading day of every
+              rebalance_period-th month counted from the SEASONAL_ANCHOR_MONTHS month
+
+        Parameters
+        ----------
+        start_date : (int) YYYYMMDD the first portfolio is chosen on
+        rebalance_period : (int) months between rebalances
+        seasonality : (str) None, 'smart', 'avg' or 'dumb'
+        end_date : (int) YYYYMMDD of the last day simulated, defaults to the end of the axis
+
+        Returns
+        --------
+        rows : np.ndarray[int64] increasing rows of self.dates after start_date and up to end_date
+        """
+
+        key = (start_date, rebalance_period, seasonality, end_date)
+        if key in self._schedules:
+            return self._schedules[key]
+
+        end_row = len(self) if end_date is None else self.position(
+            end_date, side='right')
+
+        if seasonality is None:
+            next_rows = self.next_rows(rebalance_period)
+            rows = []
+            row = int(self.positions(add_months(start_date, rebalance_period)))
+            while row < end_row:
+                rows.append(row)
+                row = int(next_rows[row])
+            rows = np.array(rows, dtype=np.int64)
+        else:
+            if seasonality not in SEASONAL_ANCHOR_MONTHS:
+                raise ValueError(
+                    f"seasonality must be one of {', '.join(SEASONAL_ANCHOR_MONTHS)} or None, not {seasonality}")
+
+            anchor = SEASONAL_ANCHOR_MONTHS[seasonality] - 1
+            month_ends = self.month_ends[(
+                self.month_numbers[self.month_ends] - anchor) % rebalance_period == 0]
+            rows = month_ends[(self.dates[month_ends] > start_date) & (
+                month_ends < end_row)].astype(np.int64)
+
+        # Shared by every caller asking for the same schedule
+        rows.flags.writeable = False
+        self._schedules[key] = rows
+        return rows
@@ -1,5 +1,15 @@
 from datetime import datetime
 
+# Statistics of every equity_* table, one row per strategy keyed by its parameters. Written by
+# components/strategy_stats.py, the sweep deletes the rows of the tables it rewrites
+STATISTICS_TABLE = 'strategy_stats'
+
+PARAMETER_COLUMNS = ['look_back', 'lottery_window', 'rebalance', 'firms_held']
+
+# Version of every equity_* table, bumped by the sweep in the transaction that rewrites the table.
+# Readers key their caches on it, a table without a row (written before it existed) is version 0
+RESULTS_VERSION_TABLE = 'results_version'
+
 
 def _ticker_to_table_name(ticker: str) -> str:
     """Coverts a ticker into its SQL table name
@@ -0,0 +1,206 @@
+"""Checks that the incremental and materialized paths of the backtester agree with a full recompute
+
+Run from the repository root (SLIPPAGE_FACTOR must be configured as for any backtest):
+
+    python -m benchmarks.consistency_checks
+
+Every check builds its own synthetic database (see synthetic.generate_database), prints one line
+and the run exits with status 1 if any check fails.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+# backtester_logic uses flat imports, progress bars would drown the report
+BACKTESTER_LOGIC_PATH = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'backtester_logic')
+sys.path.insert(0, BACKTESTER_LOGIC_PATH)
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+from synthetic import generate_database  # noqa: E402
+from momentum_strategy import QuantitativeMomentum  # noqa: E402
+from features import TRADING_DAYS_PER_YEAR, _window_days, _return_column, _positive_column, _negative_column  # noqa: E402
+from storage import PriceStore  # noqa: E402
+from strategy import SLIPPAGE_FACTOR  # noqa: E402
+from trading_calendar import TradingCalendar  # noqa: E402
+
+# Strategy every check runs
+CHECK_STRATEGY = {
+    'look_back': 12,
+    'lottery_window': 1,
+}
+
+
+def _hold_back(database: str, days: int) -> pd.DataFrame:
+    """Removes the last days of every ticker from the database and returns them as bars to append"""
+
+    connector = sqlite3.connect(database)
+    cut = int(PriceStore(connector).dates()[-days - 1])
+    held_back = pd.read_sql_query(
+        "SELECT * FROM prices WHERE Date > ? ORDER BY Ticker, Date", connector, params=(cut,))
+    with connector:
+        connector.execute("DELETE FROM prices WHERE Date > ?", (cut,))
+    connector.close()
+
+    return held_back
+
+
+def check_rank_index_incremental(directory: str, seed: int = 0) -> list[str]:
+    """The nightly flow: one strategy object builds its rank index, appends new bars and brings the
+    index up to date. The result must equal a rebuild from scratch, in memory and as stored."""
+
+    database = os.path.join(directory, 'rank_index.db')
+    universe = generate_database(
+        database, num_of_tickers=60, years=3, seed=seed, fill_gaps=True)
+    new_bars = _hold_back(database, 21)
+
+    def _strategy() -> QuantitativeMomentum:
+        return QuantitativeMomentum(database, universe, **CHECK_STRATEGY)
+
+    strategy = _strategy()
+    strategy.compute_parameters()
+    strategy.build_rank_index()
+    strategy.append_bars(new_bars)
+    incremental = strategy.build_rank_index()
+
+    # Read what was stored before a rebuild overwrites it
+    stored = _strategy().build_rank_index()
+    rebuilt = _strategy().build_rank_index(rebuild=True)
+
+    failures = []
+    for name, index in (('same instance', incremental), ('stored', stored)):
+        for array in ('dates', 'offsets', 'positions', 'fip_score', 'next_open'):
+            if not np.array_equal(getattr(index, array), getattr(rebuilt, array)):
+                failures.append(f"{name} index differs from a rebuild in {array}")
+
+    return failures
+
+
+def check_append_bars_listing(directory: str, seed: int = 0) -> list[str]:
+    """Bars appended to a ticker that listed within the last window must get the features a full
+    recompute gives them, whether its stored tail starts before, on or after the listing date"""
+
+    database = os.path.join(directory, 'append.db')
+    universe = generate_database(
+        database, num_of_tickers=60, years=3, seed=seed, fill_gaps=True)
+    reference_database = os.path.join(directory, 'reference.db')
+    shutil.copyfile(database, reference_database)
+    QuantitativeMomentum(reference_database, universe,
+                         **CHECK_STRATEGY).compute_parameters()
+
+    connector = sqlite3.connect(database)
+    close = pd.read_sql_query(
+        "SELECT Ticker, Date, Close FROM prices ORDER BY Ticker, Date", connector)
+
+    # Cut the history of every late listed ticker so its stored tail starts a few days around
+    # the day before listing, the tail then holds all or all but one of its trading days
+    tail_length = _window_days(
+        [(CHECK_STRATEGY['look_back'], CHECK_STRATEGY['lottery_window'])]) + 1
+    cuts = {}
+    for ticker, rows in close.groupby('Ticker'):
+        listing_row = int(np.argmax(rows['Close'].to_numpy() > 0))
+        cut_row = listing_row + tail_length - 2 + len(cuts) % 6 - 3
+        if listing_row > 0 and cut_row < len(rows) - 1:
+            cuts[ticker] = int(rows['Date'].iloc[cut_row])
+
+    held_back = []
+    with connector:
+        for ticker, cut in cuts.items():
+            held_back.append(pd.read_sql_query(
+                "SELECT * FROM prices WHERE Ticker = ? AND Date > ? ORDER BY Date", connector, params=(ticker, cut)))
+            connector.execute(
+                "DELETE FROM prices WHERE Ticker = ? AND Date > ?", (ticker, cut))
+    connector.close()
+
+    strategy = QuantitativeMomentum(database, universe, **CHECK_STRATEGY)
+    strategy.compute_parameters()
+    strategy.append_bars(pd.concat(held_back, ignore_index=True))
+
+    columns = [_return_column(CHECK_STRATEGY['look_back']),
+               _positive_column(CHECK_STRATEGY['look_back']),
+               _negative_column(CHECK_STRATEGY['look_back'])]
+    appended, reference = (PriceStore(sqlite3.connect(path)) for path in (database, reference_database))
+
+    failures = []
+    for ticker in cuts:
+        for column in columns:
+            values, expected = (store.read(ticker, columns=[column])[column].to_numpy(dtype=np.float64)
+                                for store in (appended, reference))
+            if not np.allclose(values, expected, rtol=1e-12, atol=0, equal_nan=True):
+                failures.append(f"{ticker} {column} differs from a full recompute")
+
+    if not cuts:
+        failures.append("no ticker lists late enough to be cut")
+
+    return failures
+
+
+def check_portfolio_matches_weights(directory: str, seed: int = 0) -> list[str]:
+    """portfolio_construction must buy what the Backtester buys from target_weights and allocate: the
+    same firms and whole shares, small capitals included where some firms are too expensive for their weight"""
+
+    database = os.path.join(directory, 'portfolio.db')
+    universe = generate_database(
+        database, num_of_tickers=60, years=3, seed=seed, fill_gaps=True)
+    strategy = QuantitativeMomentum(
+        database, universe, firms_held=3, **CHECK_STRATEGY)
+    strategy.compute_parameters()
+
+    dates = strategy.store.dates()
+    calendar = TradingCalendar(dates)
+    rebalance_dates = dates[calendar.rebalance_rows(int(dates[TRADING_DAYS_PER_YEAR + 1]), 1)].tolist()
+    weights = strategy.target_weights(rebalance_dates)
+    tickers = strategy._screened_tickers()
+
+    failures = []
+    for capital in (150, 100_000):
+        for row, date in enumerate(rebalance_dates):
+            portfolio, _, _ = strategy.portfolio_construction(capital, date)
+            held_weights = strategy.allocate(date, weights[row], capital)
+            positions, _, next_open = strategy._screen(date)
+            cost = SLIPPAGE_FACTOR * next_open
+            shares = np.floor(held_weights[positions] * capital / cost)
+            expected = {str(tickers[position]): int(count)
+                        for position, count in zip(positions, shares) if count > 0}
+            if {ticker: count for ticker, count, _ in portfolio} != expected:
+                failures.append(f"{date} with {capital} capital buys other shares than the weights")
+
+    return failures
+
+
+CHECKS = {
+    'rank_index_incremental': check_rank_index_incremental,
+    'append_bars_listing': check_append_bars_listing,
+    'portfolio_matches_weights': check_portfolio_matches_weights,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--checks', nargs='+', choices=list(CHECKS), default=list(CHECKS))
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workspace:
+        for name in arguments.checks:
+            directory = os.path.join(workspace, name)
+            os.makedirs(directory)
+            failures = CHECKS[name](directory, seed=arguments.seed)
+
+            print(f"{name:<32}{'FAILED' if failures else 'ok'}")
+            for failure in failures:
+                print(f"    {failure}")
+            failed |= bool(failures)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
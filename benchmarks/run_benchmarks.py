@@ -0,0 +1,307 @@
+"""Times the hot paths of the backtester and the website on synthetic universes of several sizes
+
+Run from the repository root (SLIPPAGE_FACTOR must be configured as for any backtest):
+
+    python -m benchmarks.run_benchmarks --sizes small medium
+    python -m benchmarks.run_benchmarks --save-baseline
+
+Every size gets its own database from synthetic.generate_database, so the numbers only depend
+on the code and the machine. Results are written as JSON and compared against the baseline
+stored on this machine (benchmarks/baseline.json, not versioned as timings do not carry across
+machines): a benchmark whose best time is more than the tolerance slower is flagged and the
+run exits with status 1. The first run, without a baseline, only records one; --save-baseline
+replaces it.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from components.utils import _get_statistics
+from components.const import INTIAL_CAPITAL, DATABASE_PATH
+
+# backtester_logic uses flat imports, progress bars would drown the report
+BACKTESTER_LOGIC_PATH = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'backtester_logic')
+sys.path.insert(0, BACKTESTER_LOGIC_PATH)
+os.environ.setdefault('TQDM_DISABLE', '1')
+
+from synthetic import generate_database  # noqa: E402
+from momentum_strategy import QuantitativeMomentum  # noqa: E402
+from backtester import Backtester  # noqa: E402
+from features import TRADING_DAYS_PER_YEAR, _months_to_days, _return_column, _positive_column, _negative_column  # noqa: E402
+from panel import load_panel, COMPACT_DTYPE  # noqa: E402
+from storage import PriceStore  # noqa: E402
+from trading_calendar import TradingCalendar  # noqa: E402
+import profiling  # noqa: E402
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+BASELINE_PATH = os.path.join(BENCHMARKS_PATH, 'baseline.json')
+RESULTS_PATH = os.path.join(BENCHMARKS_PATH, 'results.json')
+
+# (tickers, years) of the synthetic universe of each size
+SIZES = {
+    'small': (50, 5),
+    'medium': (200, 10),
+    'large': (1000, 20),
+}
+
+# A benchmark regresses when its best time is this fraction slower than the baseline's
+REGRESSION_TOLERANCE = 0.25
+
+# Strategy every benchmark runs
+BENCHMARK_STRATEGY = {
+    'look_back': 12,
+    'lottery_window': 1,
+    'rebalance': 3,
+    'firms_held': 25
+}
+
+
+def _time(run, setup=None, repeat: int = 3) -> list[float]:
+    """Returns the wall time of repeat calls of run, each given a fresh setup() result that is not timed"""
+
+    times = []
+    for _ in range(repeat):
+        arguments = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        run(*arguments)
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def benchmark_size(size: str, num_of_tickers: int, years: int, directory: str, repeat: int = 3, seed: int = 0) -> list[dict]:
+    """Times every hot path on one synthetic universe
+
+    validate_data and compute_parameters rewrite the database, so each run works on its own
+    copy. Later benchmarks run on the output of the earlier ones, as in data_preparation.ipynb.
+    """
+
+    os.makedirs(directory)
+    raw_database = os.path.join(directory, 'raw.db')
+    universe = generate_database(raw_database, num_of_tickers=num_of_tickers,
+                                 years=years, seed=seed)
+
+    copies = []
+
+    def _copy(source: str) -> str:
+        # A new file per run, earlier runs may still hold connections to theirs
+        database = os.path.join(directory, f'run_{len(copies)}.db')
+        shutil.copyfile(source, database)
+        copies.append(database)
+        return database
+
+    def _strategy(database: str, **panel_options) -> QuantitativeMomentum:
+        return QuantitativeMomentum(database, universe,
+                                    rebalance_period=BENCHMARK_STRATEGY['rebalance'],
+                                    look_back=BENCHMARK_STRATEGY['look_back'],
+                                    lottery_window=BENCHMARK_STRATEGY['lottery_window'],
+                                    firms_held=BENCHMARK_STRATEGY['firms_held'],
+                                    **panel_options)
+
+    timings = {}
+
+    timings['validate_data'] = _time(lambda database: _strategy(database).validate_data(),
+                                     setup=lambda: _copy(raw_database), repeat=repeat)
+    validated_database = copies[-1]
+
+    timings['compute_parameters'] = _time(lambda database: _strategy(database).compute_parameters(),
+                                          setup=lambda: _copy(validated_database), repeat=repeat)
+    database = copies[-1]
+
+    connector = sqlite3.connect(database)
+    dates = PriceStore(connector).dates()
+    panel = load_panel(connector, universe['Ticker'], columns=[
+        'Open', 'Close',
+        _return_column(BENCHMARK_STRATEGY['look_back']),
+        _positive_column(BENCHMARK_STRATEGY['look_back']),
+        _negative_column(BENCHMARK_STRATEGY['look_back'])], cache=False)
+    spx_daily = pd.read_sql("SELECT * FROM SPX_DAILY", con=connector)
+    connector.close()
+
+    # Trade once the look back window is filled
+    start_date = int(
+        dates[_months_to_days(BENCHMARK_STRATEGY['look_back']) + 1])
+    end_date = int(dates[-1])
+    rebalance_dates = dates[TradingCalendar(dates).rebalance_rows(
+        start_date, 1)].tolist()
+
+    def _loaded_strategy():
+        strategy = _strategy(database, panel=panel)
+        strategy.feature_panel()
+        return strategy
+
+    timings['portfolio_construction'] = _time(
+        lambda strategy: [strategy.portfolio_construction(INTIAL_CAPITAL, date)
+                          for date in rebalance_dates],
+        setup=_loaded_strategy, repeat=repeat)
+
+    # Screens of every trading date materialized once, portfolios are then lookups and slices
+    timings['rank_index_build'] = _time(
+        lambda strategy: strategy.build_rank_index(rebuild=True),
+        setup=_loaded_strategy, repeat=repeat)
+
+    indexed_strategy = _strategy(database)
+    indexed_strategy.build_rank_index()
+    timings['portfolio_construction_indexed'] = _time(
+        lambda: [indexed_strategy.portfolio_construction(INTIAL_CAPITAL, date)
+                 for date in rebalance_dates], repeat=repeat)
+
+    timings['backtest'] = _time(
+        lambda arguments: arguments[1].backtest(arguments[0], start_date=start_date, end_date=end_date),
+        setup=lambda: (_loaded_strategy(), Backtester(database, panel=panel)), repeat=repeat)
+
+    # float32 panels streamed a decade of dates at a time, reading them is part of the run
+    chunked = {'dtype': COMPACT_DTYPE, 'chunk_rows': 10 * TRADING_DAYS_PER_YEAR}
+    timings['backtest_chunked'] = _time(
+        lambda arguments: arguments[1].backtest(arguments[0], start_date=start_date, end_date=end_date),
+        setup=lambda: (_strategy(database, **chunked), Backtester(database, **chunked)), repeat=repeat)
+
+    # The risk free rates are read once per process, time the warm path the website serves
+    _get_statistics(spx_daily, INTIAL_CAPITAL)
+    timings['_get_statistics'] = _time(
+        lambda: _get_statistics(spx_daily, INTIAL_CAPITAL), repeat=repeat)
+
+    return [{
+        'benchmark': benchmark,
+        'size': size,
+        'tickers': num_of_tickers,
+        'years': years,
+        'best': min(times),
+        'median': statistics.median(times),
+        'times': times,
+    } for benchmark, times in timings.items()]
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float = REGRESSION_TOLERANCE) -> list[dict]:
+    """Adds the 'baseline', 'change' and 'regression' of every result measured in the baseline
+
+    change is the relative difference of the best times, a result regresses when change > tolerance
+    """
+
+    baseline_best = {(result['benchmark'], result['tickers'], result['years']): result['best']
+                     for result in baseline}
+
+    for result in results:
+        best = baseline_best.get(
+            (result['benchmark'], result['tickers'], result['years']))
+        result['baseline'] = best
+        result['change'] = None if best is None else result['best'] / best - 1
+        result['regression'] = best is not None and result['change'] > tolerance
+
+    return results
+
+
+def _read_results(path: str) -> list[dict]:
+    with open(path) as file:
+        return json.load(file)['results']
+
+
+def _write_results(path: str, results: list[dict], arguments) -> None:
+    with open(path, 'w') as file:
+        json.dump({
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'machine': {
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'cpus': os.cpu_count(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+            },
+            'repeat': arguments.repeat,
+            'seed': arguments.seed,
+            'strategy': BENCHMARK_STRATEGY,
+            'results': results,
+        }, file, indent=2)
+
+
+def _print_report(results: list[dict]) -> None:
+
+    print(f"{'benchmark':<32}{'size':<10}{'best (s)':>12}{'median (s)':>12}{'baseline':>12}{'change':>10}")
+    for result in results:
+        baseline = '' if result['baseline'] is None else f"{result['baseline']:.4f}"
+        change = '' if result['change'] is None else f"{result['change']:+.1%}"
+        flag = '  REGRESSION' if result['regression'] else ''
+        print(f"{result['benchmark']:<32}{result['size']:<10}{result['best']:>12.4f}"
+              f"{result['median']:>12.4f}{baseline:>12}{change:>10}{flag}")
+
+
+def _parse_size(size: str) -> tuple[str, int, int]:
+    """Reads a SIZES name or TICKERSxYEARS (e.g. 500x15)"""
+
+    if size in SIZES:
+        return (size, *SIZES[size])
+
+    try:
+        num_of_tickers, years = (int(value) for value in size.split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{size} is not one of {', '.join(SIZES)} or TICKERSxYEARS")
+    return size, num_of_tickers, years
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=_parse_size,
+                        default=[_parse_size('small'), _parse_size('medium')])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=RESULTS_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store these results as the baseline (done by default when there is none)")
+    parser.add_argument('--profile', metavar='DIRECTORY',
+                        help="write the phase profile of every timed run to DIRECTORY (slows the timings)")
+    arguments = parser.parse_args()
+
+    if arguments.profile is not None:
+        profiling.enable(os.path.abspath(arguments.profile))
+
+    output = os.path.abspath(arguments.output)
+    baseline_path = os.path.abspath(arguments.baseline)
+    baseline = _read_results(baseline_path) if os.path.exists(
+        baseline_path) and not arguments.save_baseline else []
+
+    working_directory = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as workspace:
+        # The website's helpers read the risk free rates from DATABASE_PATH, relative to the working directory
+        os.chdir(workspace)
+        try:
+            os.makedirs(os.path.dirname(DATABASE_PATH))
+            generate_database(DATABASE_PATH, num_of_tickers=1, years=max(
+                years for _, _, years in arguments.sizes), seed=arguments.seed)
+
+            for size, num_of_tickers, years in arguments.sizes:
+                print(f"Benchmarking {size}: {num_of_tickers} tickers x {years} years")
+                results += benchmark_size(size, num_of_tickers, years, os.path.join(workspace, size),
+                                          repeat=arguments.repeat, seed=arguments.seed)
+        finally:
+            os.chdir(working_directory)
+
+    results = compare(results, baseline, arguments.tolerance)
+    _print_report(results)
+
+    _write_results(output, results, arguments)
+    if arguments.save_baseline or not os.path.exists(baseline_path):
+        _write_results(baseline_path, results, arguments)
+        print(f"Baseline saved to {baseline_path}")
+
+    return 1 if any(result['regression'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
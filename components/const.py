@@ -1,3 +1,23 @@
 INTIAL_CAPITAL = 100_000
 
 DATABASE_PATH = "./backtester_logic/StratData.db"
+
+# Strategy shown when the results page is first opened
+DEFAULT_STRATEGY = {
+    'look_back': 12,
+    'lottery_window': 12,
+    'rebalance': 3,
+    'firms_held': 50
+}
+
+# Number of rendered strategies (figure and statistics table) kept by the result cache
+RESULT_CACHE_SIZE = 32
+
+# Trading calendars whose daily risk free rates are kept, equity curves mostly share a few
+RISK_FREE_CACHE_SIZE = 16
+
+# Most points sent to the browser per trace of the performance graph
+MAX_GRAPH_POINTS = 2_000
+
+# Processes running on-demand backtests of strategies that are not in the database
+BACKTEST_WORKERS = 2
@@ -0,0 +1,55 @@
+import os
+import pathlib
+import sqlite3
+import threading
+from components.const import DATABASE_PATH
+
+# Pragmas applied to every read-only connection
+MMAP_SIZE = 256 * 1024 * 1024  # bytes of the database file memory-mapped
+CACHE_SIZE = -64 * 1024  # page cache in KiB (negative values are KiB in SQLite)
+BUSY_TIMEOUT = 5.0  # seconds to wait on a lock held by a writer
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def _read_only_uri(database_path: str) -> str:
+    return f"{pathlib.Path(database_path).resolve().as_uri()}?mode=ro"
+
+
+def _connect(database_path: str) -> sqlite3.Connection:
+    """Opens a read-only connection tuned for the website's reads
+
+    The journal mode can only be changed by a writer, run_sweep puts the database in WAL mode
+    so these readers never block on (or are blocked by) a sweep writing new result tables
+    """
+
+    connector = sqlite3.connect(
+        _read_only_uri(database_path),
+        uri=True,
+        timeout=BUSY_TIMEOUT,
+        cached_statements=CACHED_STATEMENTS
+    )
+    connector.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    connector.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+    connector.execute("PRAGMA query_only = 1")
+
+    return connector
+
+
+def get_connection(database_path: str = DATABASE_PATH) -> sqlite3.Connection:
+    """Returns this thread's read-only connection to the database, opened on first use
+
+    Connections are never shared between threads or processes (a forked worker opens its own),
+    callers must not close them.
+    """
+
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+
+    if database_path not in connections:
+        connections[database_path] = _connect(database_path)
+
+    return connections[database_path]
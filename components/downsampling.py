@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from components.const import MAX_GRAPH_POINTS
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling
+
+    Keeps the first and last points and, from each of threshold - 2 equal buckets in between,
+    the point forming the largest triangle with the point kept from the previous bucket
+    and the average of the next bucket.
+
+    Parameters
+    ----------
+    x : (np.ndarray) increasing float x coordinates
+    y : (np.ndarray) float y coordinates
+    threshold : (int) number of points to keep
+
+    Returns
+    --------
+    indices : np.ndarray of the positions of the kept points, in increasing order
+    """
+
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, length - 1
+
+    kept = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        if bucket == threshold - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_end = edges[bucket + 2]
+            next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+
+        # Twice the area of the triangle (kept point, candidate, next bucket average)
+        area = np.abs((x[kept] - next_x) * (y[start:end] - y[kept]) -
+                      (x[kept] - x[start:end]) * (next_y - y[kept]))
+        kept = start + int(np.argmax(area))
+        indices[bucket + 1] = kept
+
+    return indices
+
+
+def resolution_levels(equity_df: pd.DataFrame, max_points: int = MAX_GRAPH_POINTS) -> dict:
+    """Builds the multi-resolution store of an equity curve
+
+    Returns
+    --------
+    levels : dict of pd.Series (Equity indexed by date) ordered finest first:
+             'daily', 'weekly' and 'monthly' closes, and 'overview', the LTTB downsampled daily
+             series used when the whole curve is shown
+    """
+
+    dates = pd.to_datetime(equity_df['Date'].astype(str), format='%Y%m%d')
+    daily = pd.Series(equity_df['Equity'].to_numpy(dtype=np.float64),
+                      index=pd.DatetimeIndex(dates))
+
+    return {
+        'daily': daily,
+        'weekly': daily.resample('W').last().dropna(),
+        'monthly': daily.resample('ME').last().dropna(),
+        'overview': _lttb_series(daily, max_points),
+    }
+
+
+def _lttb_series(series: pd.Series, max_points: int) -> pd.Series:
+    """Downsamples series with LTTB, triangles are measured on log equity since the graph uses a log axis"""
+
+    if len(series) <= max_points:
+        return series
+
+    x = (series.index.asi8 - series.index.asi8[0]) / 86_400e9  # days
+    y = np.log(np.maximum(series.to_numpy(), np.finfo(np.float64).tiny))
+
+    return series.iloc[lttb(x, y, max_points)]
+
+
+def visible_series(levels: dict, start=None, end=None, max_points: int = MAX_GRAPH_POINTS) -> pd.Series:
+    """Returns the points of an equity curve to draw between start and end
+
+    Ranges holding at most max_points days are drawn at full daily resolution. Wider ranges are
+    LTTB downsampled from the finest level with at most 4 * max_points points in the range, so a
+    zoom never scans the full daily history. No range returns the precomputed overview.
+    """
+
+    if start is None and end is None:
+        return levels['overview']
+
+    daily = _in_range(levels['daily'], start, end)
+    if len(daily) <= max_points:
+        return daily
+
+    for level in ('daily', 'weekly', 'monthly'):
+        series = _in_range(levels[level], start, end)
+        if len(series) <= 4 * max_points:
+            break
+
+    return _lttb_series(series, max_points)
+
+
+def _in_range(series: pd.Series, start, end) -> pd.Series:
+    """Returns the points between start and end plus the one just outside each edge, so lines reach the axis ends"""
+
+    first = 0 if start is None else max(
+        series.index.searchsorted(pd.Timestamp(start), side='right') - 1, 0)
+    last = len(series) if end is None else series.index.searchsorted(
+        pd.Timestamp(end), side='left') + 1
+
+    return series.iloc[first:last]
@@ -0,0 +1,170 @@
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from functools import lru_cache
+from components.utils import _strategy_table_convention
+from components.const import DATABASE_PATH, BACKTEST_WORKERS
+
+# backtester_logic uses flat imports, workers put it on their path
+BACKTESTER_LOGIC_PATH = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'backtester_logic')
+
+# Fraction of the backtest between two progress updates sent back to the website
+PROGRESS_STEP = 0.01
+
+# Shown for a failed job, the error itself only goes to the server log
+FAILED_JOB_ERROR = "an unexpected error occurred"
+
+logger = logging.getLogger(__name__)
+
+
+class BacktestCancelled(Exception):
+    """Raised inside a worker to stop a backtest the user cancelled"""
+
+
+def _init_worker() -> None:
+    if BACKTESTER_LOGIC_PATH not in sys.path:
+        sys.path.insert(0, BACKTESTER_LOGIC_PATH)
+
+
+def _run_job(database: str, configuration: dict, progress, cancel_event) -> str:
+    """Worker: backtests one configuration, reporting progress through the shared progress dict"""
+
+    from sweep import backtest_configuration
+
+    def _progress_callback(stage, done, total):
+        if cancel_event.is_set():
+            raise BacktestCancelled()
+
+        fraction = done / total if total else 0.0
+        if stage != progress.get('stage') or fraction - progress.get('fraction', 0.0) >= PROGRESS_STEP or done == total:
+            progress.update({'stage': stage, 'fraction': fraction})
+
+    progress.update({'stage': 'starting', 'fraction': 0.0})
+
+    return backtest_configuration(database, configuration, progress_callback=_progress_callback)
+
+
+class BacktestJobs():
+    """Runs backtests of strategies that have no equity table on a local process pool
+
+    A job is identified by the _strategy_table_convention name of its result, so identical
+    requests share the job already queued or running and a finished job is never rerun
+    (its table exists). Progress and cancellation go through a multiprocessing manager, the
+    computation of missing momentum columns is serialized by sweep.feature_lock.
+    """
+
+    def __init__(self, database: str = DATABASE_PATH, max_workers: int = BACKTEST_WORKERS) -> None:
+
+        self.database = os.path.abspath(database)
+        self.max_workers = max_workers
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manager = None
+
+    def _start(self) -> None:
+        """Starts the manager and the pool on first use, spawned so no web server thread state is forked"""
+
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                             mp_context=context,
+                                             initializer=_init_worker)
+
+    def submit(self, look_back: int, lottery_window: int, rebalance: int, firms_held: int) -> str:
+        """Queues a backtest unless an identical one is already queued or running
+
+        Returns
+        --------
+        job_id : (str) the _strategy_table_convention name of the result table
+        """
+
+        configuration = {'look_back': look_back, 'lottery_window': lottery_window,
+                         'rebalance': rebalance, 'firms_held': firms_held}
+        job_id = _strategy_table_convention(**configuration)
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job['future'].done():
+                return job_id
+
+            if self._executor is None:
+                self._start()
+
+            progress = self._manager.dict()
+            cancel_event = self._manager.Event()
+            future = self._executor.submit(_run_job, self.database, configuration,
+                                           progress, cancel_event)
+            future.add_done_callback(
+                lambda future: _log_failure(job_id, future))
+            self._jobs[job_id] = {
+                'progress': progress,
+                'cancel_event': cancel_event,
+                'future': future
+            }
+
+        return job_id
+
+    def status(self, job_id: str) -> dict:
+        """Returns {'state', 'stage', 'progress', 'error'} of a job
+
+        state is one of 'queued', 'running', 'cancelling', 'done', 'failed', 'cancelled' or 'unknown'
+        """
+
+        job = self._jobs.get(job_id)
+        if job is None:
+            return {'state': 'unknown', 'stage': None, 'progress': 0.0, 'error': None}
+
+        future = job['future']
+        status = {'state': 'queued', 'stage': None,
+                  'progress': 0.0, 'error': None}
+
+        if future.done():
+            try:
+                future.result()
+                status.update(state='done', progress=1.0)
+            except (CancelledError, BacktestCancelled):
+                status['state'] = 'cancelled'
+            except Exception:
+                status.update(state='failed', error=FAILED_JOB_ERROR)
+            return status
+
+        progress = dict(job['progress'])
+        if progress:
+            status.update(state='running', stage=progress['stage'],
+                          progress=progress['fraction'])
+        if job['cancel_event'].is_set():
+            status['state'] = 'cancelling'
+        return status
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a queued or running job, returns False when it already finished"""
+
+        job = self._jobs.get(job_id)
+        if job is None or job['future'].done():
+            return False
+
+        # A queued job never starts, a running one stops at its next progress update
+        if not job['future'].cancel():
+            job['cancel_event'].set()
+        return True
+
+
+def _log_failure(job_id: str, future) -> None:
+    """Logs the error of a failed job once, with its traceback"""
+
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None and not isinstance(error, BacktestCancelled):
+        logger.error("Backtest %s failed", job_id, exc_info=error)
+
+
+@lru_cache(maxsize=None)
+def backtest_jobs() -> BacktestJobs:
+    """Returns the process wide job queue, the pool is only started by the first submitted job"""
+    return BacktestJobs()
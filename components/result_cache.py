@@ -0,0 +1,122 @@
+import sqlite3
+import pandas as pd
+from functools import lru_cache
+from components.strategy_page_components import create_performance_graph, create_stats_table, spx_levels
+from components.downsampling import resolution_levels, visible_series
+from components.strategy_stats import strategy_statistics
+from components.utils import _strategy_table_convention
+from components.db import get_connection
+from components.const import RESULT_CACHE_SIZE
+from backtester_logic.utils import RESULTS_VERSION_TABLE
+
+
+def _results_version(table_name: str) -> int:
+    """Returns the version of an equity table, bumped by the sweep whenever it rewrites the table"""
+
+    try:
+        row = get_connection().execute(
+            f'SELECT Version FROM {RESULTS_VERSION_TABLE} WHERE Name = ?', (table_name,)).fetchone()
+    except sqlite3.OperationalError:
+        # No sweep has written a table since the versions were introduced
+        return 0
+
+    return 0 if row is None else row[0]
+
+
+@lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _equity_series(look_back: int, lottery_window: int, rebalance: int, firms_held: int, version: int) -> tuple:
+    """Reads an equity table once, returning it with its multi-resolution store
+
+    version is only part of the cache key, a rewritten equity table gets a new entry
+    and the stale one ages out of the cache
+    """
+
+    equity_df = pd.read_sql(
+        f"""SELECT * FROM {_strategy_table_convention(
+            look_back=look_back,
+            lottery_window=lottery_window,
+            rebalance=rebalance,
+            firms_held=firms_held
+        )}""",
+        con=get_connection()
+    )
+
+    return equity_df, resolution_levels(equity_df)
+
+
+@lru_cache(maxsize=RESULT_CACHE_SIZE)
+def _render_performance(look_back: int, lottery_window: int, rebalance: int, firms_held: int, version: int) -> tuple:
+    """Builds the figure (as plotly JSON) and statistics table of a strategy"""
+
+    equity_df, equity_levels = _equity_series(
+        look_back, lottery_window, rebalance, firms_held, version)
+
+    # Served from the strategy_stats table, computed live for strategies missing from it
+    equity_stats = strategy_statistics(
+        get_connection(), equity_df, look_back, lottery_window, rebalance, firms_held)
+
+    uirevision = _strategy_table_convention(
+        look_back=look_back,
+        lottery_window=lottery_window,
+        rebalance=rebalance,
+        firms_held=firms_held
+    )
+
+    return create_performance_graph(equity_levels, uirevision).to_dict(), create_stats_table(equity_stats)
+
+
+def _strategy_key(look_back, lottery_window, rebalance, firms_held) -> tuple:
+    """Returns the cache key of a strategy: its parameters as ints and the version of its equity table"""
+
+    look_back, lottery_window, rebalance, firms_held = map(
+        int, (look_back, lottery_window, rebalance, firms_held))
+
+    version = _results_version(_strategy_table_convention(
+        look_back=look_back,
+        lottery_window=lottery_window,
+        rebalance=rebalance,
+        firms_held=firms_held
+    ))
+
+    return look_back, lottery_window, rebalance, firms_held, version
+
+
+def strategy_exists(look_back, lottery_window, rebalance, firms_held) -> bool:
+    """Returns whether the equity table of a strategy has been written"""
+
+    table_name = _strategy_table_convention(
+        look_back=int(look_back),
+        lottery_window=int(lottery_window),
+        rebalance=int(rebalance),
+        firms_held=int(firms_held)
+    )
+    return get_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+
+
+def performance_results(look_back, lottery_window, rebalance, firms_held) -> tuple:
+    """Returns the (figure, statistics table) of a strategy, rendered only when it is not cached
+    or its equity table changed"""
+
+    return _render_performance(*_strategy_key(look_back, lottery_window, rebalance, firms_held))
+
+
+def visible_equity(look_back, lottery_window, rebalance, firms_held, start=None, end=None) -> tuple:
+    """Returns the (benchmark, strategy) points to draw for the x axis range [start, end]"""
+
+    _, equity_levels = _equity_series(
+        *_strategy_key(look_back, lottery_window, rebalance, firms_held))
+
+    return visible_series(spx_levels(), start, end), visible_series(equity_levels, start, end)
+
+
+def cache_statistics() -> dict:
+    """Returns the hit/miss counters of the result cache"""
+
+    info = _render_performance.cache_info()
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+    }
@@ -1,27 +1,34 @@
 import dash_bootstrap_components as dbc
 from dash import html, dcc
 import pandas as pd
-import plotly.express as px
-from components.utils import _get_statistics, _strategy_table_convention
-from components.const import INTIAL_CAPITAL, DATABASE_PATH
-import sqlite3
+import plotly.graph_objects as go
+from functools import lru_cache
+from components.utils import _get_statistics
+from components.downsampling import resolution_levels
+from components.const import INTIAL_CAPITAL
+from components.db import get_connection
 
-conn = sqlite3.connect(DATABASE_PATH)
+# Nothing below touches the database or the filesystem at import, the benchmark series
+# and the page content are loaded on first use and kept for the life of the process
 
-spx_d_df = pd.read_sql("SELECT * FROM SPX_DAILY", con=conn)
 
-equity_df = pd.read_sql(
-    f"""SELECT * FROM {_strategy_table_convention(
-            look_back=12,
-            lottery_window=12,
-            rebalance=3,
-            firms_held=50
-        )}""",
-    con=conn
-)
+@lru_cache(maxsize=None)
+def _spx_daily() -> pd.DataFrame:
+    """Returns the SPX benchmark equity series, read from the database once"""
+
+    return pd.read_sql("SELECT * FROM SPX_DAILY", con=get_connection())
+
+
+@lru_cache(maxsize=None)
+def _spx_statistics() -> dict:
+    return _get_statistics(_spx_daily(), INTIAL_CAPITAL)
+
+
+@lru_cache(maxsize=None)
+def spx_levels() -> dict:
+    """Returns the multi-resolution store of the SPX benchmark (see downsampling.resolution_levels)"""
+    return resolution_levels(_spx_daily())
 
-spx_stats = _get_statistics(spx_d_df, INTIAL_CAPITAL)
-equity_stats = _get_statistics(equity_df, INTIAL_CAPITAL)
 
 """
     Strategy Used and Backtesting Process Card
@@ -48,65 +55,121 @@ def _create_tab(card_body, tab_label: str) -> dbc.Tab:
         label=tab_label)
 
 
-about_cardbody = [dcc.Markdown(open(
-    'components/project_summary.txt', "r").read())]
+select_style = {'maxWidth': '300px'}
 
-strat_explanation = dcc.Markdown(open(
-    'components/strat_summary.txt', "r").read())
 
-select_style = {'maxWidth': '300px'}
+@lru_cache(maxsize=None)
+def content_explanation() -> dbc.Tabs:
+    """Returns the About and Strategy tabs, the summaries are read from disk the first time"""
+
+    about_cardbody = [dcc.Markdown(open(
+        'components/project_summary.txt', "r").read())]
+
+    strat_explanation = dcc.Markdown(open(
+        'components/strat_summary.txt', "r").read())
 
-strategy_cardbody = [
-    strat_explanation,
-    html.Center(
+    return dbc.Tabs(
+        [
+            _create_tab(about_cardbody, "About"),
+            _create_tab(_strategy_cardbody(strat_explanation), "Strategy"),
+        ]
+    )
+
+
+def _strategy_cardbody(strat_explanation) -> list:
+    return [
+        strat_explanation,
+        html.Center(
+            [
+                dbc.Select(id='look_back', placeholder='Look Back Window', options=_create_options(
+                    [12, 36, 60], 'Look Back Window:', 'Months'), style=select_style),
+                html.Br(),
+                dbc.Select(id='lottery_window', placeholder='Lottery Window', options=_create_options(
+                    [1, 3, 6, 12], 'Lottery Window:', 'Months'), style=select_style),
+                html.Br(),
+                dbc.Select(id='rebalnce_period', placeholder='Rebalance Period', options=_create_options(
+                    [1, 3, 6, 12], 'Rebalance Every:', 'Months'), style=select_style),
+                html.Br(),
+                dbc.Select(id='firms_held', placeholder='Firms Held', options=_create_options(
+                    [25, 50, 100, 200], 'Hold:', 'Firms'), style=select_style),
+                html.Br(),
+                html.P("Or enter custom values, they replace the choices above and are backtested if needed"),
+                dbc.Input(id='custom_look_back', type='number', min=1, step=1,
+                          placeholder='Look Back Window (Months)', style=select_style),
+                dbc.Input(id='custom_lottery_window', type='number', min=1, step=1,
+                          placeholder='Lottery Window (Months)', style=select_style),
+                dbc.Input(id='custom_rebalance_period', type='number', min=1, step=1,
+                          placeholder='Rebalance Every (Months)', style=select_style),
+                dbc.Input(id='custom_firms_held', type='number', min=1, step=1,
+                          placeholder='Firms Held', style=select_style),
+                html.Br(),
+                dbc.Button("Visualize Strategy", id='strategy_button'),
+                html.Div(id='my-output'),
+                _backtest_job_card()]
+        )
+    ]
+
+
+def _backtest_job_card() -> html.Div:
+    """Progress of an on-demand backtest, hidden until one is queued"""
+
+    return html.Div(
         [
-            dbc.Select(id='look_back', placeholder='Look Back Window', options=_create_options(
-                [12, 36, 60], 'Look Back Window:', 'Months'), style=select_style),
-            html.Br(),
-            dbc.Select(id='lottery_window', placeholder='Lottery Window', options=_create_options(
-                [1, 3, 6, 12], 'Lottery Window:', 'Months'), style=select_style),
-            html.Br(),
-            dbc.Select(id='rebalnce_period', placeholder='Rebalance Period', options=_create_options(
-                [1, 3, 6, 12], 'Rebalance Every:', 'Months'), style=select_style),
             html.Br(),
-            dbc.Select(id='firms_held', placeholder='Firms Held', options=_create_options(
-                [25, 50, 100, 200], 'Hold:', 'Firms'), style=select_style),
+            html.Div(id='backtest_status'),
+            dbc.Progress(id='backtest_progress', value=0, style=select_style),
             html.Br(),
-            dbc.Button("Visualize Strategy", id='strategy_button'),
-            html.Div(id='my-output')]
+            dbc.Button("Cancel Backtest", id='cancel_backtest',
+                       color='secondary', size='sm')
+        ],
+        id='backtest_job',
+        style={'display': 'none'}
     )
-]
 
-content_explanation = dbc.Tabs(
-    [
-        _create_tab(about_cardbody, "About"),
-        _create_tab(strategy_cardbody, "Strategy"),
-    ]
-)
 
 """
     Perormance Visualization
     -------------------------
 """
 
-spx_d_df['Date'] = pd.to_datetime(spx_d_df['Date'], format='%Y%m%d')
 
+BENCHMARK_COLOR = '#636efa'
+STRATEGY_COLOR = 'red'
 
-def create_performance_graph(equity_df):
-    equity_df['Date'] = pd.to_datetime(
-        equity_df['Date'], format='%Y%m%d')
 
-    # Lime chart with plotlhy express
-    performance_graph = px.line(spx_d_df, x='Date', y='Equity',
-                                title='Performance Comparison', log_y=True)
+def _equity_trace(series: pd.Series, name: str, color: str) -> go.Scatter:
+    return go.Scatter(x=series.index, y=series.to_numpy(), mode='lines', name=name,
+                      line={'color': color}, showlegend=False)
 
-    performance_graph.add_trace(px.line(equity_df, x='Date', y='Equity',
-                                        color_discrete_sequence=['red'], log_y=True).data[0])
 
-    return performance_graph
+@lru_cache(maxsize=None)
+def _benchmark_trace() -> go.Scatter:
+    """The SPX overview trace, built once and shared by every figure"""
+    return _equity_trace(spx_levels()['overview'], 'Benchmark', BENCHMARK_COLOR)
+
 
+def create_performance_graph(equity_levels: dict, uirevision: str = None) -> go.Figure:
+    """Line chart of the benchmark and strategy overviews on a log axis
+
+    Parameters
+    ----------
+    equity_levels : (dict) multi-resolution store of the strategy (see downsampling.resolution_levels)
+    uirevision : (str) the zoom is kept across updates with the same uirevision
+    """
+
+    performance_graph = go.Figure(
+        data=[_benchmark_trace(), _equity_trace(
+            equity_levels['overview'], 'Strategy', STRATEGY_COLOR)],
+        layout={
+            'title': 'Performance Comparison',
+            'xaxis': {'title': 'Date'},
+            'yaxis': {'title': 'Equity', 'type': 'log'},
+            'uirevision': uirevision
+        }
+    )
+
+    return performance_graph
 
-initial_performance_graph = create_performance_graph(equity_df)
 
 """
     Performance Statics Table
@@ -118,22 +181,6 @@ table_header = [
         "Strategy Performance"), html.Th("Benchmark Performance")]))
 ]
 
-statistics = [
-    'Overall Return',
-    'CAGR',
-    'Standard Deviation',
-    'Downside Deviation',
-    'Sharpe Ratio',
-    # 'Sortino Ratio',
-    'Max Drawdown',
-    'Worst Month Return',
-    'Best Month Return',
-    'Profitable Months'
-]
-
-table_body = [html.Tbody(
-    [html.Tr([html.Td(statistic), html.Td(equity_stats[statistic]), html.Td(spx_stats[statistic])]) for statistic in statistics])]
-
 
 def create_stats_table(equity_stats):
 
@@ -143,7 +190,7 @@ def create_stats_table(equity_stats):
         'Standard Deviation',
         'Downside Deviation',
         'Sharpe Ratio',
-        # 'Sortino Ratio',
+        'Sortino Ratio',
         'Max Drawdown',
         'Worst Month Return',
         'Best Month Return',
@@ -151,11 +198,8 @@ def create_stats_table(equity_stats):
     ]
 
     table_body = [html.Tbody(
-        [html.Tr([html.Td(statistic), html.Td(equity_stats[statistic]), html.Td(spx_stats[statistic])]) for statistic in statistics])]
+        [html.Tr([html.Td(statistic), html.Td(equity_stats[statistic]), html.Td(_spx_statistics()[statistic])]) for statistic in statistics])]
 
     stats_table = dbc.Table(table_header + table_body, bordered=True)
 
     return stats_table
-
-
-initial_stats_table = create_stats_table(equity_stats)
@@ -0,0 +1,137 @@
+import pandas as pd
+import re
+import sqlite3
+from components.utils import _compute_statistics, _format_statistics, _risk_free_rates
+from components.const import INTIAL_CAPITAL, DATABASE_PATH
+from backtester_logic.utils import STATISTICS_TABLE, PARAMETER_COLUMNS
+
+METRIC_COLUMNS = [
+    'Overall Return',
+    'CAGR',
+    'Standard Deviation',
+    'Downside Deviation',
+    'Sharpe Ratio',
+    'Sortino Ratio',
+    'Max Drawdown',
+    'Worst Month Return',
+    'Best Month Return',
+    'Profitable Months'
+]
+
+_EQUITY_TABLE_PATTERN = re.compile(
+    r'^equity_lw(\d+)_lb(\d+)_reb(\d+)_fh(\d+)$')
+
+
+def _create_statistics_table(connector: sqlite3.Connection) -> None:
+
+    metric_columns = ",\n".join(
+        f'"{column}" REAL' for column in METRIC_COLUMNS)
+
+    with connector:
+        connector.execute(f"""CREATE TABLE IF NOT EXISTS {STATISTICS_TABLE} (
+            look_back INTEGER NOT NULL,
+            lottery_window INTEGER NOT NULL,
+            rebalance INTEGER NOT NULL,
+            firms_held INTEGER NOT NULL,
+            starting_capital REAL NOT NULL,
+            {metric_columns},
+            PRIMARY KEY (look_back, lottery_window, rebalance, firms_held)
+            )""")
+
+
+def _equity_tables(connector: sqlite3.Connection) -> dict:
+    """Returns {(look_back, lottery_window, rebalance, firms_held): table_name} of every equity_* table"""
+
+    tables = {}
+    for (table_name,) in connector.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+        match = _EQUITY_TABLE_PATTERN.match(table_name)
+        if match:
+            lottery_window, look_back, rebalance, firms_held = map(
+                int, match.groups())
+            tables[(look_back, lottery_window, rebalance, firms_held)] = table_name
+
+    return tables
+
+
+def materialize_statistics(connector: sqlite3.Connection, starting_capital: int = INTIAL_CAPITAL, overwrite: bool = False) -> int:
+    """Stores the raw statistics of every equity_* table in the strategy_stats table
+
+    Run after the sweep (python -m components.strategy_stats from the repository root).
+    The sweep deletes the row of every equity table it rewrites, so by default only tables
+    without a row are computed. The risk free rates are read from connector's database too.
+
+    Parameters
+    ----------
+    connector : (sqlite3.Connection) connection to the stock database
+    starting_capital : (int) capital the equity curves started with
+    overwrite : (bool) recompute every table, not only the missing ones
+
+    Returns
+    --------
+    computed : (int) number of rows written
+    """
+
+    _create_statistics_table(connector)
+
+    stored = set() if overwrite else set(connector.execute(
+        f"SELECT {', '.join(PARAMETER_COLUMNS)} FROM {STATISTICS_TABLE} WHERE starting_capital = ?",
+        (starting_capital,)).fetchall())
+
+    rows = []
+    risk_free_rates = None
+    for parameters, table_name in sorted(_equity_tables(connector).items()):
+        if parameters in stored:
+            continue
+
+        equity_df = pd.read_sql(f'SELECT * FROM "{table_name}"', con=connector)
+        if equity_df.empty:
+            continue
+
+        if risk_free_rates is None:
+            risk_free_rates = _risk_free_rates(connector)
+        statistics = _compute_statistics(
+            equity_df, starting_capital, risk_free_rates=risk_free_rates)
+        rows.append((*parameters, starting_capital,
+                    *(float(statistics[column]) for column in METRIC_COLUMNS)))
+
+    metric_columns = ", ".join(f'"{column}"' for column in METRIC_COLUMNS)
+    with connector:
+        connector.executemany(
+            f"""INSERT OR REPLACE INTO {STATISTICS_TABLE} ({', '.join(PARAMETER_COLUMNS)}, starting_capital, {metric_columns})
+            VALUES ({', '.join('?' * (len(PARAMETER_COLUMNS) + 1 + len(METRIC_COLUMNS)))})""",
+            rows)
+
+    return len(rows)
+
+
+def load_statistics(connector: sqlite3.Connection, look_back, lottery_window, rebalance, firms_held, starting_capital: int = INTIAL_CAPITAL) -> dict:
+    """Returns the stored raw statistics of a strategy, None when they have not been materialized"""
+
+    try:
+        row = connector.execute(
+            f"""SELECT {', '.join(f'"{column}"' for column in METRIC_COLUMNS)} FROM {STATISTICS_TABLE}
+            WHERE look_back = ? AND lottery_window = ? AND rebalance = ? AND firms_held = ? AND starting_capital = ?""",
+            (int(look_back), int(lottery_window), int(rebalance), int(firms_held), starting_capital)).fetchone()
+    except sqlite3.OperationalError:
+        # strategy_stats has not been created yet
+        return None
+
+    return None if row is None else dict(zip(METRIC_COLUMNS, row))
+
+
+def strategy_statistics(connector: sqlite3.Connection, equity_df: pd.DataFrame, look_back, lottery_window, rebalance, firms_held) -> dict:
+    """Returns the formatted statistics of a strategy, computed from equity_df only when they are not stored"""
+
+    statistics = load_statistics(
+        connector, look_back, lottery_window, rebalance, firms_held)
+    if statistics is None:
+        statistics = _compute_statistics(equity_df, INTIAL_CAPITAL)
+
+    return _format_statistics(statistics)
+
+
+if __name__ == '__main__':
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.execute("PRAGMA journal_mode = WAL")
+    print(f"{materialize_statistics(conn)} strategies added to {STATISTICS_TABLE}")
+    conn.close()
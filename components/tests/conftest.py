@@ -0,0 +1,15 @@
+"""Shared setup of the components tests
+
+components is imported as a package from the repository root, which goes on the path before
+any test module imports it.
+
+    python -m pytest components/tests
+"""
+
+import os
+import sys
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))))
+if REPOSITORY_PATH not in sys.path:
+    sys.path.insert(0, REPOSITORY_PATH)
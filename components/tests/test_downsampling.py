@@ -0,0 +1,88 @@
+"""LTTB downsampling against the reference loop of Steinarsson's Largest-Triangle-Three-Buckets"""
+
+import math
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.downsampling import lttb, resolution_levels, visible_series
+
+
+def loop_lttb(x, y, threshold):
+    """The reference implementation, one point at a time, as positions of the kept points"""
+
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return list(range(length))
+
+    every = (length - 2) / (threshold - 2)
+    kept = 0
+    indices = [0]
+    for bucket in range(threshold - 2):
+        next_start = math.floor((bucket + 1) * every) + 1
+        next_end = min(math.floor((bucket + 2) * every) + 1, length)
+        next_x = sum(x[next_start:next_end]) / (next_end - next_start)
+        next_y = sum(y[next_start:next_end]) / (next_end - next_start)
+
+        start = math.floor(bucket * every) + 1
+        end = math.floor((bucket + 1) * every) + 1
+        max_area, max_row = -1.0, start
+        for row in range(start, end):
+            area = abs((x[kept] - next_x) * (y[row] - y[kept]) -
+                       (x[kept] - x[row]) * (next_y - y[kept]))
+            if area > max_area:
+                max_area, max_row = area, row
+        kept = max_row
+        indices.append(kept)
+
+    indices.append(length - 1)
+    return indices
+
+
+def _random_walk(seed, length):
+    rng = np.random.default_rng(seed)
+    # Irregular spacing, as trading days with weekends and holidays
+    x = np.cumsum(rng.choice([1.0, 1.0, 1.0, 3.0, 4.0], length))
+    y = np.cumsum(rng.normal(0, 1, length))
+    return x, y
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('length, threshold', [(10, 3), (100, 7), (1_000, 100), (1_000, 333),
+                                               (5_003, 2_000), (7_919, 500), (50, 50), (50, 2)])
+def test_lttb_matches_loop(seed, length, threshold):
+    x, y = _random_walk(seed, length)
+    indices = lttb(x, y, threshold)
+
+    assert indices.tolist() == loop_lttb(x.tolist(), y.tolist(), threshold)
+    assert np.all(np.diff(indices) > 0)
+
+
+@pytest.fixture
+def levels():
+    rng = np.random.default_rng(3)
+    dates = pd.bdate_range('1990-01-01', '2019-12-31')
+    equity = 10_000 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, len(dates))))
+    return resolution_levels(pd.DataFrame({'Date': dates.strftime('%Y%m%d').astype(int), 'Equity': equity}),
+                             max_points=500)
+
+
+def test_overview_is_lttb_of_log_equity(levels):
+    daily = levels['daily']
+    x = ((daily.index - daily.index[0]) / pd.Timedelta(days=1)).to_numpy(dtype=np.float64)
+
+    expected = loop_lttb(x.tolist(), np.log(daily.to_numpy()).tolist(), 500)
+    assert levels['overview'].index.equals(daily.index[expected])
+
+
+def test_visible_series_keeps_the_range_edges(levels):
+    daily = levels['daily']
+
+    # Both edges fall on a Saturday, the Friday before and the Monday after are drawn
+    narrow = visible_series(levels, '2001-03-10', '2002-01-12', max_points=500)
+    assert narrow.equals(daily['2001-03-09':'2002-01-14'])
+
+    # Twenty years are drawn from the weekly closes, which are dated on Sundays
+    wide = visible_series(levels, '1995-06-03', '2015-06-06', max_points=500)
+    assert len(wide) == 500
+    assert wide.index[0] == pd.Timestamp('1995-05-28') and wide.index[-1] == pd.Timestamp('2015-06-07')
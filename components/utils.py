@@ -1,132 +1,133 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime
 import sqlite3
-from components.const import DATABASE_PATH
+from functools import lru_cache
+from components.db import get_connection
+from components.const import RISK_FREE_CACHE_SIZE
 
-conn = sqlite3.connect(DATABASE_PATH)
+_risk_free_cache = {}
 
 
-def _overall_return(equity_timeseries: pd.DataFrame, starting_capital: int):
-    """Return the overall return generated by the strategy"""
-    return (equity_timeseries['Equity'].iloc[-1] / starting_capital) - 1
+def _risk_free_rates(connector: sqlite3.Connection = None) -> pd.Series:
+    """Returns the 3 month treasury bill rate (TB3MS) indexed by date
 
+    Read from connector's database, by default from the website's database on first use only
+    """
 
-def _cagr(equity_timeseries: pd.DataFrame, starting_capital: int) -> float:
-    """Returns the """
-    start_date = datetime.strptime(
-        str(equity_timeseries['Date'].iloc[0]), '%Y%m%d')
-    end_date = datetime.strptime(
-        str(equity_timeseries['Date'].iloc[-1]), '%Y%m%d')
-    time_difference = end_date - start_date
+    if connector is None:
+        if 'TB3MS' not in _risk_free_cache:
+            _risk_free_cache['TB3MS'] = _risk_free_rates(get_connection())
+        return _risk_free_cache['TB3MS']
 
-    periods = time_difference.days / 365.25  # Accounting for leap years
-
-    return (equity_timeseries['Equity'].iloc[-1] / starting_capital) ** (1 / periods) - 1
-
-
-def _std(equity_timeseries: pd.DataFrame) -> float:
-    """Returns the standard deviation of the timeseries"""
-    returns = equity_timeseries['Equity'].pct_change()
-
-    return returns.std()
-
-
-def _downside_deviation(equity_timeseries: pd.DataFrame, minimum_threshold: int = 0) -> float:
-    """Returns the downside deviation (measure of downside risk that focuses on returns that fall 
-    below a minimum threshold or minimum acceptable return) of equity timeseries """
-    returns = equity_timeseries['Equity'].pct_change()
-    downside_returns = returns[returns < minimum_threshold]
-
-    squared_deviations = (downside_returns - minimum_threshold) ** 2
-
-    return np.sqrt(squared_deviations.mean())
+    risk_free_rates = pd.read_sql('SELECT * FROM TB3MS', con=connector)
+    risk_free_rates['Date'] = pd.to_datetime(risk_free_rates['Date'])
+    return risk_free_rates.set_index('Date')['Rate']
 
 
-def _sharpe_ratio(equity_timeseries: pd.DataFrame) -> float:
-    """Returns annualized sharpe ratio for a daily time series dataframe"""
+def _daily_risk_free_rate(dates: pd.DatetimeIndex, risk_free_rates: pd.Series = None) -> np.ndarray:
+    """Returns the daily risk free rate on each trading day
 
-    portfolio_data = equity_timeseries.copy()
+    Rates are carried forward from the latest monthly observation, the first day uses the first observation.
+    Without risk_free_rates the website's rates are used and the result is cached per trading calendar.
+    """
 
-    portfolio_data['Date'] = pd.to_datetime(
-        portfolio_data['Date'], format='%Y%m%d')
-    portfolio_data['Daily_Return'] = portfolio_data['Equity'].pct_change()
+    if risk_free_rates is None:
+        return _calendar_risk_free_rate(dates.asi8.tobytes())
 
-    risk_free_rates = pd.read_sql('SELECT * FROM TB3MS', con=conn)
-    risk_free_rates['Date'] = pd.to_datetime(risk_free_rates['Date'])
+    rates = risk_free_rates.reindex(dates)
+    rates.iloc[0] = risk_free_rates.iloc[0]
+    rates = rates.ffill().to_numpy()
 
-    merged_data = pd.merge(
-        portfolio_data, risk_free_rates, on='Date', how='left')
-    merged_data.loc[0, 'Rate'] = risk_free_rates.loc[0, 'Rate']
-    merged_data = merged_data.ffill()
     # convert the rates into daily
-    merged_data['Daily_Rate'] = (
-        1 + (merged_data['Rate'] / 100) / 365) ** (1/91) - 1
-
-    merged_data['Excess_Return'] = portfolio_data['Daily_Return'] - \
-        merged_data['Daily_Rate']
-
-    # annualizing sharpe ratio
-    return (merged_data['Excess_Return'].mean() / merged_data['Excess_Return'].std()) * (252 ** 0.5)
+    return (1 + (rates / 100) / 365) ** (1/91) - 1
 
 
-def _max_drawdown(equity_timeseries: pd.DataFrame) -> float:
-    """Returns the worst drawdown in the equity timeseries"""
+@lru_cache(maxsize=RISK_FREE_CACHE_SIZE)
+def _calendar_risk_free_rate(calendar: bytes) -> np.ndarray:
+    """_daily_risk_free_rate of the calendar given as the bytes of its datetime64[ns] dates, which
+    only compare equal for identical calendars"""
 
-    rolling_max = equity_timeseries['Equity'].cummax()
+    daily_rates = _daily_risk_free_rate(pd.DatetimeIndex(
+        np.frombuffer(calendar, dtype='datetime64[ns]')), _risk_free_rates())
+    # Shared by every caller with this calendar
+    daily_rates.setflags(write=False)
+    return daily_rates
 
-    drawdown = (equity_timeseries['Equity'] -
-                rolling_max) / rolling_max
 
-    return drawdown.min()
+def _compute_statistics(equity_timeseries: pd.DataFrame, starting_capital: int, risk_free_rates: pd.Series = None) -> dict:
+    """Returns the raw (unformatted) performance statistics of an equity timeseries
 
+    The dates are parsed once and the daily and monthly returns are computed once, every 
+    statistic is derived from those shared series. risk_free_rates (see _risk_free_rates)
+    default to the website database's.
+    """
 
-def _extreme_month_return(equity_timeseries: pd.DataFrame) -> dict:
-    """Calculates the extreme month returns (best and worst)"""
-    data = equity_timeseries.copy()
-    data['Date'] = pd.to_datetime(data['Date'], format='%Y%m%d')
-    data.set_index('Date', inplace=True)
+    dates = pd.DatetimeIndex(pd.to_datetime(
+        equity_timeseries['Date'].astype(str), format='%Y%m%d'))
+    equity = pd.Series(
+        equity_timeseries['Equity'].to_numpy(dtype=np.float64), index=dates)
 
+    daily_returns = equity.pct_change()
     # Calculate the monthly percentage change based on closing prices
-    monthly_returns = data['Equity'].resample('M').last().pct_change()
+    monthly_returns = equity.resample('ME').last().pct_change()
+
+    # Overall return and CAGR
+    overall_return = (equity.iloc[-1] / starting_capital) - 1
+    periods = (dates[-1] - dates[0]).days / 365.25  # Accounting for leap years
+    cagr = (equity.iloc[-1] / starting_capital) ** (1 / periods) - 1
+
+    # Downside deviation, measure of downside risk that focuses on returns that fall below a minimum threshold
+    minimum_threshold = 0
+    downside_returns = daily_returns[daily_returns < minimum_threshold]
+    downside_deviation = np.sqrt(
+        ((downside_returns - minimum_threshold) ** 2).mean())
+
+    # annualizing sharpe and sortino ratios on excess returns
+    excess_returns = daily_returns - _daily_risk_free_rate(dates, risk_free_rates)
+    sharpe_ratio = (excess_returns.mean() /
+                    excess_returns.std()) * (252 ** 0.5)
+    sortino_ratio = (excess_returns.mean() /
+                     downside_deviation) * (252 ** 0.5)
+
+    # Worst drawdown in the equity timeseries
+    rolling_max = equity.cummax()
+    max_drawdown = ((equity - rolling_max) / rolling_max).min()
 
-    return {'best': monthly_returns.max(), 'worst': monthly_returns.min()}
-
-
-def _profitable_months(equity_timeseries: pd.DataFrame) -> float:
-    data = equity_timeseries.copy()  # Replace with your file path
-    data['Date'] = pd.to_datetime(data['Date'], format='%Y%m%d')
-    data.set_index('Date', inplace=True)
-
-    # Calculate the monthly percentage change based on closing prices
-    monthly_returns = data['Equity'].resample('M').last().pct_change()
+    return {
+        'Overall Return': overall_return,
+        'CAGR': cagr,
+        'Standard Deviation': daily_returns.std(),
+        'Downside Deviation': downside_deviation,
+        'Sharpe Ratio': sharpe_ratio,
+        'Sortino Ratio': sortino_ratio,
+        'Max Drawdown': max_drawdown,
+        'Worst Month Return': monthly_returns.min(),
+        'Best Month Return': monthly_returns.max(),
+        'Profitable Months': (monthly_returns > 0).sum() / len(monthly_returns)
+    }
 
-    # Count the number of profitable months (positive percentage change)
-    profitable_months = (monthly_returns > 0).sum()
 
-    # Calculate the total number of months
-    total_months = len(monthly_returns)
+def _format_statistics(statistics: dict) -> dict:
+    """Formats raw statistics for the performance table"""
 
-    # Calculate the percentage of profitable months
-    return (profitable_months / total_months)
+    return {
+        'Overall Return': f"{round(statistics['Overall Return'] * 100, 2):,} %",
+        'CAGR': f"{round(statistics['CAGR']*100, 2)} %",
+        'Standard Deviation': f"{round(statistics['Standard Deviation'] * 100, 2)} %",
+        'Downside Deviation': f"{round(statistics['Downside Deviation'] * 100, 2)}%",
+        'Sharpe Ratio': round(statistics['Sharpe Ratio'], 2),
+        'Sortino Ratio': round(statistics['Sortino Ratio'], 2),
+        'Max Drawdown': f"{round(statistics['Max Drawdown'] * 100, 2)}%",
+        'Worst Month Return': f"{round(statistics['Worst Month Return'] * 100, 2)} %",
+        'Best Month Return': f"{round(statistics['Best Month Return'] * 100, 2)} %",
+        'Profitable Months': f"{round(statistics['Profitable Months'] * 100, 2)} %"
+    }
 
 
 def _get_statistics(equity_timeseries: pd.DataFrame, starting_capital: int) -> dict:
     """Returns relevant statistics"""
 
-    extreme_month_returns = _extreme_month_return(equity_timeseries)
-
-    return {
-        'Overall Return': f"{round(_overall_return(equity_timeseries, starting_capital) * 100, 2):,} %",
-        'CAGR': f"{round(_cagr(equity_timeseries, starting_capital)*100, 2)} %",
-        'Standard Deviation': f"{round(_std(equity_timeseries) * 100, 2)} %",
-        'Downside Deviation': f"{round(_downside_deviation(equity_timeseries) * 100, 2)}%",
-        'Sharpe Ratio': round(_sharpe_ratio(equity_timeseries), 2),
-        'Max Drawdown': f"{round(_max_drawdown(equity_timeseries) * 100, 2)}%",
-        'Worst Month Return': f"{round(extreme_month_returns['worst'] * 100, 2)} %",
-        'Best Month Return': f"{round(extreme_month_returns['best'] * 100, 2)} %",
-        'Profitable Months': f"{round(_profitable_months(equity_timeseries) * 100, 2)} %"
-    }
+    return _format_statistics(_compute_statistics(equity_timeseries, starting_capital))
 
 
 def _strategy_table_convention(look_back, lottery_window, rebalance, firms_held):
@@ -1,12 +1,11 @@
-from dash import html, dcc, callback, Input, Output, State
+from dash import html, dcc, callback, ctx, no_update, Input, Output, State, Patch
 import dash
 import dash_bootstrap_components as dbc
-import pandas as pd
-import sqlite3
 
-from components.strategy_page_components import content_explanation, initial_stats_table, initial_performance_graph, create_stats_table, create_performance_graph
-from components.utils import _get_statistics, _strategy_table_convention
-from components.const import INTIAL_CAPITAL, DATABASE_PATH
+from components.strategy_page_components import content_explanation
+from components.result_cache import performance_results, visible_equity, strategy_exists
+from components.jobs import backtest_jobs
+from components.const import DEFAULT_STRATEGY
 
 dash.register_page(__name__)
 
@@ -15,80 +14,203 @@ dash.register_page(__name__)
     App Layout
     ----------
 """
-layout = html.Div([
 
-    # Header
-    html.Div(
-        html.H1(children="Strategy Backtest Results",
+
+def layout():
+    """Built on each page load, the default strategy is rendered on first use and then served from the result cache"""
+
+    initial_performance_graph, initial_stats_table = performance_results(
+        **DEFAULT_STRATEGY)
+
+    return html.Div([
+
+        # Parameters of the strategy currently drawn, used to reload its points on zoom
+        dcc.Store(id='displayed_strategy', data=DEFAULT_STRATEGY),
+
+        # On-demand backtest being waited on and the timer polling its progress
+        dcc.Store(id='backtest_job_id'),
+        dcc.Interval(id='backtest_poll', interval=1000, disabled=True),
+
+        # Header
+        html.Div(
+            html.H1(children="Strategy Backtest Results",
+                    style={
+                        'textAlign': 'center',
+                        'margin': '25px'})
+        ),
+
+        # Body
+        html.Div([
+            # Wrapper
+            dbc.Row(
+                [
+
+                    # Cards explaining website purpose, etc
+                    dbc.Col(content_explanation()),
+
+
+                    dbc.Col([
+                        # Graph
+                        dbc.Row(
+                            [dcc.Graph(id='performance_graph',
+                                       figure=initial_performance_graph)],
+                            style={'margin': '25px'},
+                            id='performance_graph_row'
+                        ),
+
+                        # Statistics Card
+                        dbc.Row(
+                            [dbc.Card(
+                                dbc.CardBody(
+                                    id='stats_table',
+                                    children=initial_stats_table
+                                ),
+                                id='stats_card'
+                            )],
+                            style={'margin': '25px'}
+                        )
+                    ])
+                ],
+
                 style={
-                    'textAlign': 'center',
-                    'margin': '25px'})
-    ),
-
-    # Body
-    html.Div([
-        # Wrapper
-        dbc.Row(
-            [
-
-                # Cards explaining website purpose, etc
-                dbc.Col(content_explanation),
-
-
-                dbc.Col([
-                    # Graph
-                    dbc.Row(
-                        [dcc.Graph(id='performance_graph',
-                                   figure=initial_performance_graph)],
-                        style={'margin': '25px'},
-                        id='performance_graph_row'
-                    ),
-
-                    # Statistics Card
-                    dbc.Row(
-                        [dbc.Card(
-                            dbc.CardBody(
-                                id='stats_table',
-                                children=initial_stats_table
-                            ),
-                            id='stats_card'
-                        )],
-                        style={'margin': '25px'}
-                    )
-                ])
-            ],
-
-            style={
-                'margin': '50px'
-            }
-        )
+                    'margin': '50px'
+                }
+            )
+        ])
+
     ])
 
-])
+
+def _relayout_range(relayout_data: dict):
+    """Returns the (start, end) x axis range of a relayout event, (None, None) when the axis was reset
+    and None when the x axis did not change"""
+
+    if 'xaxis.range[0]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'])
+    if relayout_data.get('xaxis.autorange'):
+        return None, None
+    return None
+
+
+def _job_display(status: dict) -> tuple:
+    """Returns the (card style, status text, progress value) shown for an on-demand backtest"""
+
+    messages = {
+        'queued': "Backtest queued",
+        'running': "Computing momentum features" if status['stage'] == 'features' else "Backtesting",
+        'cancelling': "Cancelling backtest",
+        'done': "Backtest finished",
+        'cancelled': "Backtest cancelled",
+        'failed': f"Backtest failed: {status['error']}",
+        'unknown': "Backtest not found",
+    }
+
+    return {'display': 'block'}, messages[status['state']], round(status['progress'] * 100)
 
 
 @callback(
     Output(component_id='performance_graph', component_property='figure'),
     Output(component_id='stats_table', component_property='children'),
+    Output(component_id='displayed_strategy', component_property='data'),
+    Output(component_id='backtest_job', component_property='style'),
+    Output(component_id='backtest_status', component_property='children'),
+    Output(component_id='backtest_progress', component_property='value'),
+    Output(component_id='backtest_job_id', component_property='data'),
+    Output(component_id='backtest_poll', component_property='disabled'),
     Input(component_id='strategy_button', component_property='n_clicks'),
+    Input(component_id='performance_graph', component_property='relayoutData'),
     State(component_id='look_back', component_property='value'),
     State(component_id='lottery_window', component_property='value'),
     State(component_id='rebalnce_period', component_property='value'),
-    State(component_id='firms_held', component_property='value')
+    State(component_id='firms_held', component_property='value'),
+    State(component_id='custom_look_back', component_property='value'),
+    State(component_id='custom_lottery_window', component_property='value'),
+    State(component_id='custom_rebalance_period', component_property='value'),
+    State(component_id='custom_firms_held', component_property='value'),
+    State(component_id='displayed_strategy', component_property='data'),
+    prevent_initial_call=True
 )
-def update_performance(n_clicks, look_back, lottery_window, rebalnce_period, firms_held):
-    conn = sqlite3.connect(DATABASE_PATH)
-
-    equity_df = pd.read_sql(
-        f"""SELECT * FROM {_strategy_table_convention(
-            look_back=look_back,
-            lottery_window=lottery_window,
-            rebalance=rebalnce_period,
-            firms_held=firms_held
-        )}""",
-        con=conn
-    )
-
-    equity_stats = _get_statistics(equity_df, INTIAL_CAPITAL)
-
-    return create_performance_graph(equity_df), create_stats_table(equity_stats)
+def update_performance(n_clicks, relayout_data, look_back, lottery_window, rebalnce_period, firms_held,
+                       custom_look_back, custom_lottery_window, custom_rebalance_period, custom_firms_held, displayed_strategy):
+    if ctx.triggered_id == 'strategy_button':
+        # Custom values replace the selected ones
+        strategy = {
+            'look_back': custom_look_back or look_back,
+            'lottery_window': custom_lottery_window or lottery_window,
+            'rebalance': custom_rebalance_period or rebalnce_period,
+            'firms_held': custom_firms_held or firms_held
+        }
+        if any(value is None or int(value) < 1 for value in strategy.values()):
+            return (no_update, no_update, no_update, {'display': 'block'},
+                    "Choose all four parameters", 0, no_update, True)
+        strategy = {name: int(value) for name, value in strategy.items()}
+
+        if strategy_exists(**strategy):
+            performance_graph, stats_table = performance_results(**strategy)
+            return performance_graph, stats_table, strategy, {'display': 'none'}, None, 0, None, True
+
+        # Not materialized yet, backtest it in the background and poll until it is written
+        job_id = backtest_jobs().submit(**strategy)
+        style, status_text, progress = _job_display(
+            backtest_jobs().status(job_id))
+        return (no_update, no_update, no_update, style, status_text, progress,
+                {'job_id': job_id, 'strategy': strategy}, False)
+
+    # Zoom or pan, only the points of the traces are sent back
+    x_range = _relayout_range(relayout_data or {})
+    if x_range is None:
+        return (no_update,) * 8
+
+    benchmark, strategy = visible_equity(**displayed_strategy,
+                                         start=x_range[0], end=x_range[1])
+
+    performance_graph = Patch()
+    for trace, series in enumerate((benchmark, strategy)):
+        performance_graph['data'][trace]['x'] = series.index
+        performance_graph['data'][trace]['y'] = series.to_numpy()
+
+    return (performance_graph,) + (no_update,) * 7
+
+
+@callback(
+    Output(component_id='performance_graph', component_property='figure', allow_duplicate=True),
+    Output(component_id='stats_table', component_property='children', allow_duplicate=True),
+    Output(component_id='displayed_strategy', component_property='data', allow_duplicate=True),
+    Output(component_id='backtest_job', component_property='style', allow_duplicate=True),
+    Output(component_id='backtest_status', component_property='children', allow_duplicate=True),
+    Output(component_id='backtest_progress', component_property='value', allow_duplicate=True),
+    Output(component_id='backtest_poll', component_property='disabled', allow_duplicate=True),
+    Input(component_id='backtest_poll', component_property='n_intervals'),
+    State(component_id='backtest_job_id', component_property='data'),
+    prevent_initial_call=True
+)
+def poll_backtest(n_intervals, backtest_job):
+    if not backtest_job:
+        return (no_update,) * 6 + (True,)
+
+    status = backtest_jobs().status(backtest_job['job_id'])
+    style, status_text, progress = _job_display(status)
+
+    if status['state'] == 'done':
+        performance_graph, stats_table = performance_results(
+            **backtest_job['strategy'])
+        return performance_graph, stats_table, backtest_job['strategy'], style, status_text, progress, True
+
+    # Stop polling once the job can no longer finish
+    finished = status['state'] in ('failed', 'cancelled', 'unknown')
+    return no_update, no_update, no_update, style, status_text, progress, finished
+
+
+@callback(
+    Output(component_id='backtest_status', component_property='children', allow_duplicate=True),
+    Input(component_id='cancel_backtest', component_property='n_clicks'),
+    State(component_id='backtest_job_id', component_property='data'),
+    prevent_initial_call=True
+)
+def cancel_backtest(n_clicks, backtest_job):
+    if not backtest_job or not backtest_jobs().cancel(backtest_job['job_id']):
+        return no_update
+
+    return "Cancelling backtest"